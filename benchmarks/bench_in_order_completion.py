@@ -0,0 +1,54 @@
+'''Times set_apogee_priorities.in_order_completion against the per-plate loop it replaced,
+on synthetic plates (n/8 locations, 4 cohorts), and checks both give the same priorities.
+
+    python benchmarks/bench_in_order_completion.py [--sizes 1000,10000,50000] [--max-old 10000]
+'''
+from __future__ import print_function, division
+import argparse
+
+import numpy as np
+
+from benchutil import best_time, report
+from autoscheduler.apogee.set_apogee_priorities import in_order_completion
+
+
+class Plate(object):
+    def __init__(self, locationid, apgver, priority):
+        self.locationid = locationid
+        self.apgver = apgver
+        self.priority = priority
+
+
+def loop_in_order_completion(apg):
+    '''The in-order completion pass of set_priorities before in_order_completion.'''
+    for p in range(len(apg)):
+        wfield = [x for x in range(len(apg)) if apg[x].locationid == apg[p].locationid]
+        for f in wfield:
+            if apg[p].apgver > apg[f].apgver and apg[f].priority > 1:
+                apg[p].priority /= 2
+    return np.array([p.priority for p in apg])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--max-old', type=int, default=10000, help='largest size to run the old loop on')
+    args = parser.parse_args()
+
+    for n in [int(x) for x in args.sizes.split(',')]:
+        rng = np.random.RandomState(0)
+        locationid = rng.randint(0, max(1, n // 8), n)
+        apgver = rng.choice([1, 2, 3, 11], n)
+        priority = rng.uniform(-1, 300, n)
+        new, result = best_time(lambda: in_order_completion(locationid, apgver, priority))
+        if n > args.max_old:
+            report(n, new)
+            continue
+        apg = [Plate(l, v, p) for l, v, p in zip(locationid, apgver, priority)]
+        old, expected = best_time(lambda: loop_in_order_completion(apg), repeat=1)
+        assert np.array_equal(result, expected), 'in_order_completion differs from the loop'
+        report(n, new, old)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+'''Times idlasl.moonpos on scalar and array JDs. With --baseline, also times moonpos from
+that git revision (e.g. the per-epoch loop before it was vectorized) and checks both give
+the same positions.
+
+    python benchmarks/bench_moonpos.py [--sizes 1,100,1000,10000,100000] [--baseline REV]
+'''
+from __future__ import print_function, division
+import argparse
+
+import numpy as np
+
+from benchutil import best_time, load_revision, report
+from autoscheduler.sdssUtilities import idlasl
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,100,1000,10000,100000')
+    parser.add_argument('--baseline', help='git revision to compare against')
+    parser.add_argument('--max-old', type=int, default=10000, help='largest size to run the baseline on')
+    args = parser.parse_args()
+    old = None if args.baseline is None else load_revision('autoscheduler/sdssUtilities/idlasl.py', args.baseline, 'idlasl_baseline')
+
+    rng = np.random.RandomState(1)
+    for n in [int(x) for x in args.sizes.split(',')]:
+        jd = 2457000 + rng.uniform(0, 3000, n)
+        arg = jd[0] if n == 1 else jd
+        repeat = max(3, 1000 // n)
+        new, result = best_time(lambda: idlasl.moonpos(arg), repeat=repeat)
+        if old is None or n > args.max_old:
+            report(n, new)
+            continue
+        base, expected = best_time(lambda: old.moonpos(arg), repeat=repeat)
+        for x, y in zip(result, expected):
+            assert np.array_equal(np.asarray(x), np.asarray(y)), 'moonpos differs from the baseline'
+        report(n, new, base)
+
+
+if __name__ == '__main__':
+    main()
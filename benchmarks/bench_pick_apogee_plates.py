@@ -0,0 +1,66 @@
+'''Times APOGEE pick_plates on synthetic nights (9 slots, a third of the plates stackable,
+n/3 locations). With --baseline, also times pick_plates from that git revision (e.g. the
+version with a full argsort per slot) on the same nights and checks both make the same
+picks and leave the same obs matrix.
+
+    python benchmarks/bench_pick_apogee_plates.py [--sizes 1000,10000,50000,200000] [--baseline REV]
+'''
+from __future__ import print_function, division
+import argparse
+
+import numpy as np
+
+from benchutil import best_time, load_revision, report
+from autoscheduler.apogee import pick_apogee_plates
+
+par = {'exposure': 60, 'overhead': 20}
+schedule = {'dark_start': 0, 'bright_start': 2457000.6}
+
+
+class Plate(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def night(rng, n, nslots=9):
+    nloc = max(1, n // 3)
+    apg = [Plate(plateid=1000 + i, locationid=int(rng.randint(nloc)), apgver=int(rng.randint(3)),
+                 stack=int(rng.rand() < 0.3), coobs=bool(rng.rand() < 0.5)) for i in range(n)]
+    obs = rng.uniform(-3, 300, (n, nslots))
+    obs[rng.rand(n, nslots) < 0.4] = -1
+    times = [2457000.6 + i * 80 / 60 / 24 for i in range(nslots)]
+    lengths = [80 / 60] * nslots
+    return apg, obs, times, lengths
+
+
+def run(module, apg, obs, times, lengths):
+    obs = obs.copy()
+    picks = module.pick_plates(apg, obs, par, list(times), list(lengths), schedule, loud=False)
+    return picks, obs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,50000,200000')
+    parser.add_argument('--baseline', help='git revision to compare against')
+    parser.add_argument('--max-old', type=int, default=50000, help='largest size to run the baseline on')
+    args = parser.parse_args()
+    old = None
+    if args.baseline is not None:
+        old = load_revision('autoscheduler/apogee/pick_apogee_plates.py', args.baseline, 'pick_apogee_plates_baseline')
+
+    rng = np.random.RandomState(5)
+    for n in [int(x) for x in args.sizes.split(',')]:
+        apg, obs, times, lengths = night(rng, n)
+        new, result = best_time(lambda: run(pick_apogee_plates, apg, obs, times, lengths))
+        if old is None or n > args.max_old:
+            report(n, new)
+            continue
+        base, expected = best_time(lambda: run(old, apg, obs, times, lengths))
+        assert result[0] == expected[0], 'pick_plates picks differ from the baseline'
+        assert np.array_equal(result[1], expected[1]), 'pick_plates obs matrix differs from the baseline'
+        report(n, new, base)
+
+
+if __name__ == '__main__':
+    main()
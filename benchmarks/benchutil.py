@@ -0,0 +1,37 @@
+'''Helpers shared by the benchmark scripts.'''
+from __future__ import print_function, division
+import imp
+import os
+import subprocess
+import sys
+from time import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'python'))
+
+
+def load_revision(path, rev, name):
+    '''Imports python/<path> as it was at git revision rev, as module name.'''
+    source = subprocess.check_output(['git', 'show', '{}:python/{}'.format(rev, path)], cwd=root)
+    module = imp.new_module(name)
+    module.__file__ = os.path.join(root, 'python', path)
+    exec(compile(source, module.__file__, 'exec'), module.__dict__)
+    return module
+
+
+def best_time(func, repeat=3):
+    '''Best wall time of repeat calls of func, and the result of the last call.'''
+    best = None
+    for i in range(repeat):
+        start = time()
+        result = func()
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(label, new, old=None):
+    if old is None:
+        print('{:>12}  new {:9.4f} s'.format(label, new))
+    else:
+        print('{:>12}  old {:9.4f} s  new {:9.4f} s  x{:.1f}'.format(label, old, new, old / new))
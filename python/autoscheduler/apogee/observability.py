@@ -1,133 +1,137 @@
 from __future__ import print_function, division
 from time import time
 import numpy as np
-import astropysics.coords as coo
 import astropysics.obstools as obs
-from autoscheduler.sdssUtilities.idlasl import moonpos
+from autoscheduler.ephemeris import sites, ephemeris_for
+from autoscheduler.obs_matrix import LSTWindowIndex, SkyIndex, transit_weight, secz_at, julian_epoch
+from autoscheduler.plateDBtools.apogee.get_apogee_plates import PlateTable
+
+obs_fields = ('priority', 'manual_priority', 'ra', 'dec', 'ha', 'minha', 'maxha', 'exp_time', 'cadence', 'vplan')
+
+
+def plate_columns(apg):
+    '''Collect the plate attributes used for observability into NumPy columns.'''
+    if isinstance(apg, PlateTable):
+        return dict((f, apg.data[f]) for f in obs_fields)
+    return {'priority': np.array([p.priority for p in apg], dtype=float),
+            'manual_priority': np.array([p.manual_priority for p in apg], dtype=int),
+            'ra': np.array([p.ra for p in apg], dtype=float),
+            'dec': np.array([p.dec for p in apg], dtype=float),
+            'ha': np.array([p.ha for p in apg], dtype=float),
+            'minha': np.array([p.minha for p in apg], dtype=float),
+            'maxha': np.array([p.maxha for p in apg], dtype=float),
+            'exp_time': np.array([p.exp_time for p in apg], dtype=float),
+            'cadence': np.array([p.cadence for p in apg], dtype=object),
+            'vplan': np.array([p.vplan for p in apg], dtype=int)}
+
+
+def obs_matrix(cols, par, beglst, endlst, samplst, lengths, moonra, moondec, lat, south=False, equinox=None):
+    '''DESCRIPTION: Computes the APOGEE-II observability matrix with array operations
+    INPUT: cols -- plate columns (see plate_columns)
+           beglst, endlst -- LST at the start/end of each slot [hours]
+           samplst -- (n_slots, n_samples) LSTs at which the airmass is checked
+           lengths -- slot lengths [hours]
+           moonra, moondec -- moon position for each slot [deg]
+           lat -- site latitude [deg]
+           equinox -- equinox of the night [years], to precess the plate centers to
+    OUTPUT: obsarr -- (n_plates, n_slots) priorities, or -1 (outside HA range or missing
+            HA limits), -2 (bad airmass), -3 (too close to the moon)'''
+    lengths = np.asarray(lengths, dtype=float)
+    samplst = np.asarray(samplst, dtype=float)
+    nplates, nslots = len(cols['priority']), len(lengths)
+    active = cols['priority'] > 0
+    manual10 = cols['manual_priority'] == 10
+
+    # Compute observing constants, with a 15 minute buffer for priority 10 plates
+    extra_time = np.where(manual10, 0.25, 0.0)
+    platelst = (cols['ra'] + cols['ha']) / 15
+    minlst = (cols['ra'] + cols['minha']) / 15 - extra_time
+    maxlst = (cols['ra'] + cols['maxha']) / 15 + extra_time
+
+    # Base priority plus Gaussian prioritization on time from transit
+    obsarr = cols['priority'][:, np.newaxis] + transit_weight(platelst, beglst, endlst, lengths)
+
+    # Moon avoidance, then HA range of the block. Only the plates whose LST window covers a
+    # slot are checked against it; inactive plates, which are zeroed below, are skipped, and
+    # plates without HA limits are never within a window.
+    moonbad = np.zeros((nplates, nslots), dtype=bool)
+    moonbad[SkyIndex(cols['ra'], cols['dec']).pairs(moonra, moondec, par['moon_threshold'])] = True
+    plates = np.where(active)[0]
+    pi, si = LSTWindowIndex(minlst[plates], maxlst[plates]).within(minlst[plates], maxlst[plates], beglst, endlst)
+    inside = np.zeros((nplates, nslots), dtype=bool)
+    inside[plates[pi], si] = True
+    habad = ~moonbad & ~inside
+
+    # Check whether any of the sample points contain a bad airmass value, for the plates
+    # and slots that passed the window and moon checks.
+    # Zenith avoidance is ignored in the south and for priority 10 plates in the north.
+    pi, si = np.nonzero(inside & ~moonbad)
+    z = secz_at(cols['ra'][pi, np.newaxis], cols['dec'][pi, np.newaxis], samplst[si], lat,
+                refraction=par.get('refraction', False), equinox=equinox)
+    badz = z > par['maxz']
+    if not south:
+        badz |= (z < 1.003) & ~manual10[pi, np.newaxis]
+    zbad = np.zeros((nplates, nslots), dtype=bool)
+    zbad[pi, si] = badz.any(axis=1)
+    obsarr = np.where(zbad, -2.0, obsarr)
+
+    # Lower the priority of long exposure plates in the last slot
+    longexp = (cols['exp_time'] == 1000.0)[:, np.newaxis]
+    lastslot = (np.arange(nslots) == nslots - 1)[np.newaxis, :]
+    obsarr = np.where(longexp & lastslot, obsarr / 3.0, obsarr)
+
+    # Lower priorities for all plates that aren't vplan == 1 for short slots. The priority order should be:
+    # vpan == 1, vplan > 3, vplan == 3, cadence == kep_koi or substellar, long exposure
+    cadence = cols['cadence']
+    slowcad = ((cadence == 'kep_koi') | (cadence == 'substellar'))[:, np.newaxis]
+    vplan = cols['vplan'][:, np.newaxis]
+    short = (lengths < 1.0)[np.newaxis, :]
+    obsarr = np.where(short & longexp, obsarr / 3.0,
+                      np.where(short & slowcad, obsarr / 2.5,
+                               np.where(short & (vplan == 3), obsarr / 2.0,
+                                        np.where(short & (vplan > 3), obsarr / 1.5, obsarr))))
+
+    obsarr[habad] = -1
+    obsarr[moonbad] = -3
+    obsarr[~active, :] = 0
+    return obsarr
 
 
 def observability(apg, par, times, lengths, loud=True, south=False):
     obs_start = time()
-    if south:
-        obs_site = obs.Site(-29.0182, -70.6915)
-    else:
-        obs_site = obs.Site(32.789278, -105.820278)
-    obsarr = np.zeros([len(apg), len(times)])
-    beglst = [obs_site.localSiderialTime(x) for x in times]
-    endlst = [obs_site.localSiderialTime(times[x] + lengths[x]/24) for x in range(len(times))]
-
-    # Determine moon coordinates
-    mpos = []
-    for t in range(len(times)):
-        mooncoords = moonpos(times[t])
-        mpos.append(coo.ICRSCoordinates(mooncoords[0], mooncoords[1]))
+    site = 'LCO' if south else 'APO'
+    lat, lon = sites[site]
+    obs_site = obs.Site(lat, lon)
+    if len(apg) == 0 or len(times) == 0:
+        return np.zeros([len(apg), len(times)])
+    times = np.asarray(times, dtype=float)
+    lengths = np.asarray(lengths, dtype=float)
+
+    # LSTs and moon coordinates come from tonight's ephemeris
+    eph = ephemeris_for(site, times)
+    beglst = eph.lst_at(times)
+    endlst = eph.lst_at(times + lengths / 24)
+    # Airmass is checked at the start, middle and end of each slot
+    samplst = eph.lst_at(times[:, np.newaxis] + lengths[:, np.newaxis] / 2 / 24 * np.arange(3))
+    moonra, moondec = eph.moon_at(times)
+
+    cols = plate_columns(apg)
+    obsarr = obs_matrix(cols, par, beglst, endlst, samplst, lengths, moonra, moondec, lat, south=south,
+                        equinox=julian_epoch(times[0]))
 
     if loud:
         df = open('apogeeobs.txt', 'w')
-    # Loop over all plates
-    for p in range(len(apg)):
-        # Initalize obsarr row
-        if apg[p].priority <= 0:
-            continue
-        for t in range(len(times)):
-            obsarr[p, t] = apg[p].priority
-
-
-        if apg[p].manual_priority == 10:
-            extra_time = 0.25  # add 15 minute buffer
-        else:
-            extra_time = 0
-        # Compute observing constants
-        platecoo = coo.ICRSCoordinates(apg[p].ra, apg[p].dec)
-        platelst = float(apg[p].ra + apg[p].ha) / 15
-        minlst = float(apg[p].ra + apg[p].minha) / 15 - extra_time
-        maxlst = float(apg[p].ra + apg[p].maxha) / 15 + extra_time
-
-
-        for t in range(len(times)):
-            # Adjust LSTs for 24 hour wrapping
-            usedminlst, usedmaxlst = minlst, maxlst
-            if minlst < 0 and beglst[t] > 12 and endlst[t] > 12:
-                usedminlst += 24
-                usedmaxlst += 24
-            if maxlst > 24 and beglst[t] < 12 and endlst[t] < 12:
-                usedminlst -= 24
-                usedmaxlst -= 24
-            if beglst[t] > endlst[t]:
-                if minlst < 12:
-                    usedminlst += 24
-                if maxlst > 12:
-                    usedmaxlst -= 24
-
-            # Adjust LSTs for Gaussian with 24 hour wrapping
-            if beglst[t] > endlst[t]:
-                lstsum = beglst[t]+endlst[t]-24
-                if platelst > 12:
-                    usedplatelst = platelst - 24
-                else:
-                    usedplatelst = platelst
-            else:
-                lstsum = beglst[t]+endlst[t]
-                if beglst[t] > 18 and platelst < 4:
-                    usedplatelst = platelst + 24
-                elif beglst[t] < 4 and platelst > 18:
-                    usedplatelst = platelst - 24
-                else:
-                    usedplatelst = platelst
-
-            # Gaussian prioritization on time from transit
-            obsarr[p, t] += 50.0 * float(np.exp(-(usedplatelst - lstsum/2 + lengths[t]/2)**2 / 2))
-
-            # Moon avoidance
-            moondist = mpos[t] - platecoo
-            if moondist.d < par['moon_threshold']:
-                obsarr[p, t] = -3
-                continue
-
-            # Determine whether HAs of block are within observational range
-            if beglst[t] < usedminlst or endlst[t] > usedmaxlst:
-                obsarr[p, t] = -1
+        for p in range(len(apg)):
+            if apg[p].priority <= 0:
                 continue
-
-            # Compute horiztonal coordinates
-            horz = obs_site.apparentCoordinates(platecoo, datetime=[times[t] + lengths[t] / 2 / 24 * x for x in range(3)])
-            secz = [1/np.cos((90.0 - horz[x].alt.d) * np.pi / 180) for x in range(len(horz))]
-            # Check whether any of the points contain a bad airmass value
-            if south:
-                badsecz = [x for x in secz if x > par['maxz']]
-            # Check again to ignore zenith avoidance for priority 10 plates in the north
-            elif apg[p].manual_priority == 10:
-                badsecz = [x for x in secz if x > par['maxz']]
-            else:
-                badsecz = [x for x in secz if x < 1.003 or x > par['maxz']]
-            if len(badsecz) > 0:
-                obsarr[p, t] = -2
-
-            # Lower the priority of long exposure plates in the last slot
-            if t == len(times) - 1:
-                if apg[p].exp_time == 1000.0:
-                    obsarr[p, t] = obsarr[p, t] / 3.0
-
-            # Lower priorities for all plates that aren't vplan == 1 for short slots. The priority order should be:
-            # vpan == 1, vplan > 3, vplan == 3, cadence == kep_koi or substellar, long exposure
-            if lengths[t] < 1.0:
-                if apg[p].exp_time == 1000.0:
-                    obsarr[p, t] = obsarr[p, t] / 3.0
-                elif apg[p].cadence == 'kep_koi' or apg[p].cadence == 'substellar':
-                    obsarr[p, t] = obsarr[p, t] / 2.5
-                elif apg[p].vplan == 3:
-                    obsarr[p, t] = obsarr[p, t] / 2.0
-                elif apg[p].vplan > 3:
-                    obsarr[p, t] = obsarr[p, t] / 1.5
-
-        if loud:
+            extra_time = 0.25 if apg[p].manual_priority == 10 else 0
+            minlst = float(apg[p].ra + apg[p].minha) / 15 - extra_time
+            maxlst = float(apg[p].ra + apg[p].maxha) / 15 + extra_time
             print(apg[p].plateid, minlst, maxlst, obs_site.localTime(minlst, utc=True), obs_site.localTime(maxlst, utc=True), obsarr[p, :], file=df)
+        df.close()
 
     obs_end = time()
     if loud:
         print("[PY] Determined APOGEE-II observability (%.3f sec)" % (obs_end - obs_start))
 
-    if loud:
-        df.close()
-
     return obsarr
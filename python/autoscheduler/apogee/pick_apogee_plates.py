@@ -1,26 +1,47 @@
 from __future__ import print_function, division
 from time import time
 import numpy as np
+from autoscheduler.plateDBtools.apogee.get_apogee_plates import PlateTable
+
+
+def design_index(apg):
+    '''Map each design (location ID, apogee version) to the indices of its plates.'''
+    if isinstance(apg, PlateTable):
+        keys = zip(apg.data['locationid'].tolist(), apg.data['apgver'].tolist())
+    else:
+        keys = [(p.locationid, p.apgver) for p in apg]
+    designs = dict()
+    for x, key in enumerate(keys):
+        designs.setdefault(key, []).append(x)
+    return dict((key, np.array(plates)) for key, plates in designs.items())
+
+
+def top_plates(values, k=3):
+    '''Indices of the k largest values, in increasing order of value (the tail of np.argsort).'''
+    n = len(values)
+    k = min(k, n)
+    if k == 0:
+        return np.zeros(0, dtype=int)
+    top = np.argpartition(values, n - k)[n - k:]
+    return top[np.argsort(values[top])]
 
 
 def pick_plates(apg, obs, par, times, lengths, schedule, loud=True, south=False):
     pick_start = time()
     # Check how many plates are available in each slot
-    nslot = np.zeros(len(times))
-    for t in range(len(times)):
-        wgood = [x for x in range(len(apg)) if obs[x, t] > 0]
-        nslot[t] = len(wgood)
+    nslot = np.sum(obs > 0, axis=0).astype(float)
+    designs = design_index(apg)
 
     # Loop through slots to choose in availability order
-    chosen = np.zeros([len(times), 3], dtype=np.int)
+    chosen = np.zeros([len(times), 3], dtype=int)
     pickorder = np.argsort(nslot)
     for t in range(len(times)):
         cslot = pickorder[t]
-        priorder = np.argsort(obs[:, cslot])
+        priorder = top_plates(obs[:, cslot])
         # Pick main plate
         if obs[priorder[-1], cslot] <= 0:
             if loud:
-                print("[WARN] No good APG-II plates for block %1d. Max priority = %4.1f" % (cslot, max(obs[:, cslot])))
+                print("[WARN] No good APG-II plates for block %1d. Max priority = %4.1f" % (cslot, obs[priorder[-1], cslot]))
             chosen[cslot, 0] = -1
         else:
             chosen[cslot, 0] = priorder[-1]
@@ -45,18 +66,16 @@ def pick_plates(apg, obs, par, times, lengths, schedule, loud=True, south=False)
         if chosen[cslot, 0] == -1:
             continue
 
-        # Find all plates on the same field, and similar designs (location ID + apogee version) to the chosen plate
-        chosen_field = [x for x in range(len(apg)) if apg[x].locationid == apg[chosen[cslot, 0]].locationid]
-        chosen_designs = [x for x in chosen_field if apg[x].apgver == apg[chosen[cslot, 0]].apgver]
+        # Find all plates with the same design (location ID + apogee version) as the chosen plate
+        chosen_plate = apg[chosen[cslot, 0]]
+        chosen_designs = designs[(chosen_plate.locationid, chosen_plate.apgver)]
 
         # Remove chosen design, if it is not stack-able.
-        if apg[chosen[cslot, 0]].stack == 0:
-            for x in chosen_designs:
-                obs[x, range(len(times)) != cslot] = -10
+        if chosen_plate.stack == 0:
+            obs[np.ix_(chosen_designs, np.arange(len(times)) != cslot)] = -10
         # This plate is stack-able, only remove non-adjacent blocks
         else:
-            for x in chosen_designs:
-                obs[x, cslot-1:cslot+2] = -10
+            obs[chosen_designs, cslot-1:cslot+2] = -10
 
     # Check for stacked fields
     for t in range(len(times)-1):
@@ -68,24 +87,11 @@ def pick_plates(apg, obs, par, times, lengths, schedule, loud=True, south=False)
             continue
         if loud:
             print("[PY] APG-II stack chosen")
-        # Create new arrays
-        newtimes, newlengths, newchosen = np.zeros(len(times)-1), np.zeros(len(times)-1), np.zeros([len(times)-1, 3])
-        # Loop through previous blocks
-        for i in range(t):
-            newtimes[i] = times[i]
-            newlengths[i] = lengths[i]
-            newchosen[i, :] = chosen[i, :]
-        # Combine current block and next block
-        newtimes[t] = times[t]
-        newlengths[t] = lengths[t] + lengths[t+1]
-        newchosen[t, :] = chosen[t, :]
-        # Save all blocks after merged ones
-        for i in range(t+2, len(times)):
-            newtimes[i-1] = times[i]
-            newlengths[i-1] = lengths[i]
-            newchosen[i-1, :] = chosen[i, :]
-        # Overwrite old arrays
-        times, lengths, chosen = newtimes, newlengths, newchosen
+        # Combine current block and next block, keeping the blocks before and after them
+        stacklength = lengths[t] + lengths[t+1]
+        times = np.concatenate((times[:t+1], times[t+2:])).astype(float)
+        lengths = np.concatenate((lengths[:t], [stacklength], lengths[t+2:])).astype(float)
+        chosen = np.concatenate((chosen[:t+1], chosen[t+2:]))
     pick_end = time()
     if loud:
         print("[PY] Chose APOGEE-II plates (%.3f sec)" % (pick_end - pick_start))
@@ -17,7 +17,8 @@ def schedule_apogee(schedule, errors, par=None, plan=False, loud=True, twilight=
 
     # Default params for north, south can have different params so keep them if passed in
     if par is None:
-        par = {'exposure': 67, 'overhead': 20.0, 'ncarts': 9, 'maxz': 3, 'moon_threshold': 15, 'sn_target': 3136}
+        par = {'exposure': 67, 'overhead': 20.0, 'ncarts': 9, 'maxz': 3, 'moon_threshold': 15, 'sn_target': 3136,
+               'refraction': False}
 
     # Define APOGEE-II blocks for tonight
     nightlength = (schedule['bright_end'] - schedule['bright_start']) * 24
@@ -82,7 +83,8 @@ def schedule_apogee(schedule, errors, par=None, plan=False, loud=True, twilight=
         passed_mjd = schedule['jd'] - 2400000
     else:
         passed_mjd = None
-    apg = get_plates(errors, plan=plan, loud=loud, south=south, mjd=passed_mjd)
+    apg = get_plates(errors, plan=plan, loud=loud, south=south, mjd=passed_mjd, table=True,
+                     exposureList=False)
     if len(apg) == 0:
         errors.append('APOGEE-II PLATE ERROR: No APOGEE-II plates found. Aborting.')
         return []
@@ -104,7 +106,7 @@ def schedule_apogee(schedule, errors, par=None, plan=False, loud=True, twilight=
     if loud:
         df = open('apogee.txt', 'w')
         for p in range(len(apg)):
-            print("%20s %5d %3d %3d %5.2f %5.2f  %5.1f %8.2f %8.2f  %s" % (apg[p].name, apg[p].plateid, apg[p].vplan, apg[p].vdone, apg[p].minha, apg[p].maxha, apg[p].sn, apg[p].priority, max(obs[p, :]), apg[p].hist), file=df)
+            print("%20s %5d %3d %3d %5.2f %5.2f  %5.1f %8.2f %8.2f  %s" % (apg[p].name, apg[p].plateid, apg[p].vplan, apg[p].vdone, apg[p].minha, apg[p].maxha, apg[p].sn, apg[p].priority, max(obs[p, :]), ','.join(str(x) for x in apg[p].hist)), file=df)
         df.close()
 
     return picks
@@ -114,7 +116,8 @@ def schedule_external(schedule, errors, par=None, plan=False, loud=True, twiligh
 
     # Default params for north, south can have different params so keep them if passed in
     if par is None:
-        par = {'exposure': 60, 'overhead': 20, 'ncarts': 9, 'maxz': 3, 'moon_threshold': 15, 'sn_target': 3136}
+        par = {'exposure': 60, 'overhead': 20, 'ncarts': 9, 'maxz': 3, 'moon_threshold': 15, 'sn_target': 3136,
+               'refraction': False}
 
     # Define APOGEE-II blocks for tonight
     nightlength = (schedule['bright_end'] - schedule['bright_start']) * 24
@@ -137,7 +140,8 @@ def schedule_external(schedule, errors, par=None, plan=False, loud=True, twiligh
     # ##########################
     # change
     # ##########################
-    apg = get_plates(errors, plan=plan, loud=loud, south=south, mjd=passed_mjd)
+    apg = get_plates(errors, plan=plan, loud=loud, south=south, mjd=passed_mjd, table=True,
+                     exposureList=False)
     if len(apg) == 0:
         errors.append('APOGEE-II PLATE ERROR: No APOGEE-II plates found. Aborting.')
         return []
@@ -158,7 +162,7 @@ def schedule_external(schedule, errors, par=None, plan=False, loud=True, twiligh
     if loud:
         df = open('apogee.txt', 'w')
         for p in range(len(apg)):
-            print("%20s %5d %3d %3d %5.2f %5.2f  %5.1f %8.2f %8.2f  %s" % (apg[p].name, apg[p].plateid, apg[p].vplan, apg[p].vdone, apg[p].minha, apg[p].maxha, apg[p].sn, apg[p].priority, max(obs[p, :]), apg[p].hist), file=df)
+            print("%20s %5d %3d %3d %5.2f %5.2f  %5.1f %8.2f %8.2f  %s" % (apg[p].name, apg[p].plateid, apg[p].vplan, apg[p].vdone, apg[p].minha, apg[p].maxha, apg[p].sn, apg[p].priority, max(obs[p, :]), ','.join(str(x) for x in apg[p].hist)), file=df)
         df.close()
 
     return picks
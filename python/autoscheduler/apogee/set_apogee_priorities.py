@@ -1,6 +1,7 @@
 from __future__ import print_function, division
 from time import time
 import numpy as np
+from autoscheduler.plateDBtools.apogee.get_apogee_plates import PlateTable
 
 # SET_PRIORITIES
 # DESCRIPTION: Sets priority values for all available APOGEE-II plates
@@ -8,63 +9,119 @@ import numpy as np
 # OUTPUT: none
 
 
-def set_priorities(apg, par, schedule, plan=False, loud=True, twilight=False, south=False):
-    set_pri_start = time()
-    # Loop through all plates and set priorities
-    for p in range(len(apg)):
-        # Manual override
-        if apg[p].manual_priority == 10:
-            apg[p].priority = 9999.0
+priority_fields = ('manual_priority', 'plugged', 'dec', 'vplan', 'vdone', 'sn', 'cadence', 'first_jd', 'last_jd',
+                   'locationid', 'apgver')
+
+
+def plate_columns(apg):
+    '''Collect the plate attributes used for prioritization into NumPy columns.'''
+    if isinstance(apg, PlateTable):
+        return dict((f, apg.data[f]) for f in priority_fields)
+    return {'manual_priority': np.array([p.manual_priority for p in apg], dtype=int),
+            'plugged': np.array([p.plugged for p in apg], dtype=int),
+            'dec': np.array([p.dec for p in apg], dtype=float),
+            'vplan': np.array([p.vplan for p in apg], dtype=int),
+            'vdone': np.array([p.vdone for p in apg], dtype=int),
+            'sn': np.array([p.sn for p in apg], dtype=float),
+            'cadence': np.array([p.cadence for p in apg], dtype=object),
+            'first_jd': np.array([p.minhist() for p in apg], dtype=float),
+            'last_jd': np.array([p.maxhist() for p in apg], dtype=float),
+            'locationid': np.array([p.locationid for p in apg], dtype=int),
+            'apgver': np.array([p.apgver for p in apg], dtype=int)}
+
+
+def base_priorities(cols, jd, plan=False, south=False):
+    '''DESCRIPTION: Applies the manual, plugged, declination, completion and cadence rules to all plates
+    INPUT: cols -- plate columns (see plate_columns)
+           jd -- Julian date of the night being scheduled
+    OUTPUT: priority -- array of plate priorities'''
+    vplan = cols['vplan']
+    vdone = cols['vdone']
+
+    # Set base priority
+    priority = 100.0 * cols['manual_priority']
+
+    # Already Plugged
+    if not south:
+        priority = np.where(cols['plugged'] > 0, priority + 100.0, priority)
+
+    # Declination
+    if south:
+        priority -= 50.0 * np.exp(-(cols['dec'] + 29)**2 / (2 * (20)**2))
+    else:
+        priority -= 50.0 * np.exp(-(cols['dec'] - 33)**2 / (2 * (20)**2))
+    # Ecliptic
+    # TO-DO
+
+    # Completion (using algorithm in SDSS python module)
+    if plan:
+        safeplan = np.where(vplan == 0, 1, vplan)
+        pct = 0.9 * np.minimum(1, vdone / safeplan) + 0.1 * np.minimum(1, cols['sn'] / (3136 * safeplan))
+        priority = np.where((vplan == 0) | (pct >= 1), -2.0, priority)
+
+    # Cadence
+    sincelast = jd - cols['last_jd']
+    sincefirst = jd - cols['first_jd']
+    # 3-visit cadence rules: 3 days between adjacent obs, 26 between first and last
+    # 4+ visit cadence rules: 3 days between adjacent obs
+    toosoon = (vplan >= 3) & (sincelast < 3)
+    toosoon |= (vplan == 3) & (vdone == 2) & (sincefirst < 26)
+    # Alternative cadence rules
+    # Do a once a bright run cadence for KOI and substellar plates
+    cadence = cols['cadence']
+    slowcad = (cadence == 'kep_koi') | (cadence == 'substellar') | (cadence == 'koi_btx')
+    toosoon |= slowcad & (sincelast < 18)
+    priority = np.where(toosoon & (jd != cols['last_jd']), -1.0, priority)
+
+    # Manual override
+    priority = np.where(cols['manual_priority'] == 10, 9999.0, priority)
+    priority = np.where(cols['manual_priority'] == 1, -1.0, priority)
+    return priority
+
+
+def in_order_completion(locationid, apgver, priority):
+    '''DESCRIPTION: Halves a plate's priority for every earlier cohort (lower apgver) plate at
+                    its location that still has priority > 1. Plates are visited in their
+                    original order, so a plate sees the already-halved priorities of the plates
+                    before it and the unhalved priorities of the plates after it.
+    INPUT: locationid, apgver, priority -- plate columns
+    OUTPUT: priority -- halved priorities'''
+    priority = np.array(priority, dtype=float)
+    if len(priority) == 0:
+        return priority
+
+    # Group plates by location once, keeping the original order within each location
+    order = np.argsort(locationid, kind='mergesort')
+    bounds = np.where(np.diff(locationid[order]) != 0)[0] + 1
+    for group in np.split(order, bounds):
+        if len(group) == 1:
             continue
-        elif apg[p].manual_priority == 1:
-            apg[p].priority = -1.0
+        # per-cohort count of plates with priority > 1, with cohorts ranked by apgver
+        cohorts, rank = np.unique(apgver[group], return_inverse=True)
+        if len(cohorts) == 1:
             continue
+        active = np.bincount(rank[priority[group] > 1], minlength=len(cohorts))
+        for p, r in zip(group, rank):
+            wasactive = priority[p] > 1
+            priority[p] /= 2**int(active[:r].sum())
+            if wasactive and priority[p] <= 1:
+                active[r] -= 1
+    return priority
+
+
+def set_priorities(apg, par, schedule, plan=False, loud=True, twilight=False, south=False):
+    set_pri_start = time()
+    # Set priorities for all plates at once
+    cols = plate_columns(apg)
+    priority = base_priorities(cols, schedule['jd'], plan=plan, south=south)
 
-        # Set base priority
-        apg[p].priority = 100.0 * apg[p].manual_priority
-
-        # Already Plugged
-        if not south:
-            if apg[p].plugged > 0:
-                apg[p].priority += 100.0
-
-        # Declination
-        if south:
-            apg[p].priority -= 50.0 * float(np.exp(-(apg[p].dec + 29)**2 / (2 * (20)**2)))
-        else:
-            apg[p].priority -= 50.0 * float(np.exp(-(apg[p].dec - 33)**2 / (2 * (20)**2)))
-        # Ecliptic
-        # TO-DO
-
-        # Completion (using algorithm in SDSS python module)
-        if plan:
-            if apg[p].pct() >= 1:
-                apg[p].priority = -2
-
-        # Cadence
-        if schedule['jd'] != apg[p].maxhist():
-            # 3-visit cadence rules: 3 days between adjacent obs, 26 between first and last
-            if apg[p].vplan == 3:
-                if schedule['jd'] - apg[p].maxhist() < 3:
-                    apg[p].priority = -1
-                if apg[p].vdone == 2 and schedule['jd'] - apg[p].minhist() < 26:
-                    apg[p].priority = -1
-            # 4+ visit cadence rules: 3 days between adjacent obs
-            elif apg[p].vplan > 3:
-                if schedule['jd'] - apg[p].maxhist() < 3:
-                    apg[p].priority = -1
-            # Alternative cadence rules
-            # Do a once a bright run cadence for KOI and substellar plates
-            if apg[p].cadence == 'kep_koi' or apg[p].cadence == 'substellar' or apg[p].cadence == 'koi_btx':
-                    if schedule['jd'] - apg[p].maxhist() < 18:
-                        apg[p].priority = -1
-
-    # In-Order Completion (needs second loop)
-    for p in range(len(apg)):
-        wfield = [x for x in range(len(apg)) if apg[x].locationid == apg[p].locationid]
-        for f in wfield:
-            if apg[p].apgver > apg[f].apgver and apg[f].priority > 1:
-                apg[p].priority /= 2
+    # In-Order Completion (needs second pass)
+    priority = in_order_completion(cols['locationid'], cols['apgver'], priority)
+    if isinstance(apg, PlateTable):
+        apg.data['priority'] = priority
+    else:
+        for p in range(len(apg)):
+            apg[p].priority = float(priority[p])
 
     # For south, de-prioritize plates for programs not scheduled tonight
     if 'programs' in schedule:
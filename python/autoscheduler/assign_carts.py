@@ -1,6 +1,7 @@
 from __future__ import print_function, division
 from time import time
 from operator import itemgetter
+from sqlalchemy import func
 from autoscheduler.plateDBtools.database.connections import APODatabaseUserLocalConnection
 from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as plateDB
 from autoscheduler.plateDBtools.database.apo.mangadb import ModelClasses as mangaDB
@@ -22,29 +23,27 @@ def mangaBrightPriority(plateIDs):
     Session = APODatabaseUserLocalConnection.Session
     session = Session()
 
-    # Retrieves the plates from the DB
+    # Sums the transparencies of the MaNGA science exposures of every plate in one query.
+    # Each platedb exposure counts once, through its first (lowest pk) mangadb exposure.
     with session.begin():
-        plates = session.query(plateDB.Plate).filter(
-            plateDB.Plate.plate_id.in_(plateIDs)).order_by(
-                plateDB.Plate.plate_id).all()
-
-    # For each plate, gets a list with the transparency of each exposure.
-    mangaTransparencies = []
-    for plate in plates:
-        plateTransparencies = []
-        for plugging in plate.pluggings:
-            scienceExposures = plugging.scienceExposures()
-            for exp in scienceExposures:
-                if exp.survey.label != 'MaNGA':
-                    continue
-                if len(exp.mangadbExposure) == 0:
-                    continue
-                plateTransparencies.append(exp.mangadbExposure[0].transparency)
-        mangaTransparencies.append(plateTransparencies)
-
-    # Calculates the sum of the transparencies for each plate
-    sumOfTransparencies = np.array([np.sum(exps)
-                                    for exps in mangaTransparencies])
+        firstManga = session.query(plateDB.Exposure.pk.label('exposure_pk'),
+                                   func.min(mangaDB.Exposure.pk).label('manga_pk'))\
+            .join(plateDB.Exposure.mangadbExposure)\
+            .group_by(plateDB.Exposure.pk).subquery()
+        transparencies = session.query(plateDB.Plate.plate_id, func.sum(mangaDB.Exposure.transparency))\
+            .join(plateDB.Plate.pluggings).join(plateDB.Plugging.observations)\
+            .join(plateDB.Observation.exposures).join(plateDB.Exposure.flavor)\
+            .join(plateDB.Exposure.survey)\
+            .join(firstManga, firstManga.c.exposure_pk == plateDB.Exposure.pk)\
+            .join(mangaDB.Exposure, mangaDB.Exposure.pk == firstManga.c.manga_pk)\
+            .filter(plateDB.Plate.plate_id.in_(plateIDs.tolist()))\
+            .filter(plateDB.ExposureFlavor.label == 'Science')\
+            .filter(plateDB.Survey.label == 'MaNGA')\
+            .group_by(plateDB.Plate.plate_id).all()
+
+    # Plates without MaNGA exposures have a sum of zero
+    plateSums = dict((plateid, float(total)) for plateid, total in transparencies if total is not None)
+    sumOfTransparencies = np.array([plateSums.get(plateid, 0.0) for plateid in plateIDs])
 
     plates_to_avoid_cart_2 = np.array([avoid_cart_2(plateid)
                                        for plateid in plateIDs])
@@ -83,14 +82,6 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
     #       "ORDER BY crt.number").fetchall()
     allcarts = session.query(plateDB.Cartridge.number).order_by(plateDB.Cartridge.number).all()
 
-    plugplan = []
-    for c in allcarts:
-        plugplan.append({'cart': c[0], 'cartsurveys': 0, 'oldplate': 0, 'm_picked': 0})
-        if c[0] < 10:
-            plugplan[-1]['cartsurveys'] = 1
-        if c[0] >= 10:
-            plugplan[-1]['cartsurveys'] = 2
-
     # Read in all plates that are currently plugged
     # Co-observing plates are returned twice
     # currentplug = session.execute("SET SCHEMA 'platedb'; "+
@@ -106,9 +97,39 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
     currentplug = session.query(plateDB.Cartridge.number, plateDB.Plate.plate_id)\
                                 .join(plateDB.Plugging).join(plateDB.Plate).join(plateDB.ActivePlugging)\
                                 .order_by(plateDB.Cartridge.number).all()
+
+    apgpicks, manpicks, ebopicks = pick_carts(allcarts, currentplug, apogee_choices, manga_choices,
+                                              eboss_choices, errors, manga_cart_order)
+
+    cart_end = time()
+    if loud:
+        print("[PY] Assigned cartridges (%.3f sec)" % (cart_end - cart_start))
+
+    return apgpicks, manpicks, ebopicks
+
+
+def pick_carts(allcarts, currentplug, apogee_choices, manga_choices, eboss_choices, errors, manga_cart_order):
+    '''
+    pick_carts: Assigns all survey plate choices to cartridges, given the cartridges and current pluggings.
+
+    INPUT: allcarts -- (cart number,) rows of all cartridges, in cart number order
+           currentplug -- (cart number, plate id) rows of the active pluggings
+           other arguments as for assign_carts
+    OUTPUT: apgpicks, manpicks, ebopicks -- APOGEE-II, MaNGA and eBOSS plate choices with their carts
+    '''
+    plugplan = []
+    cartIndex = dict()
+    for c in allcarts:
+        cartIndex[c[0]] = len(plugplan)
+        plugplan.append({'cart': c[0], 'cartsurveys': 0, 'oldplate': 0, 'm_picked': 0})
+        if c[0] < 10:
+            plugplan[-1]['cartsurveys'] = 1
+        if c[0] >= 10:
+            plugplan[-1]['cartsurveys'] = 2
+
+    # Mark the plates that are currently plugged
     for c, p in currentplug:
-        wcart = [x for x in range(len(plugplan)) if plugplan[x]['cart'] == c][0]
-        plugplan[wcart]['oldplate'] = p
+        plugplan[cartIndex[c]]['oldplate'] = p
 
     # Save MaNGA choices to cartridges (since they are the most dependent)
     manpicks = manga_choices
@@ -122,62 +143,68 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
     cart_order.extend(manga_cart_order)
 
     for c in cart_order:
-        pidx = [x for x in range(len(plugplan)) if plugplan[x]['cart'] == c]
-        if len(pidx) == 0:
+        if c not in cartIndex:
             continue
-        sort_plugplan.append(plugplan[pidx[0]])
+        sort_plugplan.append(plugplan[cartIndex[c]])
     plugplan = sort_plugplan
 
+    # Index the sorted plugplan by cart number and by currently plugged plate
+    cartIndex = dict()
+    oldplateIndex = dict()
+    for x in range(len(plugplan)):
+        cartIndex.setdefault(plugplan[x]['cart'], x)
+        oldplateIndex.setdefault(plugplan[x]['oldplate'], x)
+
     # Mark any cartridges already chosen by manga
-    if len(manpicks) > 0:
-        for c in manpicks:
-            wcart = [x for x in range(len(plugplan)) if plugplan[x]['cart'] == c['cart']]
-            if len(wcart) == 0:
-                continue
-            plugplan[wcart[0]]['m_picked'] = 1
+    mangaCarts = dict()
+    for c in manpicks:
+        mangaCarts.setdefault(c['cart'], c)
+        if c['cart'] not in cartIndex:
+            continue
+        plugplan[cartIndex[c['cart']]]['m_picked'] = 1
+
+    # Candidate carts for each kind of plate, in plugplan order
+    coobsCarts = [x for x in range(len(plugplan)) if plugplan[x]['cart'] >= 0 and plugplan[x]['cart'] <= 6 and plugplan[x]['m_picked'] == 0]
+    apogeeCarts = [x for x in range(len(plugplan)) if plugplan[x]['cartsurveys'] == 1]
+    ebossCarts = [x for x in range(len(plugplan)) if plugplan[x]['cartsurveys'] == 2]
 
     # Sort apogee_choices, so that non-co-observing plates are plugged first
     apogee_choices = sorted(apogee_choices, key=itemgetter('coobs'))
 
     # Sort the co-observing plates in order of least manga signal to most manga signal
-    aponlyplt = [apogee_choices[x]['plate'] for x in range(len(apogee_choices)) if not apogee_choices[x]['coobs'] and apogee_choices[x]['plate'] != -1]
     coobsplt = [apogee_choices[x]['plate'] for x in range(len(apogee_choices)) if apogee_choices[x]['coobs']]
     # Only do this if we have coobs plates
     if len(coobsplt) > 0:
         # Sort coobs plates in order of manga signal
         coobsplt = mangaBrightPriority(coobsplt)
-        # Combine both plate lists together
-        allplate = aponlyplt+coobsplt
-        sort_choices = []
-        # Sort apogee_choices by allplate list
-        for i in range(len(allplate)):
-            hold = [apogee_choices[x] for x in range(len(apogee_choices)) if apogee_choices[x]['plate'] == allplate[i]]
-            sort_choices = sort_choices+hold
-
-        # Add back in the -1 plates
-        for i in range(len(apogee_choices)):
-            if(apogee_choices[i]['plate'] == -1):
-                sort_choices.append(apogee_choices[i])
-
-        # Save the results
-        apogee_choices = sort_choices
+        coobsRank = dict((plate, rank) for rank, plate in enumerate(coobsplt))
+
+        # APOGEE-only plates keep their order, followed by the coobs plates in order of
+        # manga signal and then the -1 plates
+        def choiceKey(choice):
+            if choice['plate'] == -1:
+                return (2, 0)
+            if choice['coobs']:
+                return (1, coobsRank[choice['plate']])
+            return (0, 0)
+        apogee_choices = sorted(apogee_choices, key=choiceKey)
 
     # Save APOGEE-II choices to cartridges
     apgsaved = np.zeros(len(apogee_choices))
     apgpicks = []
     # First loop: assign plates to carts which are already plugged
     for i in range(len(apogee_choices)):
-        wplate = [x for x in range(len(plugplan)) if apogee_choices[i]['plate'] == plugplan[x]['oldplate']]
-        if len(wplate) == 0:
+        wplate = oldplateIndex.get(apogee_choices[i]['plate'])
+        if wplate is None:
             continue
-        if plugplan[wplate[0]]['m_picked'] == 1:
+        if plugplan[wplate]['m_picked'] == 1:
             continue
         # Save new values to apgpicks
 
         thispick = apogee_choices[i]
-        thispick['cart'] = plugplan[wplate[0]]['cart']
+        thispick['cart'] = plugplan[wplate]['cart']
         thispick['plate'] = apogee_choices[i]['plate']
-        plugplan[wplate[0]]['cart'] = -1
+        plugplan[wplate]['cart'] = -1
         apgsaved[i] = 1
         thispick.pop('coobs', None)
         apgpicks.append(thispick)
@@ -189,19 +216,19 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
             continue
         if apogee_choices[i]['coobs']:
             # Co-observing plates prefer being on carts 1 - 6
-            carts_avail = [x for x in range(len(plugplan)) if plugplan[x]['cart'] >= 0 and plugplan[x]['cart'] <= 6 and plugplan[x]['m_picked'] == 0]
+            carts_avail = [x for x in coobsCarts if plugplan[x]['cart'] >= 0]
             if len(carts_avail) == 0:
-                carts_avail = [x for x in range(len(plugplan)) if plugplan[x]['cart'] >= 0 and plugplan[x]['cartsurveys'] == 1]
+                carts_avail = [x for x in apogeeCarts if plugplan[x]['cart'] >= 0]
         else:
-            carts_avail = [x for x in range(len(plugplan)) if plugplan[x]['cart'] >= 0 and plugplan[x]['cartsurveys'] == 1]
+            carts_avail = [x for x in apogeeCarts if plugplan[x]['cart'] >= 0]
         if len(carts_avail) == 0:
             continue
 
         # Remove cart from MaNGA list
         if plugplan[carts_avail[0]]['m_picked'] == 1:
-            wcart = [x for x in range(len(manpicks)) if plugplan[carts_avail[0]]['cart'] == manpicks[x]['cart']]
-            manga_removed_plates.append(manpicks[wcart[0]]['plateid'])
-            manpicks.pop(wcart[0])
+            mpick = mangaCarts.pop(plugplan[carts_avail[0]]['cart'])
+            manga_removed_plates.append(mpick['plateid'])
+            manpicks.remove(mpick)
 
         # Save new values to apgpicks
         thispick = apogee_choices[i]
@@ -234,20 +261,20 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
     ebopicks = []
     # First loop: assign plates to carts which are already plugged
     for i in range(len(eboss_choices)):
-        wplate = [x for x in range(len(plugplan)) if eboss_choices[i]['plate'] == plugplan[x]['oldplate']]
-        if len(wplate) == 0:
+        wplate = oldplateIndex.get(eboss_choices[i]['plate'])
+        if wplate is None:
             continue
         # Save new values to ebopicks
         thispick = eboss_choices[i]
-        thispick['cart'] = plugplan[wplate[0]]['cart']
-        plugplan[wplate[0]]['cart'] = -1
+        thispick['cart'] = plugplan[wplate]['cart']
+        plugplan[wplate]['cart'] = -1
         ebosaved[i] = 1
         ebopicks.append(thispick)
     # Second loop: assign plates to carts which are not plugged
     for i in range(len(eboss_choices)):
         if ebosaved[i] == 1:
             continue
-        carts_avail = [x for x in range(len(plugplan)) if plugplan[x]['cart'] >= 0 and plugplan[x]['cartsurveys'] == 2]
+        carts_avail = [x for x in ebossCarts if plugplan[x]['cart'] >= 0]
         if len(carts_avail) == 0:
             continue
         # Save new values to ebopicks
@@ -256,8 +283,4 @@ def assign_carts(apogee_choices, manga_choices, eboss_choices, errors, manga_car
         plugplan[carts_avail[0]]['cart'] = -1
         ebopicks.append(thispick)
 
-    cart_end = time()
-    if loud:
-        print("[PY] Assigned cartridges (%.3f sec)" % (cart_end - cart_start))
-
     return apgpicks, manpicks, ebopicks
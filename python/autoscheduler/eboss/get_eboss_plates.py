@@ -5,6 +5,18 @@ import math
 import autoscheduler.plateDBtools.database.apo.platedb.ModelClasses as plateDB
 from sqlalchemy import or_
 from sqlalchemy import desc
+from sqlalchemy import text
+
+# Cartridge number, plate ID and plate pk of every plugged plate of the given surveys
+plugged_query = text("SELECT crt.number, plt.plate_id, plt.pk "+
+    "FROM ((((((platedb.active_plugging AS ac "+
+        "JOIN platedb.plugging AS plg ON (ac.plugging_pk=plg.pk)) "+
+        "LEFT JOIN platedb.cartridge AS crt ON (plg.cartridge_pk=crt.pk)) "+
+        "LEFT JOIN platedb.plate AS plt ON (plg.plate_pk=plt.pk)) "+
+        "LEFT JOIN platedb.plate_to_survey AS p2s ON (p2s.plate_pk=plt.pk)) "+
+        "LEFT JOIN platedb.survey AS surv ON (p2s.survey_pk = surv.pk)) "+
+        "LEFT JOIN platedb.plate_pointing as pltg ON (pltg.plate_pk=plt.pk)) "+
+    "WHERE surv.label=:survey1 OR surv.label=:survey2 ORDER BY crt.number")
 
 # EBOPLATE OBJECT DENITION
 # DESCRIPTION: eBOSS Plate Object
@@ -47,16 +59,25 @@ def get_plates(plan=False, loud=True):
         from autoscheduler.plateDBtools.database.connections.APODatabaseUserLocalConnection import db
     session = db.Session()
 
+    # Read what is currently plugged once; observing mode builds its plate list from it
+    stage3_start = time()
+    plugged_plates = session.execute(plugged_query, {'survey1': 'BOSS', 'survey2': 'eBOSS'}).fetchall()
+    stage3_end = time()
+    if loud: print("[SQL] Read in currently plugged eBOSS plates (%.3f sec)" % ((stage3_end - stage3_start)))
+
     # Look at all plates for plugging purposes
     stage1_start = time()
     if plan:
        # Pull all information on eBOSS plates
         ebossPlates = session.query(plateDB.Plate, plateDB.Pointing, plateDB.PlatePointing).join(plateDB.PlateToSurvey, plateDB.Survey, plateDB.PlatePointing, plateDB.Pointing, plateDB.PlateLocation, plateDB.PlateToPlateStatus, plateDB.PlateStatus).filter(or_(plateDB.Survey.label == 'eBOSS', plateDB.Survey.label == 'BOSS'), or_(plateDB.PlateStatus.label == 'Accepted',plateDB.PlateStatus.label == 'Special'), plateDB.PlateLocation.label == 'APO', plateDB.Plate.plate_id >= 4800).order_by(desc(plateDB.PlatePointing.priority)).all()
 
+        # Completion status of all plates in one query
+        statuses = plateDB.Plate.calculatedCompletionStatuses(session, set(p.Plate.pk for p in ebossPlates))
+
         # Add all incomplete plates to be analyzed
         ebo = []
         for p in ebossPlates:
-            if p.Plate.calculatedCompletionStatus() == 'Complete' or p.Plate.calculatedCompletionStatus() == 'Force Complete': continue
+            if statuses.get(p.Plate.pk) == 'Complete' or statuses.get(p.Plate.pk) == 'Force Complete': continue
             ebo.append(eboplate())
             ebo[-1].ra = p.Pointing.center_ra
             ebo[-1].dec = p.Pointing.center_dec
@@ -71,16 +92,6 @@ def get_plates(plan=False, loud=True):
             ebo[-1].platepk = p.Plate.pk
             ebo[-1].plugged = 0
     else:
-        plugged_plates = session.execute("SET SCHEMA 'platedb'; "+
-            "SELECT crt.number, plt.plate_id, plt.pk "+
-            "FROM ((((((platedb.active_plugging AS ac "+
-                "JOIN platedb.plugging AS plg ON (ac.plugging_pk=plg.pk)) "+
-                "LEFT JOIN platedb.cartridge AS crt ON (plg.cartridge_pk=crt.pk)) "+
-                "LEFT JOIN platedb.plate AS plt ON (plg.plate_pk=plt.pk)) "+
-                "LEFT JOIN platedb.plate_to_survey AS p2s ON (p2s.plate_pk=plt.pk)) "+
-                "LEFT JOIN platedb.survey AS surv ON (p2s.survey_pk = surv.pk)) "+
-                "LEFT JOIN platedb.plate_pointing as pltg ON (pltg.plate_pk=plt.pk)) "+
-            "WHERE surv.label='BOSS' OR surv.label='eBOSS' ORDER BY crt.number").fetchall() 
         ebo = []
         for i in range(len(plugged_plates)):
             ebo.append(eboplate())
@@ -89,26 +100,14 @@ def get_plates(plan=False, loud=True):
     stage1_end = time()
     if loud: print("[SQL] Read in eBOSS plates (%.3f sec)" % ((stage1_end - stage1_start)))
     
-    # Determine what is currently plugged
-    stage3_start = time()
-    stage3 = session.execute("SET SCHEMA 'platedb'; "+
-        "SELECT crt.number, plt.plate_id "+
-        "FROM ((((((platedb.active_plugging AS ac "+
-            "JOIN platedb.plugging AS plg ON (ac.plugging_pk=plg.pk)) "+
-            "LEFT JOIN platedb.cartridge AS crt ON (plg.cartridge_pk=crt.pk)) "+
-            "LEFT JOIN platedb.plate AS plt ON (plg.plate_pk=plt.pk)) "+
-            "LEFT JOIN platedb.plate_to_survey AS p2s ON (p2s.plate_pk=plt.pk)) "+
-            "LEFT JOIN platedb.survey AS surv ON (p2s.survey_pk = surv.pk)) "+
-            "LEFT JOIN platedb.plate_pointing as pltg ON (pltg.plate_pk=plt.pk)) "+
-        "WHERE surv.label='BOSS' OR surv.label='eBOSS' ORDER BY crt.number").fetchall() 
-    # Save currently plugged plates to data
-    for c,p in stage3:
-        wplate = [x for x in range(len(ebo)) if ebo[x].plateid == p]
-        if len(wplate) == 0: continue
-        wplate = wplate[0]
-        ebo[wplate].plugged = c
-    stage3_end = time()
-    if loud: print("[SQL] Read in currently plugged eBOSS plates (%.3f sec)" % ((stage3_end - stage3_start)))
+    # Save currently plugged plates to data. The last row of a plate gives its cart, and only
+    # the first entry of a plate in ebo is marked as plugged.
+    plugged = dict()
+    for c,p,pk in plugged_plates:
+        plugged[p] = c
+    for x in range(len(ebo)):
+        if ebo[x].plateid in plugged:
+            ebo[x].plugged = plugged.pop(ebo[x].plateid)
         
     return ebo
     
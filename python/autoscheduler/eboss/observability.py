@@ -1,82 +1,87 @@
 from __future__ import print_function, division
 from time import time
 import numpy as np
-import astropysics.coords as coo
-import astropysics.obstools as obs
-from autoscheduler.sdssUtilities.idlasl import moonpos
+from autoscheduler.ephemeris import sites, ephemeris_for
+from autoscheduler.obs_matrix import LSTWindowIndex, SkyIndex, transit_weight, secz_at, julian_epoch
+
+
+def _column(ebo, attr):
+    # Plate pointing values can be missing (None) in platedb; store them as NaN
+    return np.array([np.nan if getattr(p, attr) is None else float(getattr(p, attr)) for p in ebo], dtype=float)
+
+
+def plate_columns(ebo):
+    '''Collect the plate attributes used for observability into NumPy columns.'''
+    return {'manual_priority': _column(ebo, 'manual_priority'),
+            'ra': _column(ebo, 'ra'),
+            'dec': _column(ebo, 'dec'),
+            'ha': _column(ebo, 'ha'),
+            'minha': _column(ebo, 'minha'),
+            'maxha': _column(ebo, 'maxha')}
+
+
+def obs_matrix(cols, par, beglst, endlst, midlst, moonra, moondec, lat, equinox=None):
+    '''DESCRIPTION: Computes the eBOSS observability matrix with array operations
+    INPUT: cols -- plate columns (see plate_columns)
+           beglst, endlst -- LST at the start/end of each block [hours]
+           midlst -- LST at the middle of each block, where the airmass is checked [hours]
+           moonra, moondec -- moon position for each block [deg]
+           lat -- site latitude [deg]
+           equinox -- equinox of the night [years], to precess the plate centers to
+    OUTPUT: obsarr -- (n_plates, n_blocks) priorities, or -1 (outside HA range or missing
+            HA limits), -2 (bad airmass), -3 (too close to the moon)'''
+    nplates, nblocks = len(cols['ra']), len(beglst)
+    lengths = np.zeros(nblocks) + par['exposure'] / 60
+
+    # Compute observing constants
+    platelst = (cols['ra'] + cols['ha']) / 15
+    minlst = (cols['ra'] + cols['minha']) / 15
+    maxlst = (cols['ra'] + cols['maxha']) / 15
+
+    # Base priority plus Gaussian prioritization on time from transit
+    obsarr = cols['manual_priority'][:, np.newaxis] * 100 + transit_weight(platelst, beglst, endlst, lengths)
+
+    # Moon avoidance, then HA range of the block. Only the plates whose LST window covers a
+    # block are checked against it; plates without HA limits are never within a window.
+    moonbad = np.zeros((nplates, nblocks), dtype=bool)
+    moonbad[SkyIndex(cols['ra'], cols['dec']).pairs(moonra, moondec, par['moon_threshold'])] = True
+    pi, bi = LSTWindowIndex(minlst, maxlst).within(minlst, maxlst, beglst, endlst)
+    inside = np.zeros((nplates, nblocks), dtype=bool)
+    inside[pi, bi] = True
+    habad = ~moonbad & ~inside
+
+    # Check the airmass in the middle of the block, for the plates and blocks that passed
+    # the window and moon checks
+    keep = ~moonbad[pi, bi]
+    pi, bi = pi[keep], bi[keep]
+    z = secz_at(cols['ra'][pi], cols['dec'][pi], np.asarray(midlst, dtype=float)[bi], lat,
+                refraction=par.get('refraction', False), equinox=equinox)
+    zbad = (z < 1.003) | (z > par['maxz'])
+    obsarr[pi[zbad], bi[zbad]] = -2
+    obsarr[habad] = -1
+    obsarr[moonbad] = -3
+    return obsarr
+
 
 def observability(ebo, par, times, loud=True):
     obs_start = time()
-    apo = obs.Site(32.789278, -105.820278)
-    obsarr = np.zeros([len(ebo), len(times)])
-    beglst = [apo.localSiderialTime(x) for x in times]
-    endlst = [apo.localSiderialTime(times[x] + par['exposure']/60/24) for x in range(len(times))]
-    
-    # Determine moon coordinates
-    mpos = []
-    for t in range(len(times)):
-        mooncoords = moonpos(times[t])
-        mpos.append(coo.ICRSCoordinates(mooncoords[0], mooncoords[1]))
-    
-    # Loop over all plates
-    for p in range(len(ebo)):
-        # Initalize obsarr row
-        for t in range(len(times)): obsarr[p,t] = ebo[p].manual_priority * 100
-        
-        # Compute observing constants
-        platecoo = coo.ICRSCoordinates(ebo[p].ra, ebo[p].dec)
-        platelst = float(ebo[p].ra + ebo[p].ha) / 15
-        try: 
-            minlst = float(ebo[p].ra + ebo[p].minha) / 15
-        except:
-            print("Plate Missing minha info: {}".format(ebo[p].plateid))
-            continue
+    lat = sites['APO'][0]
+    if len(ebo) == 0 or len(times) == 0:
+        return np.zeros([len(ebo), len(times)])
+    times = np.asarray(times, dtype=float)
+
+    # LSTs and moon coordinates come from tonight's ephemeris
+    eph = ephemeris_for('APO', times)
+    beglst = eph.lst_at(times)
+    endlst = eph.lst_at(times + par['exposure']/60/24)
+    midlst = eph.lst_at(times + par['exposure']/60/2/24)
+    moonra, moondec = eph.moon_at(times)
+
+    cols = plate_columns(ebo)
+    for p in np.where(np.isnan(cols['minha']) | np.isnan(cols['maxha']))[0]:
+        print("Plate Missing minha info: {}".format(ebo[p].plateid))
 
-        maxlst = float(ebo[p].ra + ebo[p].maxha) / 15
-        
-        for t in range(len(times)): 
-            # Adjust LSTs for 24 hour wrapping
-            usedminlst, usedmaxlst = minlst, maxlst
-            if minlst < 0 and beglst[t] > 12 and endlst[t] > 12:
-                usedminlst += 24
-                usedmaxlst += 24
-            if maxlst > 24 and beglst[t] < 12 and endlst[t] < 12:
-                usedminlst -= 24
-                usedmaxlst -= 24
-            if beglst[t] > endlst[t]:
-                if minlst < 12: usedminlst += 24
-                if maxlst > 12: usedmaxlst -= 24
-                
-            # Adjust LSTs for Gaussian with 24 hour wrapping
-            if beglst[t] > endlst[t]:
-                lstsum = beglst[t]+endlst[t]-24
-                if platelst > 12: usedplatelst = platelst - 24
-                else: usedplatelst = platelst
-            else:
-                lstsum = beglst[t]+endlst[t]
-                if beglst[t] > 18 and platelst < 4: usedplatelst = platelst + 24
-                elif beglst[t] < 4 and platelst > 18: usedplatelst = platelst - 24
-                else: usedplatelst = platelst
-        
-            # Gaussian prioritization on time from transit
-            obsarr[p,t] += 50.0 * float(np.exp( -(usedplatelst - lstsum/2 + par['exposure']/60/2)**2 / 2))
-        
-            # Moon avoidance
-            moondist = mpos[t] - platecoo
-            if moondist.d < par['moon_threshold']:
-                obsarr[p,t] = -3
-                continue
-            
-            # Determine whether HAs of block are within observational range
-            if beglst[t] < usedminlst or endlst[t] > usedmaxlst: 
-                obsarr[p,t] = -1
-                continue
-        
-            # Compute horiztonal coordinates
-            horz = apo.apparentCoordinates(platecoo, datetime=times[t] + par['exposure'] / 60 / 2 / 24)
-            secz = 1/np.cos((90.0 - horz[0].alt.d) * np.pi / 180)
-            # Check whether any of the points contain a bad airmass value
-            if secz < 1.003 or secz > par['maxz']: obsarr[p,t] = -2
+    obsarr = obs_matrix(cols, par, beglst, endlst, midlst, moonra, moondec, lat, equinox=julian_epoch(times[0]))
     obs_end = time()
     if loud: print("[PY] Determined eBOSS observability (%.3f sec)" % (obs_end - obs_start))
     return obsarr
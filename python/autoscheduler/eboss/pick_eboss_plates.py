@@ -1,9 +1,23 @@
 from __future__ import print_function, division
 from time import time
+from collections import Counter
+import heapq
 import numpy as np
 
 
-def pick_plates(ebo, par, times, obs, loud=True):
+def slot_heap(obs, t):
+    '''Heap of the plates with non-negative priority in slot t, highest priority first
+    (ties go to the higher plate index, as with the end of np.argsort).'''
+    good = np.where(obs[:, t] >= 0)[0]
+    heap = list(zip((-obs[good, t]).tolist(), (-good).tolist()))
+    heapq.heapify(heap)
+    return heap
+
+
+def place_plates(ebo, par, times, obs, loud=True):
+    '''Places the already-plugged plates, then fills the remaining slots with the
+    highest-priority plates while carts are left. Returns the plate ID of each slot
+    (-1 if empty); obs is modified in place.'''
     # Setup
     chosen = [-1 for x in times]
 
@@ -12,12 +26,12 @@ def pick_plates(ebo, par, times, obs, loud=True):
     for p in range(len(ebo)):
         if ebo[p].plugged == 0: continue
         nleft = ebo[p].visleft(par)
+        # Find optimal slots to choose
+        optslot = int(np.argmax(obs[p,:]))
         # Plate is complete or no longer observable, we can't keep it plugged
-        if nleft == 0 or max(obs[p,:]) < 0:
-            for t in range(len(times)): obs[p,t] = -10
+        if nleft == 0 or obs[p,optslot] < 0:
+            obs[p,:] = -10
             continue
-        # Find optimal slots to choose
-        optslot = [x for x in range(len(times)) if obs[p,x] == max(obs[p,:])][0]
         centerslot = int(round(nleft / 2)-1)
         # Optimal slot is too close to beginning of night, start from beginning
         if optslot < centerslot: startslot = 0
@@ -36,24 +50,31 @@ def pick_plates(ebo, par, times, obs, loud=True):
             if startslot+i >= len(chosen): continue
             chosen[startslot+i] = ebo[p].plateid
         # Remove plate from further picking
-        for t in range(len(times)): obs[p,t] = -10
+        obs[p,:] = -10
     pickplug_end = time()
     if loud: print("[PY] Placed eBOSS already-plugged plates (%.3f sec)" % (pickplug_end - pickplug_start))
             
     # Loop through all un-scheduled blocks and place plates
     ebossrest_start = time()
+    # Number of slots holding each value of chosen; its length is len(np.unique(chosen))
+    cartcount = Counter(chosen)
+    heap, heapslot = None, -1
     t = 0
     while t < len(chosen):
-        if chosen[t] >= 0 or len(np.unique(chosen)) > par['ncarts']:
+        if chosen[t] >= 0 or len(cartcount) > par['ncarts']:
             t += 1
             continue
-        # Choose the highest-priority plate for this slot
-        priorder = np.argsort(obs[:,t])
-        p = priorder[-1]
-        if obs[p,t] < 0:
+        # Choose the highest-priority plate for this slot. Priorities only ever drop to -10
+        # after the slot's heap is built, so entries that no longer match obs are skipped.
+        if heapslot != t:
+            heap, heapslot = slot_heap(obs, t), t
+        while len(heap) > 0 and obs[-heap[0][1],t] != -heap[0][0]:
+            heapq.heappop(heap)
+        if len(heap) == 0:
             if loud: print("[WARN] No eBOSS plates for slot %2d. Max priority = %4.1f" % (t, max(obs[:,t])))
             t += 1
             continue
+        p = -heapq.heappop(heap)[1]
         nleft = ebo[p].visleft(par)
         # Check to see whether plate can be observed for the entire necessary block
         endblock = min([t+nleft, len(chosen)-1])
@@ -64,11 +85,18 @@ def pick_plates(ebo, par, times, obs, loud=True):
         # Place plate in expected number of slots
         for i in range(nleft):
             if t+i >= len(chosen): continue
+            cartcount[chosen[t+i]] -= 1
+            if cartcount[chosen[t+i]] == 0: del cartcount[chosen[t+i]]
             chosen[t+i] = ebo[p].plateid
-        for i in range(len(times)): obs[p,i] = -10
+            cartcount[chosen[t+i]] += 1
+        obs[p,:] = -10
     ebossrest_end = time()
-    if loud: print("[PY] Placed new eBOSS plates (%.3f sec)" % (pickplug_end - pickplug_start))
+    if loud: print("[PY] Placed new eBOSS plates (%.3f sec)" % (ebossrest_end - ebossrest_start))
+    return chosen
+
 
+def pick_plates(ebo, par, times, obs, loud=True):
+    chosen = place_plates(ebo, par, times, obs, loud=loud)
     print(chosen)
     
     # Return all chosen plates
@@ -0,0 +1,201 @@
+from __future__ import print_function, division
+from collections import OrderedDict
+import os
+import numpy as np
+from autoscheduler.sdssUtilities.idlasl import moonpos, sunpos, ct2lst, hadec2altaz, moonphase
+from autoscheduler.night_schedule import load_schedule
+
+# EPHEMERIS
+# DESCRIPTION: Per-night moon, sun and LST tables. Each night is computed once on a fine
+#              time grid with vectorized calls, and slot times are interpolated from it.
+#              Nights in the master schedules can be precomputed into a memory-mapped
+#              table (see build_ephemeris_table).
+
+# Site latitude and longitude [deg, east positive]
+sites = {'APO': (32.789278, -105.820278),
+         'LCO': (-29.0182, -70.6915)}
+
+# Master schedule of each site, and the directory holding them
+schedule_files = {'APO': 'Sch_base.18_eb_MaStar.txt',
+                  'LCO': 'Sch_LCO_base.dat'}
+schedule_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'schedules')
+
+# Nights run from 0.25 to 1.25 days after the schedule JD, which covers both APO and LCO
+night_offset = 0.25
+# Grid spacing [minutes]
+grid_step = 5.0
+
+# Number of nights kept by get_ephemeris
+cache_size = 16
+_ephemerisCache = OrderedDict()
+# Loaded ephemeris tables, keyed by site
+_tableCache = dict()
+
+
+def night_mjd(times):
+    '''Schedule MJD (JD - 2400000) of the night containing the given JDs.'''
+    return int(np.floor(np.min(times) - night_offset)) - 2400000
+
+
+def night_grid(mjd, step=grid_step):
+    '''JD grid of the night(s) with schedule MJD mjd; one row per night.'''
+    offsets = night_offset + np.arange(int(round(1440 / step)) + 1) * step / 1440
+    return 2400000 + np.asarray(mjd, dtype=float).reshape(-1, 1) + offsets
+
+
+def _unwrap(x, period):
+    # Remove jumps at the wrap point along each night so the values can be interpolated
+    return np.unwrap(np.asarray(x) * 2 * np.pi / period, axis=-1) * period / (2 * np.pi)
+
+
+def night_arrays(jd, lat, lon):
+    '''DESCRIPTION: Computes the ephemeris on a (n_nights, n_points) JD grid
+    OUTPUT: dict of lst [hours] and moonra [deg] (both unwrapped along each night),
+            moondec [deg], moonillum (illuminated fraction) and sunalt [deg] grids'''
+    flat = jd.ravel()
+    moon = moonpos(flat)
+    sun = sunpos(flat)
+    lst = ct2lst(flat, lon)
+    sunalt = hadec2altaz(lst * 15 - sun[1], sun[2], lat)[0]
+    return {'lst': _unwrap(lst.reshape(jd.shape), 24.0),
+            'moonra': _unwrap(moon[0].reshape(jd.shape), 360.0),
+            'moondec': moon[1].reshape(jd.shape),
+            'moonillum': moonphase(flat).reshape(jd.shape),
+            'sunalt': sunalt.reshape(jd.shape)}
+
+
+class NightEphemeris(object):
+    '''Moon RA/Dec/illumination, sun altitude and LST for one night at one site.
+    INPUT: site -- key of sites
+           mjd -- schedule MJD (JD - 2400000) of the night
+           row -- precomputed ephemeris table row for this night (optional)'''
+
+    def __init__(self, site, mjd, row=None):
+        self.site = site
+        self.mjd = mjd
+        self.lat, self.lon = sites[site]
+        self.jd = night_grid(mjd)[0]
+        if row is None:
+            values = dict((k, v[0]) for k, v in night_arrays(self.jd[np.newaxis, :], self.lat, self.lon).items())
+        else:
+            values = dict((k, np.asarray(row[k], dtype=float)) for k in ephemeris_fields)
+        self.lst = values['lst']
+        self.moonra = values['moonra']
+        self.moondec = values['moondec']
+        self.moonillum = values['moonillum']
+        self.sunalt = values['sunalt']
+
+    def _interp(self, times, values):
+        times = np.asarray(times, dtype=float)
+        if np.any(times < self.jd[0]) or np.any(times > self.jd[-1]):
+            raise ValueError("Times outside of the ephemeris for MJD %d" % self.mjd)
+        return np.interp(times, self.jd, values)
+
+    def lst_at(self, times):
+        '''LST [hours] at the given JDs.'''
+        return self._interp(times, self.lst) % 24
+
+    def moon_at(self, times):
+        '''Moon RA and Dec [deg] at the given JDs.'''
+        return self._interp(times, self.moonra) % 360, self._interp(times, self.moondec)
+
+    def moonillum_at(self, times):
+        '''Illuminated fraction of the moon at the given JDs.'''
+        return self._interp(times, self.moonillum)
+
+    def sunalt_at(self, times):
+        '''Sun altitude [deg] at the given JDs.'''
+        return self._interp(times, self.sunalt)
+
+
+# Per-night grids stored in the ephemeris table
+ephemeris_fields = ('lst', 'moonra', 'moondec', 'moonillum', 'sunalt')
+
+
+def table_path(site):
+    '''Path of the persisted ephemeris table of a site.'''
+    return os.path.join(schedule_dir, schedule_files[site] + '.ephem.npy')
+
+
+def build_ephemeris_table(site):
+    '''
+    build_ephemeris_table: precomputes the ephemeris of every night in the site's master
+    schedule and saves it next to the schedule as a .ephem.npy table. Each row holds the
+    night's schedule jd, the site coordinates it was computed for, and float32 grids of
+    ephemeris_fields at grid_step resolution.
+    '''
+    lat, lon = sites[site]
+    jds = np.asarray(load_schedule(os.path.join(schedule_dir, schedule_files[site]), south=(site == 'LCO'))['jd'])
+    npoints = night_grid(0).shape[1]
+    dtype = [('jd', float), ('lat', float), ('lon', float)] + [(f, np.float32, (npoints,)) for f in ephemeris_fields]
+    table = np.zeros(len(jds), dtype=dtype)
+    table['jd'] = jds
+    table['lat'] = lat
+    table['lon'] = lon
+    values = night_arrays(night_grid(jds - 2400000), lat, lon)
+    for f in ephemeris_fields:
+        table[f] = values[f]
+    np.save(table_path(site), table)
+    _tableCache.pop(site, None)
+    return table
+
+
+def load_ephemeris_table(site):
+    '''
+    load_ephemeris_table: memory-maps the site's ephemeris table. Returns None if there is
+    no table, or if it is older than the master schedule or was built for other site
+    coordinates or another grid; run build_ephemeris_table to refresh it.
+    '''
+    path = table_path(site)
+    if not os.path.exists(path):
+        return None
+    key = (os.path.getmtime(path), os.path.getmtime(os.path.join(schedule_dir, schedule_files[site])), sites[site])
+    cached = _tableCache.get(site)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    table = None
+    if key[0] >= key[1]:
+        table = np.load(path, mmap_mode='r')
+        lat, lon = sites[site]
+        if len(table) > 0 and (table['lat'][0] != lat or table['lon'][0] != lon or
+                               table['lst'].shape[1] != night_grid(0).shape[1]):
+            table = None
+    _tableCache[site] = (key, table)
+    return table
+
+
+def table_night(site, mjd):
+    '''Ephemeris table row of a night, or None if the night is not in a current table.'''
+    table = load_ephemeris_table(site)
+    if table is None:
+        return None
+    idx = int(np.searchsorted(table['jd'], 2400000 + mjd))
+    if idx < len(table) and table['jd'][idx] == 2400000 + mjd:
+        return table[idx]
+    return None
+
+
+def get_ephemeris(site, mjd):
+    '''Returns the NightEphemeris for (site, mjd), from the ephemeris table if it has the
+    night and computed otherwise.'''
+    key = (site, mjd)
+    if key in _ephemerisCache:
+        eph = _ephemerisCache.pop(key)
+    else:
+        eph = NightEphemeris(site, mjd, row=table_night(site, mjd))
+        if len(_ephemerisCache) >= cache_size:
+            _ephemerisCache.popitem(last=False)
+    _ephemerisCache[key] = eph
+    return eph
+
+
+def ephemeris_for(site, times):
+    '''Returns the cached NightEphemeris for the night containing the given JDs.'''
+    return get_ephemeris(site, night_mjd(times))
+
+
+if __name__ == '__main__':
+    for site in sorted(sites):
+        table = build_ephemeris_table(site)
+        print("[PY] Built %s ephemeris table for %d nights: %s" % (site, len(table), table_path(site)))
@@ -1,5 +1,7 @@
 from __future__ import print_function, division
 import datetime
+import os
+import tempfile
 import numpy as np
 
 
@@ -11,64 +13,148 @@ def get_juldate():
     return julian
 
 
+# Schedule file columns kept in the parsed schedule, as (name, type, column).
+# The comment (north) and program list (south) are stored as text.
+northColumns = [('jd', float, 0), ('eboss', int, 1), ('manga', int, 2),
+                ('bright_start', float, 4), ('bright_end', float, 5),
+                ('dark_start', float, 6), ('dark_end', float, 7),
+                ('eboss_start', float, 8), ('eboss_end', float, 9),
+                ('manga_start', float, 10), ('manga_end', float, 11),
+                ('dark_order', int, 12), ('eng', int, 13), ('eng_type', int, 14),
+                ('RM_flag', int, 15),
+                ('mastar_start', float, 16), ('mastar_end', float, 17),
+                ('rm_start', float, 18), ('rm_end', float, 19),
+                ('sdss5_start', float, 20), ('sdss5_end', float, 21)]
+southColumns = [('jd', float, 0), ('survey', int, 1), ('survey2', int, 2),
+                ('bright_start', float, 4), ('bright_end', float, 5),
+                ('lead_survey', int, 12), ('eng_flag', int, 13), ('eng_type', int, 14)]
+
+# Parsed schedules, keyed by (schedule file path, south): (mtime, structured array sorted by jd)
+_scheduleCache = dict()
+
+
+def parse_schedule(filename, south=False):
+    '''
+    parse_schedule: parses a base schedule file into a structured array sorted by jd
+
+    INPUT: filename -- path to the base schedule file
+    OUTPUT: schedule -- NumPy structured array with one row per night
+    '''
+    columns = southColumns if south else northColumns
+    textname = 'programs' if south else 'comment'
+    schf = open(filename, 'r')
+    schlines = schf.read().splitlines()
+    schf.close()
+    rows = []
+    for line in schlines:
+        if line[0] == '#':
+            continue
+        tmp = line.split()
+        text = tmp[-1] if south else ' '.join(tmp[22:])
+        rows.append(tuple([kind(tmp[col]) for name, kind, col in columns]) + (text,))
+    textlen = max([1] + [len(row[-1]) for row in rows])
+    dtype = [(name, kind) for name, kind, col in columns] + [(textname, 'U%d' % textlen)]
+    schedule = np.array(rows, dtype=dtype)
+    return schedule[np.argsort(schedule['jd'], kind='mergesort')]
+
+
+def schedule_dtype_ok(schedule, south=False):
+    '''True if a parsed schedule has the columns parse_schedule gives for this site.'''
+    columns = southColumns if south else northColumns
+    textname = 'programs' if south else 'comment'
+    names = tuple([name for name, kind, col in columns] + [textname])
+    if schedule.dtype.names != names:
+        return False
+    for name, kind, col in columns:
+        if schedule.dtype[name] != np.dtype(kind):
+            return False
+    return schedule.dtype[textname].kind == 'U'
+
+
+def save_sidecar(sidecar, schedule):
+    '''Writes a parsed schedule to sidecar through a temporary file in the same
+    directory, renamed into place so readers never see a partial file.'''
+    fd, tmpname = tempfile.mkstemp(suffix='.npy', dir=os.path.dirname(os.path.abspath(sidecar)))
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            np.save(tmp, schedule)
+        os.rename(tmpname, sidecar)
+    except:
+        os.remove(tmpname)
+        raise
+
+
+def load_schedule(filename, south=False):
+    '''
+    load_schedule: returns the parsed schedule for a base schedule file
+
+    Parsed schedules are kept in memory and in a .npy sidecar next to the schedule
+    file, and are reparsed when the schedule file is newer than either copy or the
+    sidecar does not have the expected columns.
+    '''
+    mtime = os.path.getmtime(filename)
+    cached = _scheduleCache.get((filename, south))
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    sidecar = filename + '.npy'
+    schedule = None
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= mtime:
+        try:
+            schedule = np.load(sidecar, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            schedule = None
+        if schedule is not None and not schedule_dtype_ok(schedule, south=south):
+            schedule = None
+    if schedule is None:
+        schedule = parse_schedule(filename, south=south)
+        try:
+            save_sidecar(sidecar, schedule)
+        except (IOError, OSError):
+            # schedule directory is read-only; keep the in-memory copy only
+            pass
+    _scheduleCache[(filename, south)] = (mtime, schedule)
+    return schedule
+
+
+def schedule_night(row, south=False):
+    '''Converts one parsed schedule row into the dict returned by read_schedule.'''
+    night = dict((name, row[name].item()) for name in row.dtype.names)
+    if south:
+        night['programs'] = str(night['programs']).split(',')
+    else:
+        night['comment'] = str(night['comment']).split()
+    return night
+
+
+def find_night(jds, tonight):
+    '''
+    find_night: binary search for tonight in the sorted schedule jds
+
+    OUTPUT: index of tonight, or of the closest night if tonight is missing, and
+            whether tonight was found
+    '''
+    idx = int(np.searchsorted(jds, tonight))
+    if idx < len(jds) and jds[idx] == tonight:
+        return idx, True
+    if idx == len(jds) or (idx > 0 and tonight - jds[idx-1] <= jds[idx] - tonight):
+        idx -= 1
+    return idx, False
+
+
 def read_schedule(pwd, errors, mjd=-1, surveys=['apogee', 'eboss', 'manga'], loud=True, plan=False, south=False):
     '''
     read_schedule: reads in scheduler formatted nightly schedule
 
     INPUT: filename -- name of the base schedule file supplied by survey coordinator
-    OUTPUT: schedule -- list of dicts that contain the relevant survey times for each night.
+    OUTPUT: schedule -- dict that contains the relevant survey times for tonight.
     '''
-    # Read in SDSS-III schedule
-    schdir = '/'.join(pwd.split('/')[0:-2]) + "/schedules/"
-
-    # the following lines appear to do be duplicated below. commented out as a test. if no crashes, delete them
-    # schf = open(schdir+'Sch_base.6yrs.txt.frm.dat', 'r')
-    # schlines = schf.read().splitlines()
-    # schf.close()
-    # # Assign values to schedule dict list
-    schedule = []
-    # for i in range(len(schlines)):
-    #     tmp = schlines[i].split()
-    #     # Assign already-computed values to dict
-    #     schedule.append({'jd': float(tmp[0]), 'eboss': int(tmp[1]), 'manga': int(tmp[2]), 'bright_start': float(tmp[4]),
-    #                      'bright_end': float(tmp[5]), 'dark_start': float(tmp[6]), 'dark_end': float(tmp[7]),
-    #                      'eboss_start': float(tmp[8]), 'eboss_end': float(tmp[9]), 'manga_start': float(tmp[10]), 'manga_end': float(tmp[11])})
     # Read in SDSS-IV schedule
+    schdir = '/'.join(pwd.split('/')[0:-2]) + "/schedules/"
     if south:
-        schf = open(schdir+'Sch_LCO_base.dat', 'r')
-        schlines = schf.read().splitlines()
-        schf.close()
-        # Assign values to schedule dict list
-        for line in schlines:
-            if line[0] == '#':
-                continue
-            tmp = line.split()
-            programs = tmp[-1].split(',')
-            # Assign already-computed values to dict
-            schedule.append({'jd': float(tmp[0]), 'survey': int(tmp[1]), 'survey2': int(tmp[2]), 'bright_start': float(tmp[4]),
-                             'bright_end': float(tmp[5]), 'lead_survey': int(tmp[12]), 'eng_flag': int(tmp[13]), 'eng_type': int(tmp[14]),
-                             'programs': programs})
+        schedule = load_schedule(schdir+'Sch_LCO_base.dat', south=True)
     else:
-        schf = open(schdir+'Sch_base.18_eb_MaStar.txt', 'r')
-        schlines = schf.read().splitlines()
-        schf.close()
-        # Assign values to schedule dict list
-        for line in schlines:
-            if line[0] == '#':
-                continue
-            tmp = line.split()
-            # Assign already-computed values to dict
-            schedule.append({'jd': float(tmp[0]), 'eboss': int(tmp[1]), 'manga': int(tmp[2]),
-                             'bright_start': float(tmp[4]), 'bright_end': float(tmp[5]),
-                             'dark_start': float(tmp[6]), 'dark_end': float(tmp[7]),
-                             'eboss_start': float(tmp[8]), 'eboss_end': float(tmp[9]),
-                             'manga_start': float(tmp[10]), 'manga_end': float(tmp[11]),
-                             'dark_order': int(tmp[12]), 'eng': int(tmp[13]), 'eng_type': int(tmp[14]),
-                             'RM_flag': int(tmp[15]),
-                             'mastar_start': float(tmp[16]), 'mastar_end': float(tmp[17]),
-                             'rm_start': float(tmp[18]), 'rm_end': float(tmp[19]),
-                             'sdss5_start': float(tmp[20]), 'sdss5_end': float(tmp[21]),
-                             'comment': tmp[22:] })
+        schedule = load_schedule(schdir+'Sch_base.18_eb_MaStar.txt')
 
     # Determine what line in the schedule to use for tonight
     if mjd < 0:
@@ -89,41 +175,41 @@ def read_schedule(pwd, errors, mjd=-1, surveys=['apogee', 'eboss', 'manga'], lou
         print("[PY] Scheduling MJD %5d" % (tonight - 2400000))
 
     # Find line to use in the schedule file
-    currjd = [x for x in range(len(schedule)) if schedule[x]['jd'] == tonight]
-    # If this line doesn't exist, find the closest day
-    if not len(currjd) > 0:
-        currjd = np.argsort([np.abs(schedule[x]['jd']-tonight) for x in range(len(schedule))])
-        errors.append('MJD ERROR: JD %d not present in schedule file. Using JD = %d instead.' % (tonight, schedule[currjd[0]]['jd']))
+    currjd, found = find_night(schedule['jd'], tonight)
+    # If this line doesn't exist, use the closest day
+    if not found:
+        errors.append('MJD ERROR: JD %d not present in schedule file. Using JD = %d instead.' % (tonight, schedule['jd'][currjd]))
+    night = schedule_night(schedule[currjd], south=south)
 
     if south:
-        return schedule[currjd[0]]
+        return night
 
     # See if schedule needs to be adjusted based on what surveys are being run tonight
     # Is eBOSS offline, but MaNGA isn't? MaNGA gets all of dark time.
     if 'manga' in surveys and not 'eboss' in surveys:
-        schedule[currjd[0]]['manga_start'] = schedule[currjd[0]]['dark_start']
-        schedule[currjd[0]]['manga_end'] = schedule[currjd[0]]['dark_end']
-        schedule[currjd[0]]['eboss_start'] = 0
-        schedule[currjd[0]]['eboss_end'] = 0
-        schedule[currjd[0]]['eboss'] = 0
+        night['manga_start'] = night['dark_start']
+        night['manga_end'] = night['dark_end']
+        night['eboss_start'] = 0
+        night['eboss_end'] = 0
+        night['eboss'] = 0
     # Is MaNGA offline, but eBOSS isn't? eBOSS gets all of dark time.
     if 'eboss' in surveys and not 'manga' in surveys:
-        schedule[currjd[0]]['eboss_start'] = schedule[currjd[0]]['dark_start']
-        schedule[currjd[0]]['eboss_end'] = schedule[currjd[0]]['dark_end']
-        schedule[currjd[0]]['manga_start'] = 0
-        schedule[currjd[0]]['manga_end'] = 0
-        schedule[currjd[0]]['manga'] = 0
+        night['eboss_start'] = night['dark_start']
+        night['eboss_end'] = night['dark_end']
+        night['manga_start'] = 0
+        night['manga_end'] = 0
+        night['manga'] = 0
     # Are both dark-time surveys offline? APOGEE-II gets everything.
     if not 'eboss' in surveys and not 'manga' in surveys:
-        schedule[currjd[0]]['bright_start'] = min([x for x in [schedule[currjd[0]]['bright_start'], schedule[currjd[0]]['dark_start']] if x > 0])
-        schedule[currjd[0]]['bright_end'] = max([x for x in [schedule[currjd[0]]['bright_end'], schedule[currjd[0]]['dark_end']] if x > 0])
-        schedule[currjd[0]]['eboss_start'] = 0
-        schedule[currjd[0]]['eboss_end'] = 0
-        schedule[currjd[0]]['eboss'] = 0
-        schedule[currjd[0]]['manga_start'] = 0
-        schedule[currjd[0]]['manga_end'] = 0
-        schedule[currjd[0]]['manga'] = 0
+        night['bright_start'] = min([x for x in [night['bright_start'], night['dark_start']] if x > 0])
+        night['bright_end'] = max([x for x in [night['bright_end'], night['dark_end']] if x > 0])
+        night['eboss_start'] = 0
+        night['eboss_end'] = 0
+        night['eboss'] = 0
+        night['manga_start'] = 0
+        night['manga_end'] = 0
+        night['manga'] = 0
     # APOGEE-II is offline. What happens?
     # TO-DO
 
-    return schedule[currjd[0]]
+    return night
@@ -0,0 +1,214 @@
+from __future__ import print_function, division
+import numpy as np
+from autoscheduler.sdssUtilities.idlasl import hadec2altaz, co_refract_forward, premat
+
+# OBS_MATRIX
+# DESCRIPTION: Array kernels shared by the observability engines. Plate quantities are
+#              passed as 1-D columns (n_plates) and slot quantities as 1-D rows (n_slots);
+#              every kernel broadcasts them into an (n_plates, n_slots) matrix. The *_at
+#              kernels instead work element by element on (plate, slot) pairs, such as the
+#              candidates returned by LSTWindowIndex.
+
+
+def wrap_lst_window_at(minlst, maxlst, beglst, endlst):
+    '''Adjust plate LST windows for 24 hour wrapping against (plate, slot) pairs.
+    INPUT: minlst, maxlst -- plate LST window limits [hours]
+           beglst, endlst -- slot start/end LSTs [hours], broadcast against the windows
+    OUTPUT: usedminlst, usedmaxlst -- wrapped window limits'''
+    minlst = np.asarray(minlst, dtype=float)
+    maxlst = np.asarray(maxlst, dtype=float)
+    beglst = np.asarray(beglst, dtype=float)
+    endlst = np.asarray(endlst, dtype=float)
+
+    # Window straddles 0h, slot in the evening half of the LST range
+    up = (minlst < 0) & (beglst > 12) & (endlst > 12)
+    # Window straddles 24h, slot in the morning half of the LST range
+    down = (maxlst > 24) & (beglst < 12) & (endlst < 12)
+    # Slot itself straddles 24h
+    slotwrap = beglst > endlst
+
+    shift = 24.0 * up - 24.0 * down
+    usedminlst = minlst + shift + 24.0 * (slotwrap & (minlst < 12))
+    usedmaxlst = maxlst + shift - 24.0 * (slotwrap & (maxlst > 12))
+    return usedminlst, usedmaxlst
+
+
+def outside_window_at(minlst, maxlst, beglst, endlst):
+    '''True where a slot is not wholly within the (wrapped) plate LST window; the
+    arguments are as for wrap_lst_window_at.'''
+    usedminlst, usedmaxlst = wrap_lst_window_at(minlst, maxlst, beglst, endlst)
+    return (beglst < usedminlst) | (endlst > usedmaxlst)
+
+
+class LSTWindowIndex(object):
+    '''Interval index over plate LST windows [minlst, maxlst], with 24 hour wrapping.
+
+    Windows are stored by their start LST (mod 24) in sorted order, so the windows that
+    contain a given LST are found with a binary search over the starts that lie less than
+    the widest window before it. A slot can only be within a plate's window if its start
+    LST is, so the index gives the candidate plates of each slot; outside_window_at then
+    makes the exact check on the candidates alone.
+
+    INPUT: minlst, maxlst -- plate LST window limits [hours]; plates with a NaN limit
+           are never candidates'''
+
+    # Slack on the query, so rounding in the mod 24 starts cannot drop a candidate
+    tolerance = 1e-6
+
+    def __init__(self, minlst, maxlst):
+        minlst = np.asarray(minlst, dtype=float)
+        maxlst = np.asarray(maxlst, dtype=float)
+        valid = ~(np.isnan(minlst) | np.isnan(maxlst))
+        width = np.where(valid, maxlst - minlst, 0.0)
+        # Empty, inverted or full-day windows are checked against every slot
+        self.always = np.where(valid & ((width <= 0) | (width >= 24)))[0]
+        plates = np.where(valid & (width > 0) & (width < 24))[0]
+        start = minlst[plates] % 24
+        order = np.argsort(start, kind='mergesort')
+        self.plates = plates[order]
+        self.start = start[order]
+        self.end = self.start + width[self.plates]
+        self.maxwidth = np.max(width[self.plates]) if len(self.plates) > 0 else 0.0
+
+    def covering(self, lst):
+        '''Candidate plates (sorted indices) whose window contains the LST lst [hours].'''
+        lst = lst % 24
+        found = [self.always]
+        # Windows starting today, and windows starting yesterday that wrap past 24h
+        for point in (lst, lst + 24):
+            lo = np.searchsorted(self.start, point - self.maxwidth - self.tolerance, side='left')
+            hi = np.searchsorted(self.start, point + self.tolerance, side='right')
+            found.append(self.plates[lo + np.where(self.end[lo:hi] >= point - self.tolerance)[0]])
+        return np.unique(np.concatenate(found))
+
+    def candidates(self, beglst):
+        '''(plate, slot) index pairs of the plates whose window contains each slot start.'''
+        found = [self.covering(b) for b in np.asarray(beglst, dtype=float)]
+        plates = np.concatenate([np.zeros(0, dtype=int)] + found).astype(int)
+        slots = np.repeat(np.arange(len(found)), [len(f) for f in found])
+        return plates, slots
+
+    def within(self, minlst, maxlst, beglst, endlst):
+        '''(plate, slot) index pairs where the slot is wholly within the plate window.
+        minlst and maxlst must be the limits the index was built from.'''
+        beglst = np.asarray(beglst, dtype=float)
+        endlst = np.asarray(endlst, dtype=float)
+        plates, slots = self.candidates(beglst)
+        inside = ~outside_window_at(np.asarray(minlst, dtype=float)[plates], np.asarray(maxlst, dtype=float)[plates],
+                                    beglst[slots], endlst[slots])
+        return plates[inside], slots[inside]
+
+
+def transit_weight(platelst, beglst, endlst, lengths):
+    '''Gaussian prioritization on time from transit, with 24 hour wrapping.
+    INPUT: platelst -- plate transit LSTs [hours]
+           beglst, endlst -- slot start/end LSTs [hours]
+           lengths -- slot lengths [hours]
+    OUTPUT: (n_plates, n_slots) matrix of 50 * exp(-dt**2 / 2)'''
+    platelst = np.asarray(platelst, dtype=float)[:, np.newaxis]
+    beglst = np.asarray(beglst, dtype=float)[np.newaxis, :]
+    endlst = np.asarray(endlst, dtype=float)[np.newaxis, :]
+    lengths = np.asarray(lengths, dtype=float)[np.newaxis, :]
+
+    slotwrap = beglst > endlst
+    lstsum = np.where(slotwrap, beglst + endlst - 24, beglst + endlst)
+    usedplatelst = np.where(slotwrap,
+                            np.where(platelst > 12, platelst - 24, platelst),
+                            np.where((beglst > 18) & (platelst < 4), platelst + 24,
+                                     np.where((beglst < 4) & (platelst > 18), platelst - 24, platelst)))
+    return 50.0 * np.exp(-(usedplatelst - lstsum / 2 + lengths / 2)**2 / 2)
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    '''Great circle distance [deg] between plates (ra1, dec1) and slot targets (ra2, dec2).'''
+    ra1 = np.radians(np.asarray(ra1, dtype=float))[:, np.newaxis]
+    dec1 = np.radians(np.asarray(dec1, dtype=float))[:, np.newaxis]
+    ra2 = np.radians(np.asarray(ra2, dtype=float))[np.newaxis, :]
+    dec2 = np.radians(np.asarray(dec2, dtype=float))[np.newaxis, :]
+
+    # Vincenty formula, well behaved at both small and large separations
+    dra = ra2 - ra1
+    num = np.hypot(np.cos(dec2) * np.sin(dra),
+                   np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(dra))
+    den = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(dra)
+    return np.degrees(np.arctan2(num, den))
+
+
+def unit_vectors(ra, dec):
+    '''Cartesian unit vectors (..., 3) of sky positions [deg].'''
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+class SkyIndex(object):
+    '''Declination-zone index over plate centers, for cap (cone) queries.
+
+    Plates are stored as unit vectors in order of declination, so the plates that can lie
+    within a cap of radius r around (ra, dec) are found with a binary search for the band
+    |dec' - dec| <= r. Within the band a dot product with the cap center discards the
+    plates clearly outside the cap, and only the rest are checked with angular_separation.
+    Used for moon avoidance, where each slot excludes a cap of radius par['moon_threshold']
+    around the moon.
+
+    INPUT: ra, dec -- plate centers [deg]; plates with a NaN coordinate are never returned'''
+
+    # Slack [deg] on the band and dot product limits, so rounding cannot drop a plate on the
+    # edge of the cap
+    tolerance = 1e-6
+
+    def __init__(self, ra, dec):
+        ra = np.asarray(ra, dtype=float)
+        dec = np.asarray(dec, dtype=float)
+        plates = np.where(~(np.isnan(ra) | np.isnan(dec)))[0]
+        order = np.argsort(dec[plates], kind='mergesort')
+        self.plates = plates[order]
+        self.ra = ra[self.plates]
+        self.dec = dec[self.plates]
+        self.xyz = unit_vectors(self.ra, self.dec)
+
+    def near(self, ra, dec, radius):
+        '''Sorted indices of the plates less than radius [deg] from (ra, dec).'''
+        lo = np.searchsorted(self.dec, dec - radius - self.tolerance, side='left')
+        hi = np.searchsorted(self.dec, dec + radius + self.tolerance, side='right')
+        cosmax = np.cos(np.radians(min(radius + self.tolerance, 180.0)))
+        band = lo + np.where(np.dot(self.xyz[lo:hi], unit_vectors(ra, dec)) >= cosmax)[0]
+        sep = angular_separation(self.ra[band], self.dec[band], [ra], [dec])[:, 0]
+        return np.sort(self.plates[band][sep < radius])
+
+    def pairs(self, ras, decs, radius):
+        '''(plate, slot) index pairs of the plates less than radius [deg] from each slot
+        position (ras, decs).'''
+        found = [self.near(r, d, radius) for r, d in zip(np.asarray(ras, dtype=float), np.asarray(decs, dtype=float))]
+        plates = np.concatenate([np.zeros(0, dtype=int)] + found).astype(int)
+        slots = np.repeat(np.arange(len(found)), [len(f) for f in found])
+        return plates, slots
+
+
+def julian_epoch(jd):
+    '''Julian epoch [years] of a JD, the equinox secz_at precesses plate centers to.'''
+    return 2000.0 + (np.asarray(jd, dtype=float) - 2451545.0) / 365.25
+
+
+def secz_at(ra, dec, lst, lat, refraction=False, equinox=None):
+    '''Airmass (sec z) of plates at LSTs, from idlasl.hadec2altaz.
+    INPUT: ra, dec -- plate centers [deg]
+           lst -- LSTs [hours]; ra, dec and lst broadcast against each other
+           lat -- site latitude [deg]
+           refraction -- use the refracted (observed) altitude from co_refract_forward
+           equinox -- if given, precess the J2000 plate centers to this equinox [years]
+    OUTPUT: sec z; negative below the horizon'''
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    if equinox is not None:
+        xyz = np.dot(unit_vectors(ra, dec), premat(2000.0, equinox).T)
+        ra = np.degrees(np.arctan2(xyz[..., 1], xyz[..., 0]))
+        dec = np.degrees(np.arcsin(np.clip(xyz[..., 2], -1, 1)))
+    ha = np.asarray(lst, dtype=float) * 15.0 - ra
+    alt = hadec2altaz(ha, dec, lat)[0]
+    if refraction:
+        # co_refract_forward works on 1-D arrays; the observed altitude is about the true
+        # altitude plus the correction it returns
+        alt = alt + co_refract_forward(alt.ravel()).reshape(alt.shape)
+    with np.errstate(divide='ignore'):
+        return 1 / np.sin(np.radians(alt))
@@ -2,16 +2,49 @@ from __future__ import print_function, division
 from time import time
 import os
 import sys
+import threading
 import sqlalchemy
 from sqlalchemy import or_
+from sqlalchemy import event
 import numpy as np
 # from sdss.apogee.plate_completion import completion
 
 
+# DESCRIPTION: Methods shared by ApogeePlate and PlateTable rows
+class PlateMethods(object):
+    # Determine most recent observation time
+    def maxhist(self):
+        return float(self.last_jd)
+
+    # Determine first observation time
+    def minhist(self):
+        return float(self.first_jd)
+
+    # Determine plate completion percentage
+    def pct(self):
+        # Something is wrong here...
+        if self.vplan == 0: return 1
+
+        try:
+            # 90% of completion percentage is from number of visits
+            visit_completion = 0.9 * min([1, self.vdone / self.vplan])
+            # 10% of completion percentage is from S/N
+            sn_completion = 0.1 * calculateSnCompletion(self.vplan, self.sn)
+            return visit_completion + sn_completion
+        except:
+            raise RuntimeError("ERROR: unable to calculate completion for vplan: %d, vdone: %d, sn: %d\n%s" %\
+                (self.vplan, self.vdone, self.sn, sys.exc_info()))
+
+    # Exposures as a list of dicts, built on access from the exposures array
+    @property
+    def exposureList(self):
+        return ExposureList(self.exposures)
+
+
 # DESCRIPTION: APOGEE Plate Object
-class ApogeePlate(object):
+class ApogeePlate(PlateMethods):
     # Identifying plate information
-    def __init__(self, plate=None):
+    def __init__(self, plate=None, lead_survey=None):
         if plate is None:
             raise Exception("Somehow tried to make plate object without a plate")
         # properties we get from plate object
@@ -35,37 +68,31 @@ class ApogeePlate(object):
         self._plugged = None
 
         self._exp_time = None
-        self._lead_survey = None
+        # 'apg' or 'man' when resolved by the plate query, else derived on first use
+        self._lead_survey = lead_survey
         self._coobs = None
 
         # only applicable to LCO
         self._apogee_survey_mode = None
 
         # catch values not set properly
-        if 'apogee_design_type' in self.ddict:
-            self.cadence = self.ddict['apogee_design_type']
-            self.driver = self.ddict['apogee_design_driver']
-            self.vplan = int(self.ddict['apogee_n_design_visits'])
-            self.apgver = 100*int(self.ddict['apogee_short_version'])\
-                + 10*int(self.ddict['apogee_med_version'])\
-                + int(self.ddict['apogee_long_version'])
-        else:
-            self.cadence = 'default'
-            self.driver = 'default'
-            self.vplan = 3
-            self.apgver = 999
+        self.cadence, self.driver, self.vplan, self.apgver = designAttributes(self.ddict)
 
         # properties requiring exposure info
         self.vdone = 0
         self.sn = 0.0
-        self.hist = ''
+        # visit JDs, and whether each visit is fully reduced (1) or not (0)
+        self.hist = np.zeros(0, dtype=int)
         self.snql = 0.0
         self.snred = 0.0
-        self.reduction = ''
-        # exposures returns a list of dicts for each exposure
-        # keys: exp_no, mjd, quality, start_time, exp_time, qr_sn2, apr_sn2
+        self.reduction = np.zeros(0, dtype=int)
+        # first and last visit JDs, 0 if never visited
+        self.first_jd = 0.0
+        self.last_jd = 0.0
+        # exposures is this plate's slice of the exposure array (exposureDtype);
+        # exposureList views it as one dict per exposure
         # apr_sn2 may be nan if not processed yet. 
-        self.exposureList = list()
+        self.exposures = np.zeros(0, dtype=exposureDtype)
 
         # properties not set in get_plates
         self.priority = 0.0
@@ -124,22 +151,15 @@ class ApogeePlate(object):
     def lead_survey(self):
         if self._lead_survey is None:
             if self.plate.currentSurveyMode is None:
-                self._lead_survey = 'apg'
-            elif self.plate.currentSurveyMode.label == 'APOGEE lead':
-                self._lead_survey = 'apg'
+                self._lead_survey = leadSurvey(None)
             else:
-                self._lead_survey = 'man'
+                self._lead_survey = leadSurvey(self.plate.currentSurveyMode.label)
         return self._lead_survey
 
     @property
     def exp_time(self):
         if self._exp_time is None:
-            if "apogee_exposure_time" in self.ddict:
-                self._exp_time = float(self.ddict['apogee_exposure_time'])
-            elif self.lead_survey == 'apg':
-                self._exp_time = 500.0
-            else:
-                self._exp_time = 450.0
+            self._exp_time = exposureTime(self.ddict, self.lead_survey)
         return self._exp_time
 
     @property
@@ -161,39 +181,427 @@ class ApogeePlate(object):
         return self._apogee_survey_mode
 
 
-# ----------------------------
-# useful methods
-# ----------------------------
-    # Determine most recent observation time
-    def maxhist(self):
-        obsstr = self.hist.split(',')
-        if len(obsstr) == 0 or obsstr[0] == '':
-            return float(0.0)
-        obshist = [float(x) for x in obsstr if x != '']
-        return max(obshist)
+# DESCRIPTION: Columnar APOGEE plate table
+class PlateTable(object):
+    '''Holds one row per plate in a NumPy structured array (self.data) with the same
+    fields as ApogeePlate. Columns are available as attributes (e.g. apg.ra), integer
+    indexing returns a PlateRecord that behaves like an ApogeePlate, and indexing with a
+    slice, mask or index list returns a new PlateTable.'''
+    dtype = [('plateid', int), ('platepk', int), ('locationid', int), ('name', object),
+             ('plate_loc', object), ('ra', float), ('dec', float), ('ha', float), ('minha', float),
+             ('maxha', float), ('manual_priority', int), ('plugged', int), ('lead_survey', object),
+             ('cadence', object), ('driver', object), ('vplan', int), ('apgver', int),
+             ('exp_time', float), ('coobs', bool), ('apogee_survey_mode', object),
+             ('vdone', int), ('sn', float), ('hist', object), ('snql', float), ('snred', float),
+             ('reduction', object), ('first_jd', float), ('last_jd', float), ('exposures', object),
+             ('priority', float), ('stack', int)]
+
+    def __init__(self, nrows=0, data=None):
+        if data is None:
+            data = np.zeros(nrows, dtype=self.dtype)
+            for i in range(nrows):
+                data['hist'][i] = np.zeros(0, dtype=int)
+                data['reduction'][i] = np.zeros(0, dtype=int)
+                data['exposures'][i] = np.zeros(0, dtype=exposureDtype)
+        object.__setattr__(self, 'data', data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield PlateRecord(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self.data)
+            return PlateRecord(self, index)
+        return PlateTable(data=self.data[index])
+
+    def __getattr__(self, name):
+        if name in self.data.dtype.names:
+            return self.data[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.data.dtype.names:
+            self.data[name] = value
+        else:
+            object.__setattr__(self, name, value)
 
-    # Determine first observation time
-    def minhist(self):
-        obsstr = self.hist.split(',')
-        if len(obsstr) == 0 or obsstr[0] == '':
-            return float(0.0)
-        obshist = [float(x) for x in obsstr if x != '']
-        return min(obshist)
 
-    # Determine plate completion percentage
-    def pct(self):
-        # Something is wrong here...
-        if self.vplan == 0: return 1
+# DESCRIPTION: View of a single PlateTable row
+class PlateRecord(PlateMethods):
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_index', index)
 
+    def __getattr__(self, name):
         try:
-            # 90% of completion percentage is from number of visits
-            visit_completion = 0.9 * min([1, self.vdone / self.vplan])
-            # 10% of completion percentage is from S/N
-            sn_completion = 0.1 * calculateSnCompletion(self.vplan, self.sn)
-            return visit_completion + sn_completion
-        except:
-            raise RuntimeError("ERROR: unable to calculate completion for vplan: %d, vdone: %d, sn: %d\n%s" %\
-                (self.vplan, self.vdone, self.sn, sys.exc_info()))
+            value = self._table.data[name][self._index]
+        except ValueError:
+            raise AttributeError(name)
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def __setattr__(self, name, value):
+        self._table.data[name][self._index] = value
+
+
+# fields of one exposure, in the order of the exposureList dict keys
+exposureDtype = [('exp_no', int), ('mjd', float), ('quality', bool), ('start_time', float),
+                 ('exp_time', float), ('qr_sn2', float), ('apr_sn2', float)]
+
+
+# DESCRIPTION: Read-only list-of-dicts view of a plate's exposures
+class ExposureList(object):
+    def __init__(self, exposures):
+        self.exposures = exposures
+
+    def __len__(self):
+        return len(self.exposures)
+
+    def __iter__(self):
+        for i in range(len(self.exposures)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ExposureList(self.exposures[index])
+        return dict(zip(self.exposures.dtype.names, self.exposures[index].item()))
+
+
+def exposureArray(exposures_tab, plateids):
+    '''DESCRIPTION: Builds one exposure array, sorted by plate, with per-plate offsets
+    INPUT:
+        exposures_tab: float array of (mjd, plateid, qr snr, reduction snr, exp time,
+                       start time, exp no) rows
+        plateids: plate ids, one per plate
+    OUTPUT: exposures -- exposureDtype array, rows of plate i in exposures[offsets[i]:offsets[i+1]]
+                         and in query order within a plate
+            offsets'''
+    sortedids = np.argsort(plateids)
+    pos = np.searchsorted(plateids, exposures_tab[:, 1], sorter=sortedids)
+    pos = sortedids[np.minimum(pos, len(plateids) - 1)]
+    # rows of plates not in plateids are dropped
+    known = plateids[pos] == exposures_tab[:, 1]
+    pos = pos[known]
+    order = np.argsort(pos, kind='mergesort')
+    tab = exposures_tab[known][order]
+
+    exposures = np.zeros(len(tab), dtype=exposureDtype)
+    exposures['exp_no'] = tab[:, 6]
+    exposures['mjd'] = tab[:, 0]
+    exposures['quality'] = (tab[:, 2] > 10) | (tab[:, 3] > 10)
+    exposures['start_time'] = tab[:, 5]
+    exposures['exp_time'] = tab[:, 4]
+    exposures['qr_sn2'] = tab[:, 2]**2
+    exposures['apr_sn2'] = tab[:, 3]**2
+    offsets = np.append(0, np.cumsum(np.bincount(pos, minlength=len(plateids))))
+    return exposures, offsets
+
+
+def designAttributes(ddict):
+    ''' Returns cadence, driver, vplan and apgver from a design dictionary '''
+    # catch values not set properly
+    if 'apogee_design_type' in ddict:
+        return ddict['apogee_design_type'], ddict['apogee_design_driver'],\
+            int(ddict['apogee_n_design_visits']),\
+            100*int(ddict['apogee_short_version'])\
+            + 10*int(ddict['apogee_med_version'])\
+            + int(ddict['apogee_long_version'])
+    return 'default', 'default', 3, 999
+
+
+apogeeLeadLabel = 'APOGEE lead'
+
+
+def leadSurvey(surveyModeLabel):
+    ''' Maps a plate's current survey mode label to 'apg' or 'man' '''
+    if surveyModeLabel is None or surveyModeLabel == apogeeLeadLabel:
+        return 'apg'
+    return 'man'
+
+
+def apogeeLead(pdb):
+    ''' SQL condition for leadSurvey(...) == 'apg'. The query must outer join
+        Plate.currentSurveyMode, so this is a plain join filter rather than a
+        per-row platedb.lead_survey() call '''
+    return or_(pdb.SurveyMode.label == None, pdb.SurveyMode.label == apogeeLeadLabel)
+
+
+def exposureTime(ddict, lead_survey):
+    ''' Returns the APOGEE exposure time of a design '''
+    if "apogee_exposure_time" in ddict:
+        return float(ddict['apogee_exposure_time'])
+    elif lead_survey == 'apg':
+        return 500.0
+    return 450.0
+
+
+# design fields read by designAttributes, exposureTime and the coobs/survey mode columns
+designFields = ('apogee_design_type', 'apogee_design_driver', 'apogee_n_design_visits',
+                'apogee_short_version', 'apogee_med_version', 'apogee_long_version',
+                'apogee_exposure_time', 'instruments', 'apogee_survey_mode')
+
+
+def prefetchPointings(session, apg):
+    '''DESCRIPTION: Fills the pointing attributes of ApogeePlate objects with one joined query
+    INPUT:
+        session: DB session
+        apg: list of ApogeePlate objects
+    OUTPUT: none; sets ra, dec, ha, minha, maxha and manual_priority on every plate found'''
+    from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as pdb
+
+    if len(apg) == 0:
+        return
+    byPk = dict([(p.platepk, p) for p in apg])
+    rows = session.query(pdb.Plate.pk, pdb.Pointing.center_ra, pdb.Pointing.center_dec,
+                         pdb.PlatePointing.hour_angle, pdb.PlatePointing.ha_observable_min,
+                         pdb.PlatePointing.ha_observable_max, pdb.PlatePointing.priority)\
+        .join(pdb.Plate.plate_pointings).join(pdb.PlatePointing.pointing)\
+        .filter(pdb.Plate.pk.in_(list(byPk.keys())))\
+        .order_by(pdb.Plate.pk, pdb.Pointing.pk).all()
+
+    # keep the first pointing of each plate; plates without a row keep their lazy properties
+    done = set()
+    for pk, ra, dec, ha, minha, maxha, priority in rows:
+        if pk in done:
+            continue
+        done.add(pk)
+        p = byPk[pk]
+        p._ra = float(ra)
+        p._dec = float(dec)
+        p._ha = float(ha)
+        p._maxha = float(maxha) + 7.5
+        p._minha = float(minha) - 7.5
+        p._manual_priority = int(priority)
+
+
+# DESCRIPTION: Counts the SQL statements an engine runs while the counter is active
+class StatementCounter(object):
+    '''Context manager that listens to the engine only inside the with block, and counts only
+    the statements run by the thread that entered it, so calls in other threads or other
+    requests sharing the engine are not included.'''
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self._thread = None
+
+    def __enter__(self):
+        self.count = 0
+        self._thread = threading.current_thread()
+        if self.engine is not None:
+            event.listen(self.engine, 'before_cursor_execute', self._increment)
+        return self
+
+    def __exit__(self, *exc):
+        if self.engine is not None:
+            event.remove(self.engine, 'before_cursor_execute', self._increment)
+        return False
+
+    def _increment(self, *args):
+        if threading.current_thread() is self._thread:
+            self.count += 1
+
+
+def buildPlateTable(session, plateQuery, flag=None):
+    '''DESCRIPTION: Builds a PlateTable from a single joined query
+    INPUT:
+        session: DB session
+        plateQuery: query over pdb.Plate selecting the plates to load
+        flag: optional boolean SQL expression over pdb.Plate, evaluated in the same query
+    OUTPUT: apg -- PlateTable sorted by plate id
+            flagged -- set of the plate ids for which flag is true'''
+    from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as pdb
+
+    # cartridge of the active plugging of each plate
+    active = session.query(pdb.Plugging.plate_pk, pdb.Cartridge.number.label('cart'))\
+        .join(pdb.Cartridge).join(pdb.ActivePlugging).subquery()
+    # only the design values we need, one row per (design, field)
+    fieldLabel = sqlalchemy.func.lower(pdb.DesignField.label)
+    values = session.query(pdb.DesignValue.design_pk, fieldLabel.label('field'), pdb.DesignValue.value)\
+        .join(pdb.DesignField).filter(fieldLabel.in_(designFields)).subquery()
+
+    rows = session.query(pdb.Plate.pk, pdb.Plate.plate_id, pdb.Plate.name, pdb.Plate.location_id,
+                         pdb.PlateLocation.label, pdb.Pointing.pk, pdb.Pointing.center_ra,
+                         pdb.Pointing.center_dec, pdb.PlatePointing.hour_angle,
+                         pdb.PlatePointing.ha_observable_min, pdb.PlatePointing.ha_observable_max,
+                         pdb.PlatePointing.priority, pdb.SurveyMode.label, active.c.cart,
+                         values.c.field, values.c.value,
+                         sqlalchemy.literal(False) if flag is None else flag)\
+        .join(pdb.Plate.location)\
+        .join(pdb.Plate.plate_pointings).join(pdb.PlatePointing.pointing)\
+        .outerjoin(pdb.Plate.currentSurveyMode)\
+        .outerjoin(active, active.c.plate_pk == pdb.Plate.pk)\
+        .outerjoin(values, values.c.design_pk == pdb.Plate.design_pk)\
+        .filter(pdb.Plate.pk.in_(plateQuery.with_entities(pdb.Plate.pk).subquery()))\
+        .order_by(pdb.Plate.plate_id, pdb.Pointing.pk).all()
+
+    # collapse the (pointing, cart, design value) rows to one entry per plate,
+    # keeping the first pointing of each plate
+    order = list()
+    plates = dict()
+    flagged = set()
+    for row in rows:
+        if row[16]:
+            flagged.add(row[1])
+        if row[0] not in plates:
+            order.append(row[0])
+            plates[row[0]] = {'row': row, 'cart': 0, 'ddict': dict()}
+        entry = plates[row[0]]
+        if row[13] is not None:
+            entry['cart'] = row[13]
+        if row[14] is not None:
+            entry['ddict'][row[14]] = row[15]
+
+    apg = PlateTable(len(order))
+    for i, pk in enumerate(order):
+        row, ddict = plates[pk]['row'], plates[pk]['ddict']
+        p = apg[i]
+        p.platepk, p.plateid, p.name, p.locationid, p.plate_loc = row[0], row[1], row[2], row[3], row[4]
+        p.ra = float(row[6])
+        p.dec = float(row[7])
+        p.ha = np.nan if row[8] is None else float(row[8])
+        p.minha = np.nan if row[9] is None else float(row[9]) - 7.5
+        p.maxha = np.nan if row[10] is None else float(row[10]) + 7.5
+        p.manual_priority = 0 if row[11] is None else int(row[11])
+        p.lead_survey = leadSurvey(row[12])
+        p.plugged = plates[pk]['cart']
+        p.cadence, p.driver, p.vplan, p.apgver = designAttributes(ddict)
+        p.exp_time = exposureTime(ddict, p.lead_survey)
+        p.coobs = 'MANGA' in ddict.get('instruments', '')
+        p.apogee_survey_mode = ddict.get('apogee_survey_mode', 'unknown')
+    return apg, flagged
+
+
+def plateNights(exposures_tab):
+    '''DESCRIPTION: Reduces raw exposure rows to the plate-night rows returned by nightQuery
+    INPUT:
+        exposures_tab: float array of (mjd, plateid, qr snr, reduction snr, ...) rows
+    OUTPUT: float array of (mjd, plateid, good exposures, good exposures with a full reduction,
+            sum of best S/N^2, sum of quickred S/N^2, sum of reduction S/N^2) rows, one per
+            plate and mjd with good exposures, sorted by plateid and mjd'''
+    # good exposures: S/N > 10, using the quickred S/N where there is no full reduction
+    reduced = ~np.isnan(exposures_tab[:, 3])
+    qrsn = np.nan_to_num(exposures_tab[:, 2])
+    redsn = np.nan_to_num(exposures_tab[:, 3])
+    bestsn = np.where(reduced, redsn, qrsn)
+    good = bestsn > 10
+    expmjd, expplate = exposures_tab[good, 0], exposures_tab[good, 1]
+    columns = [np.ones(np.sum(good)), reduced[good].astype(float),
+               bestsn[good]**2, qrsn[good]**2, redsn[good]**2]
+
+    order = np.lexsort((expmjd, expplate))
+    expmjd, expplate = expmjd[order], expplate[order]
+    newnight = np.ones(len(order), dtype=bool)
+    newnight[1:] = (np.diff(expplate) != 0) | (np.diff(expmjd) != 0)
+    start = np.where(newnight)[0]
+    if len(start) == 0:
+        return np.zeros((0, 7))
+    return np.column_stack([expmjd[start], expplate[start]] +
+                           [np.add.reduceat(x[order], start) for x in columns])
+
+
+def nightQuery(session, plateids):
+    '''DESCRIPTION: Aggregates the Object exposures of the given plates per plate-night in SQL
+    INPUT:
+        session: DB session
+        plateids: plate ids to load
+    OUTPUT: query returning the plateNights rows'''
+    from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as pdb
+    from autoscheduler.plateDBtools.database.apo.apogeeqldb import ModelClasses as qldb
+
+    qrsn = sqlalchemy.func.coalesce(qldb.Quickred.snr_standard, 0)
+    redsn = sqlalchemy.func.coalesce(qldb.Reduction.snr, 0)
+    bestsn = sqlalchemy.func.coalesce(qldb.Reduction.snr, qldb.Quickred.snr_standard, 0)
+    good = session.query(sqlalchemy.func.floor(pdb.Exposure.start_time/86400+.3).label('mjd'),
+                         pdb.Plate.plate_id, qldb.Reduction.snr.label('reduced'),
+                         (bestsn*bestsn).label('sn2'), (qrsn*qrsn).label('qrsn2'),
+                         (redsn*redsn).label('redsn2'))\
+        .join(pdb.Survey).join(pdb.ExposureFlavor)\
+        .join(pdb.Observation).join(pdb.PlatePointing).join(pdb.Plate)\
+        .outerjoin(qldb.Quickred).outerjoin(qldb.Reduction)\
+        .filter(pdb.ExposureFlavor.label == 'Object')\
+        .filter(pdb.Plate.plate_id.in_(plateids))\
+        .filter(bestsn > 10).subquery()
+    return session.query(good.c.mjd, good.c.plate_id, sqlalchemy.func.count(),
+                         sqlalchemy.func.count(good.c.reduced), sqlalchemy.func.sum(good.c.sn2),
+                         sqlalchemy.func.sum(good.c.qrsn2), sqlalchemy.func.sum(good.c.redsn2))\
+        .group_by(good.c.plate_id, good.c.mjd)\
+        .order_by(good.c.plate_id, good.c.mjd)
+
+
+def aggregateVisits(nights, plateids, locationids, apgvers, mjd=None):
+    '''DESCRIPTION: Groups plate-nights into visits with one sort and reduceat pass
+    INPUT:
+        nights: float array of plateNights rows
+        plateids, locationids, apgvers: plate columns; plates sharing a location and
+                                        apgver share their visits
+        mjd: exposures taken on this mjd are ignored
+    OUTPUT: dict of per-plate vdone, sn, snql, snred, first_jd, last_jd arrays, plus the visit JDs ('hist')
+            and reduction flags (1 if every exposure has a full reduction) of plate i
+            in hist[offsets[i]:offsets[i+1]]'''
+    nplates = len(plateids)
+
+    # group id of each plate, on (locationid, apgver)
+    porder = np.lexsort((apgvers, locationids))
+    newgroup = np.ones(nplates, dtype=bool)
+    newgroup[1:] = (np.diff(locationids[porder]) != 0) | (np.diff(apgvers[porder]) != 0)
+    plategroup = np.empty(nplates, dtype=int)
+    plategroup[porder] = np.cumsum(newgroup) - 1
+    ngroups = int(np.sum(newgroup))
+
+    good = np.ones(len(nights), dtype=bool)
+    if mjd is not None:
+        good &= nights[:, 0] != mjd
+    nights = nights[good]
+    sortedids = np.argsort(plateids)
+    expplate = sortedids[np.searchsorted(plateids, nights[:, 1], sorter=sortedids)]
+    expgroup = plategroup[expplate]
+    expmjd = nights[:, 0]
+
+    # one run per (group, mjd); a night with 2+ good exposures is a visit
+    eorder = np.lexsort((expmjd, expgroup))
+    expgroup, expmjd = expgroup[eorder], expmjd[eorder]
+    newrun = np.ones(len(eorder), dtype=bool)
+    newrun[1:] = (np.diff(expgroup) != 0) | (np.diff(expmjd) != 0)
+    runstart = np.where(newrun)[0]
+    if len(runstart) > 0:
+        runsums = [np.add.reduceat(nights[eorder, c], runstart) for c in range(2, 7)]
+    else:
+        runsums = [np.zeros(0)] * 5
+    visit = runsums[0] >= 2
+    visitgroup = expgroup[runstart][visit]
+    visitjd = expmjd[runstart][visit].astype(int) + 2400000
+    # fully reduced if every good exposure of the visit has a full reduction
+    visitred = (runsums[1] == runsums[0])[visit].astype(int)
+    runsums = [x[visit] for x in runsums[2:]]
+
+    # per-group totals, in mjd order
+    groupvisits = np.bincount(visitgroup, minlength=ngroups)
+    groupstart = np.append(0, np.cumsum(groupvisits))
+    totals = [np.bincount(visitgroup, weights=x, minlength=ngroups) for x in runsums]
+
+    # hand every plate the visits of its group
+    pvisits = groupvisits[plategroup]
+    offsets = np.append(0, np.cumsum(pvisits))
+    index = np.repeat(groupstart[plategroup] - offsets[:-1], pvisits) + np.arange(offsets[-1])
+
+    # visits are in mjd order within a group, so the first and last visits bound the history
+    visited = pvisits > 0
+    first_jd = np.zeros(nplates)
+    last_jd = np.zeros(nplates)
+    first_jd[visited] = visitjd[groupstart[plategroup][visited]]
+    last_jd[visited] = visitjd[groupstart[plategroup + 1][visited] - 1]
+    return {'vdone': pvisits, 'sn': totals[0][plategroup], 'snql': totals[1][plategroup],
+            'snred': totals[2][plategroup], 'offsets': offsets,
+            'hist': visitjd[index], 'reduction': visitred[index],
+            'first_jd': first_jd, 'last_jd': last_jd}
 
 
 def calculateSnCompletion(vplan, sn):
@@ -214,8 +622,21 @@ def getPlateid(item):
         return item.plateid
 
 
+def sortPlates(apg, plateList, plateidDict):
+    ''' Orders get_plates output by plate id, restricted to plateList if given '''
+    if plateList is not None:
+        plateList = list(plateList)
+        plateList = sorted(plateList)
+        order = [plateidDict[p] for p in plateList]
+    else:
+        order = sorted(range(len(apg)), key=lambda i: apg[i].plateid)
+    if isinstance(apg, PlateTable):
+        return apg[np.array(order, dtype=int)]
+    return [apg[i] for i in order]
+
+
 def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, allPlates=False, 
-               plateList=None, south=False, mjd=None):
+               plateList=None, south=False, mjd=None, table=False, prefetch=True, exposureList=True):
     '''DESCRIPTION: Reads in APOGEE-II plate information from platedb
     INPUT: 
         plan: grabs everything that can be observed tonight (i.e. on the mountain, marked accepted)
@@ -226,7 +647,11 @@ def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, all
         plateList: a list of integers corresponding to plates; must be iterable.
         south: pull from lco-db (works at LCO)
         mjd: only used at lco; excludes exposures taken on mjd to keep schedule consistent through night
-    OUTPUT: apg -- list of objects with all APOGEE-II plate information'''
+        table: return a PlateTable built from one joined query instead of ApogeePlate objects
+        prefetch: load the pointing attributes of all ApogeePlate objects in one query
+        exposureList: load every exposure to fill the plates' exposureList; if False, exposure
+                      S/N is aggregated per plate-night in SQL and exposureList stays empty
+    OUTPUT: apg -- list of objects (or PlateTable) with all APOGEE-II plate information'''
     start_time = time()
 
     if session is None:
@@ -239,6 +664,24 @@ def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, all
         else:
             from autoscheduler.plateDBtools.database.connections.LCODatabaseUserLocalConnection import db
         session = db.Session()
+
+    # the number of statements is printed in loud mode
+    with StatementCounter(session.bind) as counter:
+        apg = queryPlates(session, start_time, plan=plan, loud=loud, allPlates=allPlates,
+                          plateList=plateList, south=south, mjd=mjd, table=table,
+                          prefetch=prefetch, exposureList=exposureList)
+    if loud:
+        print('[SQL]: get_plates issued {} statements'.format(counter.count))
+    return apg
+
+
+def queryPlates(session, start_time, plan=False, loud=True, allPlates=False, plateList=None,
+                south=False, mjd=None, table=False, prefetch=True, exposureList=True):
+    '''DESCRIPTION: Does the work of get_plates with a DB session
+    INPUT: session -- DB session
+           start_time -- time() at the start of get_plates, for the timing info
+           other arguments as for get_plates
+    OUTPUT: apg -- list of objects (or PlateTable) with all APOGEE-II plate information'''
     # currently, model classes should work equally well in north and south. this is desireable
     from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as pdb
     from autoscheduler.plateDBtools.database.apo.apogeeqldb import ModelClasses as qldb
@@ -281,79 +724,105 @@ def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, all
         # otherwise would have to duplicate queries below, undesireable
         plateLoc2 = None
 
-    # Pull all relevant plate information for APOGEE plates
-    protoList = list()
+    # Pull all relevant plate information for APOGEE plates. The plates that determine which
+    # locations are loaded (protoQuery) and their location IDs are subselects of plateQuery,
+    # and membership of protoQuery comes back as a flag on the plates, so each branch is a
+    # single round trip. The location ID subselect reads the same tables as plateQuery, so
+    # its correlation is turned off; otherwise it would collapse onto the outer plate row.
+    protoQuery = None
     with session.begin():
         if plateList is not None:
             # getting plates with same loc id as requested plates to determine hist & completion
             locIDS = session.query(pdb.Plate.location_id)\
+               .join(pdb.PlateToSurvey, pdb.Survey)\
                .filter(pdb.Survey.pk == survey.pk)\
-               .filter(pdb.Plate.plate_id.in_(plateList)).all()
+               .filter(pdb.Plate.plate_id.in_(plateList)).correlate(None).subquery()
 
-            plates = session.query(pdb.Plate)\
+            plateQuery = session.query(pdb.Plate)\
                .join(pdb.PlateToSurvey, pdb.Survey)\
                .filter(pdb.Survey.pk == survey.pk)\
-               .filter(pdb.Plate.location_id.in_(locIDS)).all()
+               .filter(pdb.Plate.location_id.in_(locIDS))
 
         elif plan:
-            protoList = session.query(pdb.Plate.plate_id)\
+            protoQuery = session.query(pdb.Plate.plate_id)\
                     .join(pdb.PlateToSurvey, pdb.Survey)\
                     .join(pdb.PlateLocation)\
                     .join(pdb.PlateToPlateStatus, pdb.PlateStatus)\
+                    .outerjoin(pdb.Plate.currentSurveyMode)\
                     .filter(pdb.Survey.pk == survey.pk)\
                     .filter(or_(pdb.Plate.location == plateLoc, pdb.Plate.location == plateLoc2))\
-                    .filter(sqlalchemy.func.platedb.lead_survey(pdb.Plate.plate_id) == 'apogeeLead')\
-                    .filter(pdb.PlateStatus.pk == acceptedStatus.pk).all()
+                    .filter(apogeeLead(pdb))\
+                    .filter(pdb.PlateStatus.pk == acceptedStatus.pk)
             locIDS = session.query(pdb.Plate.location_id)\
+                   .join(pdb.PlateToSurvey, pdb.Survey)\
                    .filter(pdb.Survey.pk == survey.pk)\
-                   .filter(pdb.Plate.plate_id.in_(protoList)).all()
-            plates = session.query(pdb.Plate)\
+                   .filter(pdb.Plate.plate_id.in_(protoQuery.subquery())).correlate(None).subquery()
+            plateQuery = session.query(pdb.Plate)\
                    .join(pdb.PlateToSurvey, pdb.Survey)\
                    .filter(pdb.Survey.pk == survey.pk)\
-                   .filter(pdb.Plate.location_id.in_(locIDS)).all()
+                   .filter(pdb.Plate.location_id.in_(locIDS))
 
         elif allPlates:
-            plates = session.query(pdb.Plate)\
+            plateQuery = session.query(pdb.Plate)\
                .join(pdb.PlateToSurvey, pdb.Survey)\
-               .filter(pdb.Survey.pk == survey.pk).all()
+               .filter(pdb.Survey.pk == survey.pk)
         else:
-            protoList = session.query(pdb.Plate.plate_id)\
+            protoQuery = session.query(pdb.Plate.plate_id)\
                    .join(pdb.PlateToSurvey, pdb.Survey)\
                    .join(pdb.Plugging, pdb.Cartridge)\
                    .join(pdb.ActivePlugging)\
+                   .outerjoin(pdb.Plate.currentSurveyMode)\
                    .filter(pdb.Survey.pk == survey.pk)\
-                   .filter(sqlalchemy.func.platedb.lead_survey(pdb.Plate.plate_id) == 'apogeeLead')\
-                   .order_by(pdb.Cartridge.number).all()
+                   .filter(apogeeLead(pdb))
             # .filter(sqlalchemy.func.platedb.lead_survey(pdb.Plate.plate_id) == 'apogeelead')\
 
             # getting plates with same loc id as PLUGGED plates to determine hist & completion
             locIDS = session.query(pdb.Plate.location_id)\
+               .join(pdb.PlateToSurvey, pdb.Survey)\
                .filter(pdb.Survey.pk == survey.pk)\
-               .filter(pdb.Plate.plate_id.in_(protoList)).all()
+               .filter(pdb.Plate.plate_id.in_(protoQuery.subquery())).correlate(None).subquery()
           # assert len(locIDS) > 0
-            plates = session.query(pdb.Plate)\
+            plateQuery = session.query(pdb.Plate)\
                .join(pdb.PlateToSurvey, pdb.Survey)\
                .filter(pdb.Survey.pk == survey.pk)\
-               .filter(pdb.Plate.location_id.in_(locIDS)).all()
+               .filter(pdb.Plate.location_id.in_(locIDS))
+
+        protoFlag = None if protoQuery is None else pdb.Plate.plate_id.in_(protoQuery.subquery())
+        if table:
+            apg, protoPlates = buildPlateTable(session, plateQuery, flag=protoFlag)
+        else:
+            # survey mode label alongside each plate, so lead_survey needs no lazy load
+            plates = plateQuery.outerjoin(pdb.Plate.currentSurveyMode)\
+                .add_columns(pdb.SurveyMode.label,
+                             sqlalchemy.literal(False) if protoFlag is None else protoFlag).all()
+            protoPlates = set(row[0].plate_id for row in plates if row[2])
 
     q1Time = time()
     if loud:
         print('[SQL]: plate query completed in {} s'.format(q1Time-start_time))
 
     # create the list of apg plate objects
-    apg = list()
     tmpPlateList = list()
-    for plate in plates:
-        tmpPlate = ApogeePlate(plate)
-        if allPlates or plateList is not None:
-            apg.append(tmpPlate)
-        else:
-            if tmpPlate.lead_survey == 'apg':
-                tmpPlateList.append(tmpPlate.plateid)
+    if table:
+        if not (allPlates or plateList is not None):
+            apg = apg[apg.lead_survey == 'apg']
+            tmpPlateList = apg.plateid.tolist()
+    else:
+        apg = list()
+        for plate, surveyModeLabel, proto in plates:
+            tmpPlate = ApogeePlate(plate, lead_survey=leadSurvey(surveyModeLabel))
+            if allPlates or plateList is not None:
                 apg.append(tmpPlate)
+            else:
+                if tmpPlate.lead_survey == 'apg':
+                    tmpPlateList.append(tmpPlate.plateid)
+                    apg.append(tmpPlate)
+        if prefetch:
+            with session.begin():
+                prefetchPointings(session, apg)
 
-    if protoList != []:
-        plateList = set([p[0] for p in protoList]).intersection(tmpPlateList)
+    if len(protoPlates) > 0:
+        plateList = protoPlates.intersection(tmpPlateList)
 
     assignmentTime = time()
     if loud:
@@ -361,16 +830,20 @@ def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, all
 
     exposedPlates = [p.plateid for p in apg]
     with session.begin():
-        # returns list of tuples (mjd,plateid,qrRed,fullRed,exp.time,exp.start_time,exp_num)
-        exposures = session.query(sqlalchemy.func.floor(pdb.Exposure.start_time/86400+.3), pdb.Plate.plate_id,\
-                    qldb.Quickred.snr_standard, qldb.Reduction.snr, pdb.Exposure.exposure_time, pdb.Exposure.start_time, pdb.Exposure.exposure_no)\
-                    .join(pdb.Survey).join(pdb.ExposureFlavor)\
-                    .join(pdb.Observation).join(pdb.PlatePointing).join(pdb.Plate)\
-                    .outerjoin(qldb.Quickred).outerjoin(qldb.Reduction)\
-                    .filter(pdb.ExposureFlavor.label == 'Object')\
-                    .filter(pdb.Plate.plate_id.in_(exposedPlates)).all()
-        # removed survey label filter to deal with mislabled exposures
-        # .filter(pdb.Survey.label == 'APOGEE-2' )
+        if exposureList:
+            # returns list of tuples (mjd,plateid,qrRed,fullRed,exp.time,exp.start_time,exp_num)
+            exposures = session.query(sqlalchemy.func.floor(pdb.Exposure.start_time/86400+.3), pdb.Plate.plate_id,\
+                        qldb.Quickred.snr_standard, qldb.Reduction.snr, pdb.Exposure.exposure_time, pdb.Exposure.start_time, pdb.Exposure.exposure_no)\
+                        .join(pdb.Survey).join(pdb.ExposureFlavor)\
+                        .join(pdb.Observation).join(pdb.PlatePointing).join(pdb.Plate)\
+                        .outerjoin(qldb.Quickred).outerjoin(qldb.Reduction)\
+                        .filter(pdb.ExposureFlavor.label == 'Object')\
+                        .filter(pdb.Plate.plate_id.in_(exposedPlates)).all()
+            # removed survey label filter to deal with mislabled exposures
+            # .filter(pdb.Survey.label == 'APOGEE-2' )
+        else:
+            # one row per plate-night, see plateNights
+            exposures = nightQuery(session, exposedPlates).all()
     q2Time = time()
 
     if loud:
@@ -385,85 +858,40 @@ def get_plates(errors=None, plan=False, loud=True, session=None, atapo=True, all
         if loud:
             print('[PY]: get_plates complete in {} s'.format(end_time-start_time))
 
-        if plateList is not None:
-            plateList = list(plateList)
-            plateList = sorted(plateList)
-            return [apg[plateidDict[p]] for p in plateList]
-
-        return sorted(apg, key=getPlateid)
+        return sortPlates(apg, plateList, plateidDict)
 
     exposures_tab = np.array(exposures)
     exposures_tab = np.array(exposures_tab, dtype=np.float)
-    proto_good_exp = np.nan_to_num(exposures_tab)
-
-    fullRedCheck = np.copy([exposures_tab[:, 0], exposures_tab[:, 1],\
-                            exposures_tab[:, 2],\
-                            exposures_tab[:, 3],\
-                            [x[3] if not np.isnan(x[3]) else x[2] for x in exposures_tab]]).swapaxes(0, 1)
-
-    # convert nones in SNR to zeros
-    proto_good_exp = np.nan_to_num(fullRedCheck)
-    good_exp = proto_good_exp[proto_good_exp[:, 4] > 10]
-
-    for p in apg:
-        exp_to_add = exposures_tab[exposures_tab[:, 1] == p.plateid]
-        for exp in exp_to_add:
-            p.exposureList.append({'exp_no': exp[6], 'mjd': exp[0],\
-                                   'quality': exp[2] > 10 or exp[3] > 10,\
-                                   'start_time': exp[5], 'exp_time': exp[4],\
-                                   'qr_sn2': exp[2]**2, 'apr_sn2': exp[3]**2})
-        if p.hist != '' and p.vdone != 0:
-            continue
-        repeat = []
-        # find plates that share location and cohort
-        for pl in apg:
-            if p.plateid == pl.plateid:
-                continue
-            if p.locationid == pl.locationid:
-                if p.apgver == pl.apgver:
-                    repeat.append(pl.plateid)
-        if repeat != []:
-            repeat.append(p.plateid)
-            plateExps = good_exp[np.in1d(good_exp[:, 1], repeat)]
-            dates = np.unique(plateExps[:, 0])
-            for d in dates:
-                if d != mjd:
-                    day = plateExps[plateExps[:, 0] == d]
-                    if day.shape[0] >= 2:
-                        for r in repeat:
-                            apg[plateidDict[r]].hist += '{},'.format(int(d)+2400000)
-                            apg[plateidDict[r]].vdone += 1
-                            apg[plateidDict[r]].sn += float(np.sum(day[:, 4]**2))
-                            apg[plateidDict[r]].snql += float(np.sum(day[:, 2]**2))
-                            apg[plateidDict[r]].snred += float(np.sum(day[:, 3]**2))
-                            if np.sum(day[:, 4]) == np.sum(day[:, 3]):
-                                apg[plateidDict[r]].reduction += '1,'
-                            else:
-                                apg[plateidDict[r]].reduction += '0,'
-        else:
-            plateExps = good_exp[good_exp[:, 1] == p.plateid]
-            dates = np.unique(plateExps[:, 0])
-            for d in dates:
-                if d != mjd:
-                    day = plateExps[plateExps[:, 0] == d]
-                    if day.shape[0] >= 2:
-                        p.hist += '{},'.format(int(d)+2400000)
-                        p.vdone += 1
-                        p.sn += float(np.sum(day[:, 4]**2))
-                        p.snql += float(np.sum(day[:, 2]**2))
-                        p.snred += float(np.sum(day[:, 3]**2))
-                        if np.sum(day[:, 4]) == np.sum(day[:, 3]):
-                            p.reduction += '1,'
-                        else:
-                            p.reduction += '0,'
+
+    plateids = np.array([p.plateid for p in apg])
+    if exposureList:
+        # the plates' exposures are slices of one array
+        exposures_arr, offsets = exposureArray(exposures_tab, plateids)
+        for i, p in enumerate(apg):
+            p.exposures = exposures_arr[offsets[i]:offsets[i+1]]
+        nights = plateNights(exposures_tab)
+    else:
+        nights = exposures_tab
+
+    # visits are shared by all plates with the same location and cohort (apgver)
+    visits = aggregateVisits(nights, plateids, np.array([p.locationid for p in apg]),
+                             np.array([p.apgver for p in apg]), mjd=mjd)
+    if isinstance(apg, PlateTable):
+        for col in ['vdone', 'sn', 'snql', 'snred', 'first_jd', 'last_jd']:
+            apg.data[col] = visits[col]
+    for i, p in enumerate(apg):
+        p.hist = visits['hist'][visits['offsets'][i]:visits['offsets'][i+1]]
+        p.reduction = visits['reduction'][visits['offsets'][i]:visits['offsets'][i+1]]
+        if not isinstance(apg, PlateTable):
+            p.vdone = int(visits['vdone'][i])
+            p.sn = float(visits['sn'][i])
+            p.snql = float(visits['snql'][i])
+            p.snred = float(visits['snred'][i])
+            p.first_jd = float(visits['first_jd'][i])
+            p.last_jd = float(visits['last_jd'][i])
 
     end_time = time()
     if loud:
         print('[PY]: get_plates complete in {} s'.format(end_time-start_time))
 
-    if plateList is not None:
-        plateList = list(plateList)
-        plateList = sorted(plateList)
-        return [apg[plateidDict[p]] for p in plateList]
-
-    return sorted(apg, key=getPlateid)
+    return sortPlates(apg, plateList, plateidDict)
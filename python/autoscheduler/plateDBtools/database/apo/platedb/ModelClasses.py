@@ -480,6 +480,34 @@ class Plate(Base):
                 return 'Complete'
         return 'Incomplete'
 
+    @classmethod
+    def calculatedCompletionStatuses(cls, session, platePks):
+        """ Bulk version of calculatedCompletionStatus: one query returns
+            (plate pk, completion status pk and label, has a BOSS survey,
+            has a good plugging) for every plate, and the result is a dict
+            of plate pk -> calculated completion status """
+        if len(platePks) == 0:
+            return dict()
+
+        rows = session.query(cls.pk, PlateCompletionStatus.pk, PlateCompletionStatus.label,
+                             func.bool_or(func.lower(Survey.label).like('%boss%')),
+                             func.bool_or(PluggingStatus.label.like('%Good%')))\
+                      .join(cls.completionStatus)\
+                      .outerjoin(cls.surveys)\
+                      .outerjoin(cls.pluggings).outerjoin(Plugging.status)\
+                      .filter(cls.pk.in_(list(platePks)))\
+                      .group_by(cls.pk, PlateCompletionStatus.pk, PlateCompletionStatus.label).all()
+
+        statuses = dict()
+        for pk, status_pk, status_label, boss, good in rows:
+            if not boss:
+                statuses[pk] = "n/a"
+            elif status_pk == 0: # pk = 0 -> "Automatic"
+                statuses[pk] = 'Complete' if good else 'Incomplete'
+            else:
+                statuses[pk] = status_label
+        return statuses
+
     @property
     def firstPointing(self):
         return self.design.pointings[0]
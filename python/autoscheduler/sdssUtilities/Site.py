@@ -16,6 +16,7 @@ from __future__ import division
 from __future__ import print_function
 from astropy import time
 import numpy as np
+import time as systime
 
 # TBD: we need ephem at APO, since our older astropy does not contain
 # astropy.coordinates.get_sun()
@@ -27,6 +28,14 @@ try:
 except:
     ephem = None
 
+
+def nowJD():
+    """Returns the current JD from the system clock, without creating an
+    `astropy.time.Time` instance."""
+
+    return systime.time() / 86400. + 2440587.5
+
+
 class Site(object):
     """A class similar to `astropysics.obstools.Site` to perform LST->calendar
     conversions.
@@ -85,6 +94,8 @@ class Site(object):
         inputDate : optional
             An `astropy.Time.time` instance or the argument to create one.
             If None, the current time will be used. The UTC scale is used.
+            With `format='jd'` a JD or an array of JDs is converted directly,
+            without creating `Time` objects.
 
         format : string, optional
             If date is not None or a Time instance, the value to be passed
@@ -92,22 +103,21 @@ class Site(object):
 
         Returns
         -------
-        result : float
-            A float with the LST time for the given date(s), in hours.
+        result : float or `numpy.ndarray`
+            The LST for the given date(s), in hours, with the shape of the
+            input.
 
         """
 
         if inputDate is None:
-            inputDate = time.Time.now()
-
-        if isinstance(inputDate, time.Time):
+            JD = nowJD()
+        elif isinstance(inputDate, time.Time):
             JD = inputDate.jd
         elif format == 'jd':
-            JD = np.array(inputDate)
+            JD = np.asarray(inputDate, dtype=float)
         else:
             try:
-                inputDate = time.Time(inputDate, scale='tai', format=format)
-                inputDate.jd
+                JD = time.Time(inputDate, scale='tai', format=format).jd
             except:
                 raise ValueError('inputDate format not recognised.')
 
@@ -123,8 +133,7 @@ class Site(object):
         return lmst
 
     def localSiderealTimeToDate(self, lst, date=None, format=None):
-        """Returns an `astropy.time.Time` instance for a LST
-        at a given date.
+        """Returns the dates for a LST or sequence of LSTs at a given date.
 
         Parameters
         ----------
@@ -133,7 +142,9 @@ class Site(object):
 
         date : optional
             An `astropy.Time.time` instance or the argument to create one.
-            If None, the current time will be used.
+            If None, the current time will be used. A JD given as a float or
+            `numpy.ndarray`, or with `format='jd'`, is converted directly,
+            without creating `Time` objects.
 
         format : string, optional
             If date is not None or a Time instance, the value to be passed
@@ -141,27 +152,38 @@ class Site(object):
 
         Returns
         -------
-        result : `astropy.time.Time`
-            An `astropy.time.Time` instance of the same size of the lst
-            input list, with each element being the date of the corresponding
-            LST.
+        result : `astropy.time.Time`, float or `numpy.ndarray`
+            The date of each LST in the lst input list. If date is a JD
+            (a float, an array or `format='jd'`) the dates are returned as
+            JDs, otherwise (including date None) as an `astropy.time.Time`
+            instance. A single LST returns a single date.
 
         """
 
+        lst = np.atleast_1d(np.asarray(lst, dtype=float))
+
         if date is None:
             date = time.Time.now()
 
-        lst = np.atleast_1d(lst)
-
         if isinstance(date, time.Time):
-            pass
+            format = None
+        elif format == 'jd' or isinstance(date, (float, np.floating, np.ndarray)):
+            format = 'jd'
         else:
             try:
                 date = time.Time(date, format=format, scale='tai')
             except:
                 raise ValueError('date format not recognised.')
 
-        LST0 = self.localSiderealTime(date)
+        if format == 'jd':
+            try:
+                JD = float(date)
+            except (TypeError, ValueError):
+                raise ValueError('date format not recognised.')
+        else:
+            JD = date.jd
+
+        LST0 = self.localSiderealTime(JD)
         testPoint = lst[0]
         diffs = (lst - testPoint) % 24
 
@@ -172,8 +194,11 @@ class Site(object):
 
         lstDelta = diffs + delta
 
-        UTDates = date + time.TimeDelta(lstDelta * 3600, format='sec',
-                                        scale='tai')
+        if format == 'jd':
+            UTDates = JD + lstDelta / 24.
+        else:
+            UTDates = date + time.TimeDelta(lstDelta * 3600, format='sec',
+                                            scale='tai')
 
         if len(UTDates) == 1:
             return UTDates[0]
@@ -105,9 +105,8 @@ def nutate(jd, radian=False, plot=False):
 	arg = np.transpose(arg)
 	sarg = np.sin(arg)
 	carg = np.cos(arg)
-	for i in range(n):
-		nut_lon[i] = 0.0001*np.sum( (sdelt*jdcen[i] + sin_lng)*sarg[i] )
-		nut_obliq[i] = 0.0001*np.sum( (cdelt*jdcen[i] + cos_lng)*carg[i] )
+	nut_lon[:] = 0.0001*np.sum( (np.outer(jdcen, sdelt) + sin_lng)*sarg, axis=1 )
+	nut_obliq[:] = 0.0001*np.sum( (np.outer(jdcen, cdelt) + cos_lng)*carg, axis=1 )
 	
 	# Until here result are in arcseconds!
 	# Convert to degrees
@@ -944,7 +943,7 @@ def sunpos(jd, end_jd=None, jd_steps=None, full_output=False):
 		# Form time in Julian centuries from 1900.0
 		start_jd = (jd - 2415020.0)/36525.0
 		# Zime array
-		time = np.array([start_jd])
+		time = np.array(start_jd, ndmin=1)
 	else:
 		# Form time in Julian centuries from 1900.0
 		start_jd = (jd - 2415020.0)/36525.0
@@ -1027,43 +1026,53 @@ def sunpos(jd, end_jd=None, jd_steps=None, full_output=False):
 	else:
 		return jd, ra, dec
 	
+# Periodic terms of the lunar longitude/distance and latitude series (Meeus, ch. 47),
+# used by moonpos. The eccentricity correction of each term is E**|M|, where M is the
+# multiple of the Sun's mean anomaly in the term.
+_moon_d_lng = np.array([0,2,2,0,0,0,2,2,2,2,0,1,0,2,0,0,4,0,4,2,2,1,1,2,2,4,2,0,2,2,1,2,0,0, \
+				 2,2,2,4,0,3,2,4,0,2,2,2,4,0,4,1,2,0,1,3,4,2,0,1,2,2])
+_moon_m_lng = np.array([0,0,0,0,1,0,0,-1,0,-1,1,0,1,0,0,0,0,0,0,1,1,0,1,-1,0,0,0,1,0,-1,0, \
+				 -2,1,2,-2,0,0,-1,0,0,1,-1,2,2,1,-1,0,0,-1,0,1,0,1,0,0,-1,2,1,0,0])
+_moon_mp_lng = np.array([1,-1,0,2,0,0,-2,-1,1,0,-1,0,1,0,1,1,-1,3,-2,-1,0,-1,0,1,2,0,-3,-2, \
+					-1,-2,1,0,2,0,-1,1,0,-1,2,-1,1,-2,-1,-1,-2,0,1,4,0,-2,0,2,1,-2,-3,2,1,-1,3,-1])
+_moon_f_lng = np.array([0,0,0,0,0,2,0,0,0,0,0,0,0,-2,2,-2,0,0,0,0,0,0,0,0,0,0,0,0,2,0,0,0, \
+				 0,0,0,-2,2,0,2,0,0,0,0,0,0,-2,0,0,0,0,-2,-2,0,0,0,0,0,0,0,-2])
+_moon_sin_lng = np.array([6288774,1274027,658314,213618,-185116,-114332,58793,57066,53322, \
+					 45758,-40923,-34720,-30383,15327,-12528,10980,10675,10034,8548,-7888,-6766, \
+					 -5163,4987,4036,3994,3861,3665,-2689,-2602,2390,-2348,2236,-2120,-2069,2048, \
+					 -1773,-1595,1215,-1110,-892,-810,759,-713,-700,691,596,549,537,520,-487, \
+					 -399,-381,351,-340,330,327,-323,299,294,0.0])
+_moon_cos_lng = np.array([-20905355,-3699111,-2955968,-569925,48888,-3149,246158,-152138, \
+					 -170733,-204586,-129620,108743,104755,10321,0,79661,-34782,-23210,-21636, \
+					 24208,30824,-8379,-16675,-12831,-10445,-11650,14403,-7003,0,10056,6322, \
+					 -9884,5751,0,-4950,4130,0,-3958,0,3258,2616,-1897,-2117,2354,0,0,-1423, \
+					 -1117,-1571,-1739,0,-4421,0,0,0,0,1165,0,0,8752.0])
+_moon_d_lat = np.array([0,0,0,2,2,2,2,0,2,0,2,2,2,2,2,2,2,0,4,0,0,0,1,0,0,0,1,0,4,4,0,4,2,2, \
+									2,2,0,2,2,2,2,4,2,2,0,2,1,1,0,2,1,2,0,4,4,1,4,1,4,2])
+_moon_m_lat = np.array([0,0,0,0,0,0,0,0,0,0,-1,0,0,1,-1,-1,-1,1,0,1,0,1,0,1,1,1,0,0,0,0,0,0, \
+									0,0,-1,0,0,0,0,1,1,0,-1,-2,0,1,1,1,1,1,0,-1,1,0,-1,0,0,0,-1,-2])
+_moon_mp_lat = np.array([0,1,1,0,-1,-1,0,2,1,2,0,-2,1,0,-1,0,-1,-1,-1,0,0,-1,0,1,1,0,0,3,0, \
+									-1,1, -2,0,2,1,-2,3,2,-3,-1,0,0,1,0,1,1,0,0,-2,-1,1,-2,2,-2,-1,1,1,-1,0,0])
+_moon_f_lat = np.array([ 1,1,-1,-1,1,-1,1,1,-1,-1,-1,-1,1,-1,1,1,-1,-1,-1,1,3,1,1,1,-1,-1,-1, \
+									 1,-1,1,-3,1,-3,-1,-1,1,-1,1,-1,1,1,1,1,-1,3,-1,-1,1,-1,-1,1,-1,1,-1,-1, \
+									-1,-1,-1,-1,1])
+_moon_sin_lat = np.array([5128122,280602,277693,173237,55413,46271,32573,17198,9266,8822, \
+										8216,4324,4200,-3359,2463,2211,2065,-1870,1828,-1794,-1749,-1565,-1491, \
+										-1475,-1410,-1344,-1335,1107,1021,833,777,671,607,596,491,-451,439,422, \
+										421,-366,-351,331,315,302,-283,-229,223,223,-220,-220,-185,181,-177,176, \
+										166,-164,132,-119,115,107.0])
+_moon_ecc_lng = np.abs(_moon_m_lng)
+_moon_ecc_lat = np.abs(_moon_m_lat)
+
+# Number of epochs moonpos sums at once, to bound the (epochs x terms) work arrays
+_moon_chunk = 4096
+
 def moonpos(jd, radian=False):
 
+	# scalar input returns scalar RA and Dec, array input returns arrays
+	scalar = np.ndim(jd) == 0
 	jd = np.array(jd, ndmin=1)
 	time = (jd - 2451545.0)/36525.0
-	d_lng = np.array([0,2,2,0,0,0,2,2,2,2,0,1,0,2,0,0,4,0,4,2,2,1,1,2,2,4,2,0,2,2,1,2,0,0, \
-					 2,2,2,4,0,3,2,4,0,2,2,2,4,0,4,1,2,0,1,3,4,2,0,1,2,2])
-	m_lng = np.array([0,0,0,0,1,0,0,-1,0,-1,1,0,1,0,0,0,0,0,0,1,1,0,1,-1,0,0,0,1,0,-1,0, \
-					 -2,1,2,-2,0,0,-1,0,0,1,-1,2,2,1,-1,0,0,-1,0,1,0,1,0,0,-1,2,1,0,0])
-	mp_lng = np.array([1,-1,0,2,0,0,-2,-1,1,0,-1,0,1,0,1,1,-1,3,-2,-1,0,-1,0,1,2,0,-3,-2, \
-						-1,-2,1,0,2,0,-1,1,0,-1,2,-1,1,-2,-1,-1,-2,0,1,4,0,-2,0,2,1,-2,-3,2,1,-1,3,-1])
-	f_lng = np.array([0,0,0,0,0,2,0,0,0,0,0,0,0,-2,2,-2,0,0,0,0,0,0,0,0,0,0,0,0,2,0,0,0, \
-					 0,0,0,-2,2,0,2,0,0,0,0,0,0,-2,0,0,0,0,-2,-2,0,0,0,0,0,0,0,-2])
-	sin_lng = np.array([6288774,1274027,658314,213618,-185116,-114332,58793,57066,53322, \
-						 45758,-40923,-34720,-30383,15327,-12528,10980,10675,10034,8548,-7888,-6766, \
-						 -5163,4987,4036,3994,3861,3665,-2689,-2602,2390,-2348,2236,-2120,-2069,2048, \
-						 -1773,-1595,1215,-1110,-892,-810,759,-713,-700,691,596,549,537,520,-487, \
-						 -399,-381,351,-340,330,327,-323,299,294,0.0])
-	cos_lng = np.array([-20905355,-3699111,-2955968,-569925,48888,-3149,246158,-152138, \
-						 -170733,-204586,-129620,108743,104755,10321,0,79661,-34782,-23210,-21636, \
-						 24208,30824,-8379,-16675,-12831,-10445,-11650,14403,-7003,0,10056,6322, \
-						 -9884,5751,0,-4950,4130,0,-3958,0,3258,2616,-1897,-2117,2354,0,0,-1423, \
-						 -1117,-1571,-1739,0,-4421,0,0,0,0,1165,0,0,8752.0])
-	d_lat = np.array([0,0,0,2,2,2,2,0,2,0,2,2,2,2,2,2,2,0,4,0,0,0,1,0,0,0,1,0,4,4,0,4,2,2, \
-										2,2,0,2,2,2,2,4,2,2,0,2,1,1,0,2,1,2,0,4,4,1,4,1,4,2])
-	m_lat = np.array([0,0,0,0,0,0,0,0,0,0,-1,0,0,1,-1,-1,-1,1,0,1,0,1,0,1,1,1,0,0,0,0,0,0, \
-										0,0,-1,0,0,0,0,1,1,0,-1,-2,0,1,1,1,1,1,0,-1,1,0,-1,0,0,0,-1,-2])
-	mp_lat = np.array([0,1,1,0,-1,-1,0,2,1,2,0,-2,1,0,-1,0,-1,-1,-1,0,0,-1,0,1,1,0,0,3,0, \
-										-1,1, -2,0,2,1,-2,3,2,-3,-1,0,0,1,0,1,1,0,0,-2,-1,1,-2,2,-2,-1,1,1,-1,0,0])
-	f_lat = np.array([ 1,1,-1,-1,1,-1,1,1,-1,-1,-1,-1,1,-1,1,1,-1,-1,-1,1,3,1,1,1,-1,-1,-1, \
-										 1,-1,1,-3,1,-3,-1,-1,1,-1,1,-1,1,1,1,1,-1,3,-1,-1,1,-1,-1,1,-1,1,-1,-1, \
-										-1,-1,-1,-1,1])
-	sin_lat = np.array([5128122,280602,277693,173237,55413,46271,32573,17198,9266,8822, \
-											8216,4324,4200,-3359,2463,2211,2065,-1870,1828,-1794,-1749,-1565,-1491, \
-											-1475,-1410,-1344,-1335,1107,1021,833,777,671,607,596,491,-451,439,422, \
-											421,-366,-351,331,315,302,-283,-229,223,223,-220,-220,-185,181,-177,176, \
-											166,-164,132,-119,115,107.0])
-
 	# Mean longitude of the moon referred to mean equinox of the date
 	coeff0 = [-1.0/6.5194e7, 1.0/538841.0, -0.0015786, 481267.88123421, 218.3164477]
 	lprimed = np.polyval(coeff0, time)*np.pi/180.
@@ -1091,12 +1100,6 @@ def moonpos(jd, radian=False):
 
 	# Eccentricity of Earth's orbit around the Sun
 	E = 1 - 0.002516*time - 7.4e-6*time**2
-	E2 = E**2
-	ecorr1 = np.where(np.abs(m_lng) == 1)[0]
-	ecorr2 = np.where(np.abs(m_lat) == 1)[0]
-	ecorr3 = np.where(np.abs(m_lng) == 2)[0]
-	ecorr4 = np.where(np.abs(m_lat) == 2)[0]
-
 	# Additional arguments
 	A1 = (119.75 + 131.849*time) * np.pi/180.
 	A2 = (53.09 + 479264.290*time) * np.pi/180.
@@ -1105,30 +1108,24 @@ def moonpos(jd, radian=False):
 	sumb_add =	-2235.*np.sin(lprimed) + 382.*np.sin(A3) + 175.*np.sin(A1-F) + \
 							175.*np.sin(A1 + F) + 127.*np.sin(lprimed - Mprime) - 115.*np.sin(lprimed + Mprime)
 
-	# Sum the periodic terms 
+	# Sum the periodic terms, as (epochs x terms) outer products over chunks of epochs
 	geolong = np.zeros(jd.size)
 	geolat = np.zeros(jd.size)
 	dis = np.zeros(jd.size)
 
-	for i in xrange(jd.size):
-		sinlng = sin_lng.copy()
-		coslng = cos_lng.copy()
-		sinlat = sin_lat.copy()
-
-		sinlng[ecorr1] = E[i]*sinlng[ecorr1]
-		coslng[ecorr1] = E[i]*coslng[ecorr1]
-		sinlat[ecorr2] = E[i]*sinlat[ecorr2]
-		sinlng[ecorr3] = E2[i]*sinlng[ecorr3]
-		coslng[ecorr3] = E2[i]*coslng[ecorr3]
-		sinlat[ecorr4] = E2[i]*sinlat[ecorr4]
+	for i in range(0, jd.size, _moon_chunk):
+		c = slice(i, i + _moon_chunk)
+		ecc = E[c][:, np.newaxis]
+		ecc_lng = ecc**_moon_ecc_lng
+		ecc_lat = ecc**_moon_ecc_lat
 
-		arg = d_lng*d[i] + m_lng*M[i] +mp_lng*Mprime[i] + f_lng*F[i]
-		geolong[i] = lprimed[i]/(np.pi/180.) + ( np.sum( sinlng*np.sin(arg) ) + suml_add[i] )/1.0e6
+		arg = np.outer(d[c], _moon_d_lng) + np.outer(M[c], _moon_m_lng) + np.outer(Mprime[c], _moon_mp_lng) + np.outer(F[c], _moon_f_lng)
+		geolong[c] = lprimed[c]/(np.pi/180.) + ( np.sum( ecc_lng*_moon_sin_lng*np.sin(arg), axis=1 ) + suml_add[c] )/1.0e6
 
-		dis[i] = 385000.56 + np.sum( coslng*np.cos(arg) )/1.0e3
+		dis[c] = 385000.56 + np.sum( ecc_lng*_moon_cos_lng*np.cos(arg), axis=1 )/1.0e3
 
-		arg = d_lat*d[i] + m_lat*M[i] +mp_lat*Mprime[i] + f_lat*F[i]
-		geolat[i] = ( np.sum( sinlat*np.sin(arg) ) + sumb_add[i] )/1.0e6
+		arg = np.outer(d[c], _moon_d_lat) + np.outer(M[c], _moon_m_lat) + np.outer(Mprime[c], _moon_mp_lat) + np.outer(F[c], _moon_f_lat)
+		geolat[c] = ( np.sum( ecc_lat*_moon_sin_lat*np.sin(arg), axis=1 ) + sumb_add[c] )/1.0e6
 
 	# Find the nutation in longitude
 	nut = nutate(jd)
@@ -1159,7 +1156,9 @@ def moonpos(jd, radian=False):
 		geolong = lamb
 		geolat = beta
 
-	return ra[0], dec[0], dis, geolong, geolat
+	if scalar:
+		return ra[0], dec[0], dis, geolong, geolat
+	return ra, dec, dis, geolong, geolat
 	
 def moonphase(jd):
   """
@@ -1,5 +1,5 @@
 from __future__ import print_function, division
-import astropysics.obstools as obs
+from autoscheduler.sdssUtilities.Site import Site
 import numpy as np
 import sys
 import matplotlib.pyplot as plt
@@ -11,7 +11,7 @@ apg_frac = 1
 man_frac = 12.6
 ebo_frac = 5.3
 
-apo = obs.Site(32.789278, -105.820278)
+apo = Site(longitude=254.179722, latitude=32.789278, name='APO')
 schedule = np.loadtxt(sys.argv[1])
 apg_lst, man_lst, ebo_lst = np.zeros(24), np.zeros(24), np.zeros(24)
 apg_met, man_met, ebo_met = [], [], []
@@ -22,8 +22,8 @@ for d in range(schedule.shape[0]):
 	if apg_start > 1:
 		apg_length = int((apg_end - apg_start) * 24 * 60 / 87 + 0.4)
 		midpts = apg_start + np.arange(apg_length)*(87/60/24) + 0.5/24
-		apg_nightlst = [apo.localSiderialTime(x) for x in midpts]
-		for l in apg_nightlst: apg_lst[int(l)] += 87/60
+		apg_nightlst = apo.localSiderealTime(midpts)
+		np.add.at(apg_lst, apg_nightlst.astype(int), 87/60)
 		if len(apg_met) == 0: apg_met.append([int(schedule[d,0]-2400000), len(apg_nightlst)])
 		else: apg_met.append([int(schedule[d,0]-2400000), len(apg_nightlst) + apg_met[-1][1]])
 	else:
@@ -36,15 +36,11 @@ for d in range(schedule.shape[0]):
 	if ebo_start > 1:
 		ebo_length = int((ebo_end - ebo_start) * 24 * 60 / 16.5 + 0.4)
 		midpts = ebo_start + np.arange(ebo_length)*(16.5/60/24) + 8.25/60/24
-		ebo_nightlst = [apo.localSiderialTime(x) for x in midpts]
-		ebo_nightlen = 0.0
-		for l in ebo_nightlst:
-			if int(l) > 6 and int(l) <= 18:
-				ebo_lst[int(l)] += 16.5/60
-				ebo_nightlen += 1
-			else: 
-				ebo_lst[int(l)] += 16.5/60 * south_frac
-				ebo_nightlen += 1 * south_frac
+		ebo_nightlst = apo.localSiderealTime(midpts).astype(int)
+		# Slots outside LST 7-18 count at the south fraction
+		ebo_weight = np.where((ebo_nightlst > 6) & (ebo_nightlst <= 18), 1, south_frac)
+		np.add.at(ebo_lst, ebo_nightlst, ebo_weight * 16.5/60)
+		ebo_nightlen = np.sum(ebo_weight)
 		if len(ebo_met) == 0: ebo_met.append([int(schedule[d,0]-2400000), int(ebo_nightlen)])
 		else: ebo_met.append([int(schedule[d,0]-2400000), int(ebo_nightlen) + ebo_met[-1][1]])
 	else:
@@ -57,15 +53,11 @@ for d in range(schedule.shape[0]):
 	if man_start > 1:
 		man_length = int((man_end - man_start) * 24 * 60 / 16.5 + 0.4)
 		midpts = man_start + np.arange(man_length)*(16.5/60/24) + 8.25/60/24
-		man_nightlst = [apo.localSiderialTime(x) for x in midpts]
-		man_nightlen = 0.0
-		for l in man_nightlst:
-			if int(l) > 6 and int(l) <= 18:
-				man_lst[int(l)] += 16.5/60
-				man_nightlen += 1
-			else: 
-				man_lst[int(l)] += 16.5/60 * south_frac
-				man_nightlen += 1 * south_frac
+		man_nightlst = apo.localSiderealTime(midpts).astype(int)
+		# Slots outside LST 7-18 count at the south fraction
+		man_weight = np.where((man_nightlst > 6) & (man_nightlst <= 18), 1, south_frac)
+		np.add.at(man_lst, man_nightlst, man_weight * 16.5/60)
+		man_nightlen = np.sum(man_weight)
 		if len(man_met) == 0: man_met.append([int(schedule[d,0]-2400000), int(man_nightlen)])
 		else: man_met.append([int(schedule[d,0]-2400000), int(man_nightlen) + man_met[-1][1]])
 	else:
@@ -0,0 +1,260 @@
+import importlib
+import os
+import sys
+import types
+import uuid
+
+import pytest
+
+# the autoscheduler package lives in python/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+schema_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'platedb_schema.sql')
+
+
+@pytest.fixture(scope='session')
+def platedb_connection():
+    '''A DatabaseConnection to a scratch database loaded with data/platedb_schema.sql.
+
+    Set PLATEDB_TEST_URI to the SQLAlchemy URI of a PostgreSQL server on which the user
+    may create databases, e.g. postgresql+psycopg2://postgres@localhost/postgres. The
+    scratch database is dropped at the end of the session. The ModelClasses modules
+    reflect the tables of whichever database DatabaseConnection first connects to, so
+    this must be the first connection made in the test process.'''
+    uri = os.environ.get('PLATEDB_TEST_URI')
+    if not uri:
+        pytest.skip('PLATEDB_TEST_URI is not set')
+    import sqlalchemy
+    from sqlalchemy.engine.url import make_url
+    from autoscheduler.plateDBtools.database.DatabaseConnection import DatabaseConnection
+
+    if DatabaseConnection in DatabaseConnection._singletons:
+        pytest.skip('a database connection was already made in this process')
+
+    server = sqlalchemy.create_engine(uri, isolation_level='AUTOCOMMIT')
+    name = 'autoscheduler_test_{}'.format(uuid.uuid4().hex[:12])
+    server.execute('CREATE DATABASE {}'.format(name))
+    url = make_url(uri)
+    url.database = name
+    try:
+        loader = sqlalchemy.create_engine(url)
+        with loader.begin() as conn:
+            conn.connection.cursor().execute(open(schema_file).read())
+        loader.dispose()
+        db = DatabaseConnection(database_connection_string=str(url))
+        try:
+            yield db
+        finally:
+            db.Session.remove()
+            db.engine.dispose()
+    finally:
+        server.execute('DROP DATABASE IF EXISTS {}'.format(name))
+        server.dispose()
+
+
+def _stub_totoro(monkeypatch):
+    '''Replaces Totoro.utils.utils by a module whose avoid_cart_2 is always False, when
+    Totoro is not installed.'''
+    try:
+        import Totoro.utils.utils  # noqa
+    except ImportError:
+        utils = types.ModuleType('Totoro.utils.utils')
+        utils.avoid_cart_2 = lambda plateid: False
+        for name in ['Totoro', 'Totoro.utils']:
+            monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+        monkeypatch.setitem(sys.modules, 'Totoro.utils.utils', utils)
+
+
+def _import_assign_carts():
+    '''Imports a fresh autoscheduler.assign_carts and returns it with a cleanup callable.'''
+    import autoscheduler
+
+    def cleanup():
+        sys.modules.pop('autoscheduler.assign_carts', None)
+        autoscheduler.__dict__.pop('assign_carts', None)
+
+    cleanup()
+    return importlib.import_module('autoscheduler.assign_carts'), cleanup
+
+
+@pytest.fixture
+def assign_carts(platedb_connection, monkeypatch):
+    '''autoscheduler.assign_carts on the platedb test database, with Totoro stubbed out if it
+    is not installed.'''
+    _stub_totoro(monkeypatch)
+    module, cleanup = _import_assign_carts()
+    yield module
+    cleanup()
+
+
+@pytest.fixture
+def offline_assign_carts(monkeypatch):
+    '''autoscheduler.assign_carts without a database: unless a database connection was
+    already made, the platedb connection and ModelClasses modules are replaced by empty
+    modules, so only the code that does not query platedb can be used. Totoro is stubbed out
+    if it is not installed.'''
+    _stub_totoro(monkeypatch)
+    for name in ['autoscheduler.plateDBtools.database.connections.APODatabaseUserLocalConnection',
+                 'autoscheduler.plateDBtools.database.apo.platedb.ModelClasses',
+                 'autoscheduler.plateDBtools.database.apo.mangadb.ModelClasses']:
+        if name not in sys.modules:
+            package, attr = name.rsplit('.', 1)
+            stub = types.ModuleType(name)
+            monkeypatch.setitem(sys.modules, name, stub)
+            monkeypatch.setattr(importlib.import_module(package), attr, stub, raising=False)
+    module, cleanup = _import_assign_carts()
+    yield module
+    cleanup()
+
+
+def insert(conn, table, **values):
+    '''Inserts one row and returns its pk.'''
+    names = sorted(values)
+    if not names:
+        return conn.execute('INSERT INTO {} DEFAULT VALUES RETURNING pk'.format(table)).scalar()
+    return conn.execute('INSERT INTO {} ({}) VALUES ({}) RETURNING pk'.format(
+        table, ', '.join(names), ', '.join('%({})s'.format(n) for n in names)), values).scalar()
+
+
+def label_pk(conn, table, label):
+    '''Returns the pk of the row of a lookup table with this label, inserting it if needed.'''
+    pk = conn.execute('SELECT pk FROM {} WHERE label = %(label)s'.format(table), label=label).scalar()
+    return pk if pk is not None else insert(conn, table, label=label)
+
+
+def apogee_fixture_data(seed=20):
+    '''Plates, pluggings and exposures for the APOGEE plate queries, as plain dicts.
+
+    North plates share location ids, so visits are pooled across plates, and carry a mix of
+    APO/Storage locations, Accepted status, survey modes, MaNGA co-membership and active
+    pluggings. A few MaNGA-only plates share an APOGEE location id, and a few APOGEE-2S plates
+    are at LCO and du Pont.'''
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    plates = []
+    plateid = 9000
+    for south in (False, True):
+        for locationid in (range(100, 112) if not south else range(200, 205)):
+            for i in range(rng.randint(1, 5)):
+                plateid += 1
+                apogee = not (locationid in (101, 104) and i == 0)
+                if south:
+                    location = ['LCO', 'du Pont', 'Storage'][rng.randint(3)]
+                else:
+                    location = 'APO' if rng.rand() < 0.7 else 'Storage'
+                plates.append({
+                    'plateid': plateid, 'locationid': locationid, 'south': south,
+                    'surveys': (['APOGEE-2S' if south else 'APOGEE-2'] if apogee else []) +
+                               (['MaNGA'] if not apogee or rng.rand() < 0.2 else []),
+                    'location': location,
+                    'accepted': rng.rand() < 0.75,
+                    'survey_mode': [None, 'APOGEE lead', 'MaNGA dither', 'MaNGA 10min'][rng.randint(4)],
+                    'ra': round(rng.uniform(0, 360), 4), 'dec': round(rng.uniform(-10, 70), 4),
+                    'ha': round(rng.uniform(-20, 20), 2), 'ha_min': -30.0, 'ha_max': 30.0,
+                    'priority': int(rng.choice([5, 5, 10])),
+                    'design': {'apogee_design_type': ['default', 'kep_koi', 'substellar'][rng.randint(3)],
+                               'apogee_design_driver': 'default',
+                               'apogee_n_design_visits': str(rng.randint(1, 7)),
+                               'apogee_short_version': str(rng.randint(2)),
+                               'apogee_med_version': str(rng.randint(2)),
+                               'apogee_long_version': '1',
+                               'instruments': 'APOGEE MANGA' if rng.rand() < 0.3 else 'APOGEE'},
+                    'pluggings': []})
+                if rng.rand() < 0.3:
+                    plates[-1]['design']['apogee_exposure_time'] = '1000.0'
+                if rng.rand() < 0.15:
+                    # old-style designs without APOGEE values
+                    for field in ['apogee_design_type', 'apogee_design_driver', 'apogee_n_design_visits',
+                                  'apogee_short_version', 'apogee_med_version', 'apogee_long_version']:
+                        del plates[-1]['design'][field]
+
+    # active pluggings on distinct cartridges, plus some old ones
+    carts = list(range(1, 13))
+    for n, p in enumerate(rng.permutation(len(plates))):
+        if n < len(carts):
+            plates[p]['pluggings'].append({'cart': carts[n], 'active': True})
+        elif rng.rand() < 0.3:
+            plates[p]['pluggings'].append({'cart': int(rng.randint(1, 13)), 'active': False})
+
+    # exposures: (plateid, mjd, start_time, exp_no, flavor, quickred snr, reduction snr);
+    # a missing S/N is None
+    exposures = []
+    expno = 100
+    for p in plates:
+        for mjd in sorted(set(rng.randint(57000, 57012, rng.randint(0, 5)))):
+            for k in range(rng.randint(1, 5)):
+                expno += 1
+                qr = None if rng.rand() < 0.1 else round(rng.uniform(3, 25), 3)
+                red = round(rng.uniform(3, 25), 3) if rng.rand() < 0.6 else None
+                exposures.append((p['plateid'], int(mjd), (mjd - 0.3 + 0.05 * (k + 1)) * 86400, expno,
+                                  'Flat' if rng.rand() < 0.1 else 'Object', qr, red))
+    return plates, exposures
+
+
+@pytest.fixture(scope='session')
+def apogee_platedb(platedb_connection):
+    '''The platedb test database filled with apogee_fixture_data(); returns (session, plates,
+    exposures).'''
+    plates, exposures = apogee_fixture_data()
+    with platedb_connection.engine.begin() as conn:
+        pk = {}
+        for table, labels in [('survey', ['APOGEE-2', 'APOGEE-2S', 'MaNGA']),
+                              ('survey_mode', ['APOGEE lead', 'MaNGA dither', 'MaNGA 10min']),
+                              ('plate_location', ['APO', 'Storage', 'LCO', 'du Pont']),
+                              ('plate_status', ['Accepted', 'Shipped']),
+                              ('exposure_flavor', ['Object', 'Flat'])]:
+            for label in labels:
+                pk[table, label] = insert(conn, 'platedb.' + table, label=label)
+        for field in ['apogee_design_type', 'apogee_design_driver', 'apogee_n_design_visits',
+                      'apogee_short_version', 'apogee_med_version', 'apogee_long_version',
+                      'apogee_exposure_time', 'instruments', 'apogee_survey_mode', 'manga_tileid']:
+            # production labels are not all lower case
+            pk['design_field', field] = insert(conn, 'platedb.design_field',
+                                               label=field.upper() if field.startswith('apogee_n') else field)
+        for cart in range(1, 13):
+            pk['cartridge', cart] = insert(conn, 'platedb.cartridge', number=cart)
+
+        pointings = {}
+        for p in plates:
+            design = insert(conn, 'platedb.design')
+            for field, value in sorted(p['design'].items()):
+                insert(conn, 'platedb.design_value', design_pk=design, design_field_pk=pk['design_field', field],
+                       value=value)
+            insert(conn, 'platedb.design_value', design_pk=design, design_field_pk=pk['design_field', 'manga_tileid'],
+                   value='1')
+            pointing = insert(conn, 'platedb.pointing', design_pk=design, pointing_no=1,
+                              center_ra=p['ra'], center_dec=p['dec'])
+            plate = insert(conn, 'platedb.plate', plate_id=p['plateid'], location_id=p['locationid'],
+                           name='field{}'.format(p['locationid']), design_pk=design,
+                           plate_location_pk=pk['plate_location', p['location']],
+                           current_survey_mode_pk=pk.get(('survey_mode', p['survey_mode'])))
+            for survey in p['surveys']:
+                insert(conn, 'platedb.plate_to_survey', plate_pk=plate, survey_pk=pk['survey', survey])
+            insert(conn, 'platedb.plate_to_plate_status', plate_pk=plate,
+                   plate_status_pk=pk['plate_status', 'Accepted' if p['accepted'] else 'Shipped'])
+            pointings[p['plateid']] = insert(conn, 'platedb.plate_pointing', plate_pk=plate, pointing_pk=pointing,
+                                             pointing_name='A', hour_angle=p['ha'],
+                                             ha_observable_min=p['ha_min'], ha_observable_max=p['ha_max'],
+                                             priority=p['priority'])
+            for plugging in p['pluggings']:
+                plugging_pk = insert(conn, 'platedb.plugging', plate_pk=plate,
+                                     cartridge_pk=pk['cartridge', plugging['cart']], fscan_mjd=56990)
+                if plugging['active']:
+                    insert(conn, 'platedb.active_plugging', plugging_pk=plugging_pk)
+
+        observations = {}
+        for plateid, mjd, start, expno, flavor, qr, red in exposures:
+            if (plateid, mjd) not in observations:
+                observations[plateid, mjd] = insert(conn, 'platedb.observation',
+                                                    plate_pointing_pk=pointings[plateid], mjd=mjd)
+            exposure = insert(conn, 'platedb.exposure', observation_pk=observations[plateid, mjd],
+                              survey_pk=pk['survey', 'APOGEE-2'], exposure_flavor_pk=pk['exposure_flavor', flavor],
+                              exposure_no=expno, start_time=start, exposure_time=500)
+            if qr is not None:
+                insert(conn, 'apogeeqldb.quickred', exposure_pk=exposure, snr_standard=qr)
+            if red is not None:
+                insert(conn, 'apogeeqldb.reduction', exposure_pk=exposure, snr=red)
+
+    session = platedb_connection.Session()
+    yield session, plates, exposures
+    session.close()
@@ -0,0 +1,240 @@
+-- Minimal platedb/apogeeqldb/mangadb schema for the database tests.
+--
+-- Only the tables reflected by the ModelClasses modules, with the columns and foreign
+-- keys their relationships and the scheduler queries use. This is not a copy of the
+-- production schema.
+
+CREATE SCHEMA platedb;
+CREATE SCHEMA apogeeqldb;
+CREATE SCHEMA mangadb;
+CREATE SCHEMA functions;
+
+-- lookup tables
+CREATE TABLE platedb.survey (pk serial PRIMARY KEY, label text, plateplan_name text);
+CREATE TABLE platedb.survey_mode (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plate_location (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plate_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plate_completion_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plate_run (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.tile_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.design_field (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.exposure_flavor (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.exposure_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.exposure_header_keyword (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.observation_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.pointing_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plugging_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.plate_hole_type (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.object_type (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.instrument (pk serial PRIMARY KEY, label text);
+CREATE TABLE platedb.constants (pk serial PRIMARY KEY, label text, value text);
+CREATE TABLE platedb.apogee_threshold (pk serial PRIMARY KEY, label text, value real);
+CREATE TABLE platedb.cartridge (pk serial PRIMARY KEY, number integer);
+
+-- designs and plates
+CREATE TABLE platedb.design (pk serial PRIMARY KEY, comment text);
+CREATE TABLE platedb.design_value (
+    pk serial PRIMARY KEY,
+    design_pk integer REFERENCES platedb.design,
+    design_field_pk integer REFERENCES platedb.design_field,
+    value text);
+CREATE TABLE platedb.plate_input (
+    pk serial PRIMARY KEY,
+    design_pk integer REFERENCES platedb.design,
+    filepath text);
+CREATE TABLE platedb.pointing (
+    pk serial PRIMARY KEY,
+    design_pk integer REFERENCES platedb.design,
+    pointing_no integer,
+    center_ra numeric,
+    center_dec numeric);
+CREATE TABLE platedb.tile (
+    pk serial PRIMARY KEY,
+    id integer,
+    tile_status_pk integer REFERENCES platedb.tile_status);
+CREATE TABLE platedb.tile_status_history (
+    pk serial PRIMARY KEY,
+    tile_pk integer REFERENCES platedb.tile,
+    tile_status_pk integer REFERENCES platedb.tile_status);
+CREATE TABLE platedb.plate (
+    pk serial PRIMARY KEY,
+    plate_id integer,
+    location_id integer,
+    name text,
+    comment text,
+    design_pk integer REFERENCES platedb.design,
+    plate_location_pk integer REFERENCES platedb.plate_location,
+    plate_run_pk integer REFERENCES platedb.plate_run,
+    tile_pk integer REFERENCES platedb.tile,
+    tile_id integer,
+    current_survey_mode_pk integer REFERENCES platedb.survey_mode,
+    plate_completion_status_pk integer REFERENCES platedb.plate_completion_status);
+CREATE TABLE platedb.plate_to_survey (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    survey_pk integer REFERENCES platedb.survey);
+CREATE TABLE platedb.plate_to_plate_status (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    plate_status_pk integer REFERENCES platedb.plate_status);
+CREATE TABLE platedb.plate_completion_status_history (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    plate_completion_status_pk integer REFERENCES platedb.plate_completion_status);
+CREATE TABLE platedb.plate_pointing (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    pointing_pk integer REFERENCES platedb.pointing,
+    pointing_name text,
+    hour_angle numeric,
+    ha_observable_min numeric,
+    ha_observable_max numeric,
+    priority integer);
+CREATE TABLE platedb.plate_pointing_to_pointing_status (
+    pk serial PRIMARY KEY,
+    plate_pointing_pk integer REFERENCES platedb.plate_pointing,
+    pointing_status_pk integer REFERENCES platedb.pointing_status);
+CREATE TABLE platedb.cmm_meas (pk serial PRIMARY KEY, plate_pk integer REFERENCES platedb.plate);
+CREATE TABLE platedb.plate_holes_file (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    filename text);
+CREATE TABLE platedb.plate_hole (
+    pk serial PRIMARY KEY,
+    plate_holes_file_pk integer REFERENCES platedb.plate_holes_file,
+    plate_hole_type_pk integer REFERENCES platedb.plate_hole_type,
+    object_type_pk integer REFERENCES platedb.object_type);
+CREATE TABLE platedb.hole_meas (
+    pk serial PRIMARY KEY,
+    cmm_meas_pk integer REFERENCES platedb.cmm_meas,
+    plate_hole_pk integer REFERENCES platedb.plate_hole);
+
+-- pluggings
+CREATE TABLE platedb.gprobe (pk serial PRIMARY KEY, cartridge_pk integer REFERENCES platedb.cartridge);
+CREATE TABLE platedb.plugging (
+    pk serial PRIMARY KEY,
+    plate_pk integer REFERENCES platedb.plate,
+    cartridge_pk integer REFERENCES platedb.cartridge,
+    plugging_status_pk integer REFERENCES platedb.plugging_status,
+    fscan_id integer,
+    fscan_mjd integer);
+CREATE TABLE platedb.active_plugging (pk serial PRIMARY KEY, plugging_pk integer REFERENCES platedb.plugging);
+CREATE TABLE platedb.plugging_to_instrument (
+    pk serial PRIMARY KEY,
+    plugging_pk integer REFERENCES platedb.plugging,
+    instrument_pk integer REFERENCES platedb.instrument);
+CREATE TABLE platedb.pl_plugmap_m (
+    pk serial PRIMARY KEY,
+    plugging_pk integer REFERENCES platedb.plugging,
+    pointing_name text);
+CREATE TABLE platedb.fiber (
+    pk serial PRIMARY KEY,
+    pl_plugmap_m_pk integer REFERENCES platedb.pl_plugmap_m,
+    plate_hole_pk integer REFERENCES platedb.plate_hole,
+    fiber_id integer);
+CREATE TABLE platedb.boss_plugging_info (pk serial PRIMARY KEY, plugging_pk integer REFERENCES platedb.plugging);
+CREATE TABLE platedb.prof_tolerances (pk serial PRIMARY KEY, survey_pk integer REFERENCES platedb.survey);
+CREATE TABLE platedb.profilometry (
+    pk serial PRIMARY KEY,
+    plugging_pk integer REFERENCES platedb.plugging,
+    prof_tolerances_pk integer REFERENCES platedb.prof_tolerances);
+CREATE TABLE platedb.prof_measurement (
+    pk serial PRIMARY KEY,
+    profilometry_pk integer REFERENCES platedb.profilometry,
+    number integer);
+
+-- observations and exposures
+CREATE TABLE platedb.camera (
+    pk serial PRIMARY KEY,
+    instrument_pk integer REFERENCES platedb.instrument,
+    label text);
+CREATE TABLE platedb.boss_sn2_threshold (pk serial PRIMARY KEY, camera_pk integer REFERENCES platedb.camera);
+CREATE TABLE platedb.observation (
+    pk serial PRIMARY KEY,
+    plate_pointing_pk integer REFERENCES platedb.plate_pointing,
+    plugging_pk integer REFERENCES platedb.plugging,
+    observation_status_pk integer REFERENCES platedb.observation_status,
+    mjd integer);
+CREATE TABLE platedb.exposure (
+    pk serial PRIMARY KEY,
+    observation_pk integer REFERENCES platedb.observation,
+    survey_pk integer REFERENCES platedb.survey,
+    camera_pk integer REFERENCES platedb.camera,
+    exposure_flavor_pk integer REFERENCES platedb.exposure_flavor,
+    exposure_status_pk integer REFERENCES platedb.exposure_status,
+    survey_mode_pk integer REFERENCES platedb.survey_mode,
+    exposure_no integer,
+    start_time numeric,
+    exposure_time numeric);
+CREATE TABLE platedb.exposure_header_value (
+    pk serial PRIMARY KEY,
+    exposure_pk integer REFERENCES platedb.exposure,
+    exposure_header_keyword_pk integer REFERENCES platedb.exposure_header_keyword,
+    index integer,
+    value text);
+CREATE TABLE platedb.camera_frame (
+    pk serial PRIMARY KEY,
+    camera_pk integer REFERENCES platedb.camera,
+    exposure_pk integer REFERENCES platedb.exposure,
+    sn2 real);
+
+-- apogeeqldb
+CREATE TABLE apogeeqldb.quicklook (pk serial PRIMARY KEY, exposure_pk integer REFERENCES platedb.exposure);
+CREATE TABLE apogeeqldb.quicklook_prediction (pk serial PRIMARY KEY, quicklook_pk integer REFERENCES apogeeqldb.quicklook);
+CREATE TABLE apogeeqldb.quicklook60 (pk serial PRIMARY KEY, quicklook_pk integer REFERENCES apogeeqldb.quicklook);
+CREATE TABLE apogeeqldb.quicklook60_repspec (pk serial PRIMARY KEY, quicklook60_pk integer REFERENCES apogeeqldb.quicklook60);
+CREATE TABLE apogeeqldb.quicklook60_imbinzoom (pk serial PRIMARY KEY, quicklook60_pk integer REFERENCES apogeeqldb.quicklook60);
+CREATE TABLE apogeeqldb.quickred (
+    pk serial PRIMARY KEY,
+    exposure_pk integer REFERENCES platedb.exposure,
+    snr_standard real);
+CREATE TABLE apogeeqldb.quickred_spectrum (pk serial PRIMARY KEY, quickred_pk integer REFERENCES apogeeqldb.quickred);
+CREATE TABLE apogeeqldb.quickred_imbinzoom (pk serial PRIMARY KEY, quickred_pk integer REFERENCES apogeeqldb.quickred);
+CREATE TABLE apogeeqldb.reduction (
+    pk serial PRIMARY KEY,
+    exposure_pk integer REFERENCES platedb.exposure,
+    snr real);
+CREATE TABLE apogeeqldb.required_fitskeywords (pk serial PRIMARY KEY, label text);
+CREATE TABLE apogeeqldb.fitskeywords_errortype (pk serial PRIMARY KEY, label text);
+CREATE TABLE apogeeqldb.required_fitskeywords_error (
+    pk serial PRIMARY KEY,
+    quicklook_pk integer REFERENCES apogeeqldb.quicklook,
+    fitskeywords_errortype_pk integer REFERENCES apogeeqldb.fitskeywords_errortype);
+CREATE TABLE apogeeqldb.apogee_snr_goals (pk serial PRIMARY KEY, snr real);
+
+-- mangadb
+CREATE TABLE mangadb.set_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE mangadb.set (pk serial PRIMARY KEY, set_status_pk integer REFERENCES mangadb.set_status);
+CREATE TABLE mangadb.exposure_status (pk serial PRIMARY KEY, label text);
+CREATE TABLE mangadb.data_cube (pk serial PRIMARY KEY, plate_pk integer REFERENCES platedb.plate);
+CREATE TABLE mangadb.spectrum (pk serial PRIMARY KEY, data_cube_pk integer REFERENCES mangadb.data_cube);
+CREATE TABLE mangadb.exposure (
+    pk serial PRIMARY KEY,
+    platedb_exposure_pk integer REFERENCES platedb.exposure,
+    set_pk integer REFERENCES mangadb.set,
+    exposure_status_pk integer REFERENCES mangadb.exposure_status,
+    spectrum_pk integer REFERENCES mangadb.spectrum,
+    data_cube_pk integer REFERENCES mangadb.data_cube,
+    transparency real);
+CREATE TABLE mangadb.exposure_to_data_cube (
+    pk serial PRIMARY KEY,
+    exposure_pk integer REFERENCES mangadb.exposure,
+    data_cube_pk integer REFERENCES mangadb.data_cube);
+CREATE TABLE mangadb.sn2_values (
+    pk serial PRIMARY KEY,
+    exposure_pk integer REFERENCES mangadb.exposure,
+    b1_sn2 real, b2_sn2 real, r1_sn2 real, r2_sn2 real);
+CREATE TABLE mangadb.current_status (pk serial PRIMARY KEY, exposure_no integer, mjd integer, flavor text, unpluggedifu boolean);
+CREATE TABLE mangadb.filelist (pk serial PRIMARY KEY, name text, path text);
+CREATE TABLE mangadb.plate (pk serial PRIMARY KEY, platedb_plate_pk integer REFERENCES platedb.plate);
+
+-- Stand-in for platedb.lead_survey(plate_id), which the scheduler's plate queries used
+-- before they joined the plate's current survey mode. The production function is not
+-- available here; this version returns 'apogeeLead' for plates whose current survey
+-- mode is unset or 'APOGEE lead'.
+CREATE FUNCTION platedb.lead_survey(integer) RETURNS text AS $$
+    SELECT CASE WHEN sm.label IS NULL OR sm.label = 'APOGEE lead' THEN 'apogeeLead'
+                ELSE 'mangaLead' END
+    FROM platedb.plate p LEFT JOIN platedb.survey_mode sm ON sm.pk = p.current_survey_mode_pk
+    WHERE p.plate_id = $1
+$$ LANGUAGE sql STABLE;
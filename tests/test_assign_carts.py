@@ -0,0 +1,62 @@
+import copy
+import json
+import os
+
+# assign_carts outputs recorded with the implementation before the cart and plate indexes
+# (the parent of the commit that added them), for generated cart, plugging and plate
+# choice sets. avoid_cart_2 and mangaBrightPriority are replaced by the recorded plate
+# lists, so the cases do not depend on Totoro's plate data or on MaNGA exposures.
+cases_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'assign_carts_cases.json')
+
+
+def test_pick_carts_matches_recorded_cases(offline_assign_carts, monkeypatch):
+    assign_carts = offline_assign_carts
+    cases = json.load(open(cases_file))
+    assert len(cases) > 0
+    for case in cases:
+        avoid = set(case['avoid_cart_2'])
+        order = case['coobs_order']
+        monkeypatch.setattr(assign_carts, 'avoid_cart_2', lambda plateid: plateid in avoid)
+        monkeypatch.setattr(assign_carts, 'mangaBrightPriority', lambda plates: [p for p in order if p in plates])
+
+        errors = []
+        apgpicks, manpicks, ebopicks = assign_carts.pick_carts(
+            [(c,) for c in case['carts']], [tuple(p) for p in case['plugged']],
+            copy.deepcopy(case['apogee_choices']), copy.deepcopy(case['manga_choices']),
+            copy.deepcopy(case['eboss_choices']), errors, list(case['manga_cart_order']))
+        expected = case['expected']
+        assert apgpicks == expected['apogee']
+        assert manpicks == expected['manga']
+        assert ebopicks == expected['eboss']
+        assert errors == expected['errors']
+
+
+def test_manga_bright_priority(apogee_platedb, assign_carts, monkeypatch):
+    from conftest import insert, label_pk
+
+    session = apogee_platedb[0]
+    # plateid: [(survey, flavor, [transparencies of the linked mangadb exposures]), ...]
+    plates = {
+        8001: [('MaNGA', 'Science', [0.9]), ('MaNGA', 'Science', [0.8])],
+        8002: [],
+        8003: [('MaNGA', 'Science', [0.1]), ('APOGEE-2', 'Science', [5.0])],
+        8004: [('MaNGA', 'Science', [0.5, 3.0])],
+        8005: [('MaNGA', 'Science', [0.3]), ('MaNGA', 'Flat', [10.0]), ('MaNGA', 'Science', [])],
+    }
+    with session.bind.begin() as conn:
+        for plateid, exposures in sorted(plates.items()):
+            plate = insert(conn, 'platedb.plate', plate_id=plateid)
+            plugging = insert(conn, 'platedb.plugging', plate_pk=plate)
+            observation = insert(conn, 'platedb.observation', plugging_pk=plugging)
+            for survey, flavor, transparencies in exposures:
+                exposure = insert(conn, 'platedb.exposure', observation_pk=observation,
+                                  survey_pk=label_pk(conn, 'platedb.survey', survey),
+                                  exposure_flavor_pk=label_pk(conn, 'platedb.exposure_flavor', flavor))
+                for transparency in transparencies:
+                    insert(conn, 'mangadb.exposure', platedb_exposure_pk=exposure, transparency=transparency)
+
+    # sums 1.7, 0, 0.1, 0.5 and 0.3: only MaNGA science exposures count, each through its
+    # first mangadb exposure
+    assert assign_carts.mangaBrightPriority([8005, 8004, 8003, 8002, 8001]) == [8002, 8003, 8005, 8004, 8001]
+    monkeypatch.setattr(assign_carts, 'avoid_cart_2', lambda plateid: plateid in (8001, 8005))
+    assert assign_carts.mangaBrightPriority([8001, 8002, 8003, 8004, 8005]) == [8005, 8001, 8002, 8003, 8004]
@@ -0,0 +1,109 @@
+from __future__ import division
+import os
+
+import numpy as np
+import pytest
+
+from autoscheduler import ephemeris
+from autoscheduler.sdssUtilities.idlasl import ct2lst, moonpos
+
+
+def angle_diff(a, b, period):
+    return (np.asarray(a) - np.asarray(b) + period / 2) % period - period / 2
+
+
+# nights of each site's schedule during which the moon crosses RA = 0
+@pytest.mark.parametrize('site, mjd', [('APO', 56855), ('LCO', 57757)])
+def test_night_ephemeris_matches_direct(site, mjd):
+    eph = ephemeris.NightEphemeris(site, mjd)
+    times = np.concatenate([eph.jd[[0, -1]], np.random.RandomState(mjd).uniform(eph.jd[0], eph.jd[-1], 500)])
+    assert ephemeris.night_mjd(times) == mjd
+    lat, lon = ephemeris.sites[site]
+
+    lst = eph.lst_at(times)
+    assert np.all((lst >= 0) & (lst < 24))
+    assert np.max(np.abs(angle_diff(lst, ct2lst(times, lon), 24))) < 1e-6
+
+    moonra, moondec = eph.moon_at(times)
+    direct = moonpos(times)
+    assert np.all((moonra >= 0) & (moonra < 360))
+    assert np.any(direct[0] < 10) and np.any(direct[0] > 350)
+    assert np.max(np.abs(angle_diff(moonra, direct[0], 360))) < 1e-3
+    assert np.max(np.abs(moondec - direct[1])) < 1e-3
+
+
+def test_night_ephemeris_outside_night():
+    eph = ephemeris.NightEphemeris('APO', 56855)
+    start = 2400000 + 56855 + ephemeris.night_offset
+    eph.lst_at([start, start + 1])
+    for times in [[start - 1e-3], [start + 0.5, start + 1 + 1e-3]]:
+        with pytest.raises(ValueError):
+            eph.lst_at(times)
+        with pytest.raises(ValueError):
+            eph.moon_at(times)
+
+
+@pytest.fixture
+def schedule_dir(tmpdir, monkeypatch):
+    '''The first 20 nights of each master schedule in a scratch schedule directory.'''
+    for site, filename in ephemeris.schedule_files.items():
+        lines = open(os.path.join(ephemeris.schedule_dir, filename)).read().splitlines()
+        header = [line for line in lines if line.startswith('#')]
+        nights = [line for line in lines if not line.startswith('#')][:20]
+        tmpdir.join(filename).write('\n'.join(header + nights) + '\n')
+    monkeypatch.setattr(ephemeris, 'schedule_dir', str(tmpdir))
+    monkeypatch.setattr(ephemeris, '_tableCache', dict())
+    return tmpdir
+
+
+@pytest.mark.parametrize('site', ['APO', 'LCO'])
+def test_ephemeris_table_reused(schedule_dir, site):
+    assert ephemeris.load_ephemeris_table(site) is None
+    built = ephemeris.build_ephemeris_table(site)
+    assert len(built) == 20
+    table = ephemeris.load_ephemeris_table(site)
+    assert isinstance(table, np.memmap)
+    assert np.array_equal(table, built)
+    assert ephemeris.load_ephemeris_table(site) is table
+
+    mjd = int(built['jd'][5]) - 2400000
+    assert ephemeris.table_night(site, mjd)['jd'] == built['jd'][5]
+    assert ephemeris.table_night(site, mjd + 100) is None
+
+
+def test_ephemeris_table_outdated(schedule_dir, monkeypatch):
+    ephemeris.build_ephemeris_table('APO')
+    assert ephemeris.load_ephemeris_table('APO') is not None
+
+    # the schedule changed after the table was built
+    schedule = os.path.join(str(schedule_dir), ephemeris.schedule_files['APO'])
+    mtime = os.path.getmtime(schedule) - 10
+    os.utime(ephemeris.table_path('APO'), (mtime, mtime))
+    assert ephemeris.load_ephemeris_table('APO') is None
+    ephemeris.build_ephemeris_table('APO')
+    assert ephemeris.load_ephemeris_table('APO') is not None
+
+    # the site coordinates changed
+    lat, lon = ephemeris.sites['APO']
+    monkeypatch.setitem(ephemeris.sites, 'APO', (lat, lon + 1))
+    assert ephemeris.load_ephemeris_table('APO') is None
+    table = ephemeris.build_ephemeris_table('APO')
+    assert table['lon'][0] == lon + 1
+    assert ephemeris.load_ephemeris_table('APO') is not None
+
+
+@pytest.mark.parametrize('site', ['APO', 'LCO'])
+def test_table_ephemeris_matches_computed(schedule_dir, site):
+    table = ephemeris.build_ephemeris_table(site)
+    for jd in table['jd'][::4]:
+        mjd = int(jd) - 2400000
+        row = ephemeris.table_night(site, mjd)
+        assert row is not None
+        stored = ephemeris.NightEphemeris(site, mjd, row=row)
+        computed = ephemeris.NightEphemeris(site, mjd)
+        for field in ephemeris.ephemeris_fields:
+            assert np.allclose(getattr(stored, field), getattr(computed, field),
+                               rtol=np.finfo(np.float32).eps, atol=1e-5)
+        times = np.linspace(computed.jd[0], computed.jd[-1], 97)
+        assert np.max(np.abs(angle_diff(stored.lst_at(times), computed.lst_at(times), 24))) < 1e-5
+        assert np.max(np.abs(angle_diff(stored.moon_at(times)[0], computed.moon_at(times)[0], 360))) < 1e-4
@@ -0,0 +1,214 @@
+from __future__ import division
+import threading
+
+import numpy as np
+import pytest
+import sqlalchemy
+from sqlalchemy import event
+
+from autoscheduler.plateDBtools.apogee.get_apogee_plates import StatementCounter
+
+
+@pytest.fixture
+def sqlite_engine():
+    # DatabaseConnection sets the PostgreSQL search path on every new pooled connection,
+    # which SQLite rejects, so that listener is lifted while the SQLite engine is used
+    from sqlalchemy.pool import Pool
+    from autoscheduler.plateDBtools.database.DatabaseConnection import clearSearchPathCallback
+    event.remove(Pool, 'connect', clearSearchPathCallback)
+    engine = sqlalchemy.create_engine('sqlite://')
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        event.listen(Pool, 'connect', clearSearchPathCallback)
+
+
+def test_statement_counter_is_scoped(sqlite_engine):
+    engine = sqlite_engine
+    engine.execute('select 1')
+
+    def other():
+        for i in range(5):
+            engine.execute('select 1')
+
+    with StatementCounter(engine) as counter:
+        engine.execute('select 1')
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        engine.execute('select 2')
+    engine.execute('select 1')
+
+    # only the statements of this thread inside the block
+    assert counter.count == 2
+    assert not event.contains(engine, 'before_cursor_execute', counter._increment)
+
+    # a new block starts from zero
+    with counter:
+        engine.execute('select 1')
+    assert counter.count == 1
+
+
+def apgver(p):
+    d = p['design']
+    if 'apogee_design_type' not in d:
+        return 999
+    return 100*int(d['apogee_short_version']) + 10*int(d['apogee_med_version']) + int(d['apogee_long_version'])
+
+
+def expected_plates(plates, plan=False, allPlates=False, plateList=None, south=False):
+    '''The plates get_plates should load and return, from the fixture data: (loaded, returned)
+    plate dicts'''
+    survey = 'APOGEE-2S' if south else 'APOGEE-2'
+    apogee = [p for p in plates if survey in p['surveys']]
+    lead = lambda p: p['survey_mode'] in (None, 'APOGEE lead')
+    if allPlates:
+        return apogee, apogee
+    if plateList is not None:
+        proto = [p for p in apogee if p['plateid'] in plateList]
+    elif plan:
+        sites = ['LCO', 'du Pont'] if south else ['APO']
+        proto = [p for p in apogee if lead(p) and p['accepted'] and p['location'] in sites]
+    else:
+        proto = [p for p in apogee if lead(p) and any(pl['active'] for pl in p['pluggings'])]
+    locations = set(p['locationid'] for p in proto)
+    loaded = [p for p in apogee if p['locationid'] in locations and (plateList is not None or lead(p))]
+    return loaded, proto
+
+
+def baseline_visits(loaded, exposures, mjd=None):
+    '''The visit history loop of get_plates before it was vectorized, over the fixture data:
+    {plateid: (vdone, sn, snql, snred, hist, reduction)}'''
+    loadedids = [p['plateid'] for p in loaded]
+    exposures_tab = np.array([(m, plateid, np.nan if qr is None else qr, np.nan if red is None else red)
+                              for plateid, m, start, expno, flavor, qr, red in exposures
+                              if flavor == 'Object' and plateid in loadedids], dtype=float).reshape(-1, 4)
+    fullRedCheck = np.column_stack([exposures_tab, np.where(np.isnan(exposures_tab[:, 3]),
+                                                            exposures_tab[:, 2], exposures_tab[:, 3])])
+    proto_good_exp = np.nan_to_num(fullRedCheck)
+    good_exp = proto_good_exp[proto_good_exp[:, 4] > 10]
+
+    result = dict((p['plateid'], [0, 0., 0., 0., [], []]) for p in loaded)
+    for p in loaded:
+        repeat = [pl['plateid'] for pl in loaded
+                  if pl['locationid'] == p['locationid'] and apgver(pl) == apgver(p)]
+        if result[p['plateid']][0] != 0:
+            continue
+        plateExps = good_exp[np.in1d(good_exp[:, 1], repeat)]
+        for d in np.unique(plateExps[:, 0]):
+            if d == mjd:
+                continue
+            day = plateExps[plateExps[:, 0] == d]
+            if day.shape[0] >= 2:
+                for r in repeat:
+                    v = result[r]
+                    v[0] += 1
+                    v[1] += float(np.sum(day[:, 4]**2))
+                    v[2] += float(np.sum(day[:, 2]**2))
+                    v[3] += float(np.sum(day[:, 3]**2))
+                    v[4].append(int(d) + 2400000)
+                    v[5].append(1 if np.sum(day[:, 4]) == np.sum(day[:, 3]) else 0)
+    return result
+
+
+def check_visits(apg, loaded, exposures, mjd=None):
+    expected = baseline_visits(loaded, exposures, mjd=mjd)
+    for p in apg:
+        vdone, sn, snql, snred, hist, reduction = expected[p.plateid]
+        assert p.vdone == vdone
+        assert np.allclose([p.sn, p.snql, p.snred], [sn, snql, snred], rtol=1e-5, atol=0)
+        assert list(p.hist) == hist
+        assert list(p.reduction) == reduction
+        assert p.first_jd == (hist[0] if hist else 0)
+        assert p.last_jd == (hist[-1] if hist else 0)
+
+
+branches = [dict(), dict(plan=True), dict(allPlates=True), dict(plateList=[9003, 9013]),
+            dict(south=True), dict(plan=True, south=True), dict(mjd=57005),
+            dict(plan=True, south=True, mjd=57004)]
+
+
+def test_get_plates_branches(apogee_platedb):
+    from autoscheduler.plateDBtools.apogee.get_apogee_plates import get_plates
+    session, plates, exposures = apogee_platedb
+    for kwargs in branches:
+        select = dict((k, v) for k, v in kwargs.items() if k != 'mjd')
+        loaded, returned = expected_plates(plates, **select)
+        # every branch returns plates, and the history of some comes from other plates
+        # at their location
+        assert len(returned) > 0
+        assert len(loaded) > len(returned) or kwargs.get('allPlates')
+        apg = get_plates(session=session, loud=False, **kwargs)
+        assert [p.plateid for p in apg] == sorted(p['plateid'] for p in returned)
+        check_visits(apg, loaded, exposures, mjd=kwargs.get('mjd'))
+
+
+def test_plate_table_matches_objects(apogee_platedb):
+    # schedule_apogee loads a PlateTable with visits aggregated in SQL; it must agree with the
+    # ApogeePlate objects built from every exposure
+    from autoscheduler.plateDBtools.apogee.get_apogee_plates import get_plates, PlateTable
+    session, plates, exposures = apogee_platedb
+    fields = ['plateid', 'locationid', 'name', 'plate_loc', 'ra', 'dec', 'ha', 'minha', 'maxha',
+              'manual_priority', 'plugged', 'lead_survey', 'cadence', 'driver', 'vplan', 'apgver',
+              'exp_time', 'coobs', 'apogee_survey_mode', 'vdone', 'first_jd', 'last_jd']
+    for kwargs in branches:
+        select = dict((k, v) for k, v in kwargs.items() if k != 'mjd')
+        loaded, returned = expected_plates(plates, **select)
+        objects = get_plates(session=session, loud=False, **kwargs)
+        table = get_plates(session=session, loud=False, table=True, exposureList=False, **kwargs)
+        assert isinstance(table, PlateTable)
+        assert len(table) == len(objects)
+        for p, q in zip(table, objects):
+            for f in fields:
+                assert getattr(p, f) == getattr(q, f), f
+            assert np.allclose([p.sn, p.snql, p.snred], [q.sn, q.snql, q.snred], rtol=1e-5, atol=0)
+            assert np.array_equal(p.hist, q.hist)
+            assert np.array_equal(p.reduction, q.reduction)
+            assert abs(p.pct() - q.pct()) < 1e-6
+            assert len(p.exposureList) == 0
+        assert sum(len(q.exposureList) for q in objects) > 0
+        check_visits(table, loaded, exposures, mjd=kwargs.get('mjd'))
+
+
+def test_apogee_lead_matches_lead_survey(apogee_platedb):
+    # The plate queries used to select APOGEE-led plates with platedb.lead_survey(). The
+    # fixture database has a stand-in for that function (see data/platedb_schema.sql), not
+    # the production one, so this checks the survey mode join against its documented rule.
+    from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as pdb
+    from autoscheduler.plateDBtools.apogee.get_apogee_plates import get_plates, apogeeLead
+    session, plates, exposures = apogee_platedb
+    leadSurvey = sqlalchemy.func.platedb.lead_survey(pdb.Plate.plate_id) == 'apogeeLead'
+
+    with session.begin():
+        old = session.query(pdb.Plate.plate_id).filter(leadSurvey).all()
+        new = session.query(pdb.Plate.plate_id).outerjoin(pdb.Plate.currentSurveyMode)\
+            .filter(apogeeLead(pdb)).all()
+    assert sorted(old) == sorted(new)
+    assert 0 < len(new) < len(plates)
+
+    for south in (False, True):
+        with session.begin():
+            survey = session.query(pdb.Survey).filter(pdb.Survey.label == ('APOGEE-2S' if south else 'APOGEE-2')).one()
+            sites = ['LCO', 'du Pont'] if south else ['APO']
+            # the plan and observing-mode plate queries as they were
+            plan = session.query(pdb.Plate.plate_id)\
+                .join(pdb.PlateToSurvey, pdb.Survey)\
+                .join(pdb.PlateLocation)\
+                .join(pdb.PlateToPlateStatus, pdb.PlateStatus)\
+                .filter(pdb.Survey.pk == survey.pk)\
+                .filter(pdb.PlateLocation.label.in_(sites))\
+                .filter(leadSurvey)\
+                .filter(pdb.PlateStatus.label == 'Accepted').all()
+            plugged = session.query(pdb.Plate.plate_id)\
+                .join(pdb.PlateToSurvey, pdb.Survey)\
+                .join(pdb.Plugging, pdb.Cartridge)\
+                .join(pdb.ActivePlugging)\
+                .filter(pdb.Survey.pk == survey.pk)\
+                .filter(leadSurvey)\
+                .order_by(pdb.Cartridge.number).all()
+        for kwargs, old in [(dict(plan=True), plan), (dict(), plugged)]:
+            for table in (False, True):
+                apg = get_plates(session=session, loud=False, south=south, table=table, **kwargs)
+                assert [p.plateid for p in apg] == sorted(set(p[0] for p in old))
+                assert all(p.lead_survey == 'apg' for p in apg)
@@ -0,0 +1,80 @@
+import itertools
+
+from conftest import insert, label_pk
+
+
+def test_completion_statuses_match_per_plate(apogee_platedb):
+    from autoscheduler.plateDBtools.database.apo.platedb import ModelClasses as plateDB
+
+    session = apogee_platedb[0]
+    surveys = [[], ['MaNGA'], ['BOSS'], ['eBOSS'], ['BOSS', 'eBOSS'], ['APOGEE-2', 'eBOSS']]
+    statuses = ['Automatic', 'Force Complete', 'Force Incomplete']
+    pluggings = [[], ['Bad'], ['Good'], ['Bad', 'Good on Obs'], ['Bad', 'Overwritten']]
+    with session.bind.begin() as conn:
+        # pk = 0 is "Automatic"
+        if conn.execute('SELECT pk FROM platedb.plate_completion_status WHERE pk = 0').scalar() is None:
+            insert(conn, 'platedb.plate_completion_status', pk=0, label='Automatic')
+        plateid = 8100
+        for plate_surveys, status, plate_pluggings in itertools.product(surveys, statuses, pluggings):
+            plateid += 1
+            plate = insert(conn, 'platedb.plate', plate_id=plateid, plate_completion_status_pk=label_pk(
+                conn, 'platedb.plate_completion_status', status))
+            for survey in plate_surveys:
+                insert(conn, 'platedb.plate_to_survey', plate_pk=plate,
+                       survey_pk=label_pk(conn, 'platedb.survey', survey))
+            for plugging in plate_pluggings:
+                insert(conn, 'platedb.plugging', plate_pk=plate,
+                       plugging_status_pk=label_pk(conn, 'platedb.plugging_status', plugging))
+
+    plates = session.query(plateDB.Plate).filter(plateDB.Plate.plate_id.between(8101, plateid)).all()
+    assert len(plates) == len(surveys) * len(statuses) * len(pluggings)
+    expected = dict((p.pk, p.calculatedCompletionStatus()) for p in plates)
+    assert set(expected.values()) == set(['n/a', 'Complete', 'Incomplete', 'Force Complete', 'Force Incomplete'])
+    assert plateDB.Plate.calculatedCompletionStatuses(session, set(expected)) == expected
+    assert plateDB.Plate.calculatedCompletionStatuses(session, set()) == {}
+
+
+def baseline_plugged(rows):
+    '''The observing-mode plate list and cart matching of get_plates before plugged_query: one
+    entry per row, and each row sets the cart of the first entry with its plate id.'''
+    ebo = [{'plateid': int(p), 'platepk': int(pk), 'plugged': 0} for c, p, pk in rows]
+    for c, p, pk in rows:
+        wplate = [x for x in range(len(ebo)) if ebo[x]['plateid'] == p]
+        if len(wplate) == 0: continue
+        ebo[wplate[0]]['plugged'] = c
+    return ebo
+
+
+def test_plugged_plates_match_baseline(apogee_platedb):
+    from autoscheduler.eboss import get_eboss_plates
+
+    session = apogee_platedb[0]
+    with session.bind.begin() as conn:
+        def plugged_plate(plateid, surveys, cart, pointings=1):
+            plate = insert(conn, 'platedb.plate', plate_id=plateid)
+            for survey in surveys:
+                insert(conn, 'platedb.plate_to_survey', plate_pk=plate,
+                       survey_pk=label_pk(conn, 'platedb.survey', survey))
+            for i in range(pointings):
+                insert(conn, 'platedb.plate_pointing', plate_pk=plate, pointing_name='ABCDEF'[i])
+            plugging = insert(conn, 'platedb.plugging', plate_pk=plate,
+                              cartridge_pk=insert(conn, 'platedb.cartridge', number=cart) if cart else None)
+            insert(conn, 'platedb.active_plugging', plugging_pk=plugging)
+
+        plugged_plate(8201, ['eBOSS'], 21)
+        plugged_plate(8202, ['BOSS', 'eBOSS'], 22)
+        plugged_plate(8203, ['eBOSS'], None)
+        plugged_plate(8204, ['BOSS'], 23, pointings=2)
+        plugged_plate(8205, ['MaNGA'], 24)
+        insert(conn, 'platedb.plate_to_survey', plate_pk=insert(conn, 'platedb.plate', plate_id=8206),
+               survey_pk=label_pk(conn, 'platedb.survey', 'eBOSS'))
+
+    rows = session.execute(get_eboss_plates.plugged_query, {'survey1': 'BOSS', 'survey2': 'eBOSS'}).fetchall()
+    assert sorted(set(p for c, p, pk in rows)) == [8201, 8202, 8203, 8204]
+    assert len(rows) == 6
+
+    ebo = get_eboss_plates.get_plates(plan=False, loud=False)
+    assert [{'plateid': e.plateid, 'platepk': e.platepk, 'plugged': e.plugged} for e in ebo] == \
+        baseline_plugged(rows)
+    assert [(e.plateid, e.plugged) for e in ebo] == \
+        [(8201, 21), (8202, 22), (8202, 0), (8204, 23), (8204, 0), (8203, None)]
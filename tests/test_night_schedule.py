@@ -0,0 +1,58 @@
+from __future__ import division
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from autoscheduler import night_schedule
+
+schedules = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schedules')
+
+
+@pytest.fixture
+def schedule_file(tmpdir):
+    night_schedule._scheduleCache.clear()
+    filename = str(tmpdir.join('Sch_base.18_eb_MaStar.txt'))
+    shutil.copy(os.path.join(schedules, 'Sch_base.18_eb_MaStar.txt'), filename)
+    return filename
+
+
+def test_load_schedule_writes_sidecar(schedule_file):
+    schedule = night_schedule.load_schedule(schedule_file)
+    # only the sidecar is left next to the schedule, no temporary files
+    assert sorted(os.listdir(os.path.dirname(schedule_file))) == \
+        [os.path.basename(schedule_file), os.path.basename(schedule_file) + '.npy']
+    assert night_schedule.schedule_dtype_ok(schedule)
+    assert np.array_equal(schedule, night_schedule.parse_schedule(schedule_file))
+
+    # a new process reads the sidecar
+    night_schedule._scheduleCache.clear()
+    sidecar = night_schedule.load_schedule(schedule_file)
+    assert isinstance(sidecar, np.memmap)
+    assert np.array_equal(sidecar, schedule)
+
+
+def test_load_schedule_cache_key_includes_south(schedule_file):
+    north = night_schedule.load_schedule(schedule_file)
+    south = night_schedule.load_schedule(schedule_file, south=True)
+    assert 'comment' in north.dtype.names
+    assert 'programs' in south.dtype.names
+    assert night_schedule.load_schedule(schedule_file) is north
+
+
+def test_load_schedule_rejects_bad_sidecar(schedule_file):
+    expected = night_schedule.parse_schedule(schedule_file)
+    sidecar = schedule_file + '.npy'
+
+    # a sidecar with the other site's columns
+    np.save(sidecar, night_schedule.parse_schedule(schedule_file, south=True))
+    assert np.array_equal(night_schedule.load_schedule(schedule_file), expected)
+    assert night_schedule.schedule_dtype_ok(np.load(sidecar))
+
+    # a truncated sidecar
+    night_schedule._scheduleCache.clear()
+    with open(sidecar, 'wb') as f:
+        f.write(b'\x93NUMPY')
+    assert np.array_equal(night_schedule.load_schedule(schedule_file), expected)
+    assert np.array_equal(np.load(sidecar), expected)
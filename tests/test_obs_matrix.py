@@ -0,0 +1,130 @@
+from __future__ import division
+
+import astropysics.coords as coo
+import astropysics.obstools as obs
+import numpy as np
+
+from autoscheduler.ephemeris import sites
+from autoscheduler.obs_matrix import LSTWindowIndex, outside_window_at, secz_at, julian_epoch
+
+
+def brute_force_within(minlst, maxlst, beglst, endlst):
+    '''All (plate, slot) pairs with the slot wholly within the plate window.'''
+    plates, slots = [], []
+    for i in range(len(minlst)):
+        for j in range(len(beglst)):
+            if np.isnan(minlst[i]) or np.isnan(maxlst[i]):
+                continue
+            if not outside_window_at(minlst[i], maxlst[i], beglst[j], endlst[j]):
+                plates.append(i)
+                slots.append(j)
+    return sorted(zip(plates, slots))
+
+
+def windows(rng, n):
+    '''Plate windows like ra/15 + ha limits: starting before 0h or after 24h, wrapping
+    past 24h, full-day, empty, inverted and unset.'''
+    center = rng.uniform(0, 24, n)
+    width = rng.uniform(0.5, 12, n)
+    kind = rng.randint(0, 10, n)
+    width[kind == 0] = 24.
+    width[kind == 1] = rng.uniform(24, 30, np.sum(kind == 1))
+    width[kind == 2] = 0.
+    width[kind == 3] = -1.
+    minlst = center - width / 2
+    maxlst = center + width / 2
+    minlst[kind == 4] = np.nan
+    return minlst, maxlst
+
+
+def slots(rng, n):
+    '''Slots of 0.5 to 2 h, including slots that wrap past 24h and slots that start on
+    a window edge.'''
+    beglst = rng.uniform(0, 24, n)
+    beglst[:4] = [0., 12., 23.5, 23.9]
+    endlst = (beglst + rng.uniform(0.5, 2, n)) % 24
+    return beglst, endlst
+
+
+def test_within_matches_brute_force():
+    rng = np.random.RandomState(16)
+    for trial in range(20):
+        minlst, maxlst = windows(rng, 60)
+        beglst, endlst = slots(rng, 40)
+        # slots starting exactly on a window start
+        beglst[4:8] = minlst[~np.isnan(minlst)][:4] % 24
+        endlst[4:8] = (beglst[4:8] + 1) % 24
+        index = LSTWindowIndex(minlst, maxlst)
+        plates, found = index.within(minlst, maxlst, beglst, endlst)
+        assert sorted(zip(plates, found)) == brute_force_within(minlst, maxlst, beglst, endlst)
+
+
+def test_within_wrapping_and_full_day_windows():
+    # a window wrapping past 24h, one starting before 0h and a full-day window
+    minlst = np.array([22., -2., 0., 5.])
+    maxlst = np.array([27., 3., 24., 5.])
+    beglst = np.array([23., 0.5, 23.5, 12.])
+    endlst = np.array([0.5, 1.5, 0.5, 13.])
+    index = LSTWindowIndex(minlst, maxlst)
+    plates, found = index.within(minlst, maxlst, beglst, endlst)
+    expected = brute_force_within(minlst, maxlst, beglst, endlst)
+    assert sorted(zip(plates, found)) == expected
+    assert (0, 0) in expected and (1, 1) in expected and (2, 3) in expected
+
+
+def apparent_secz(site, ra, dec, jd, refraction):
+    '''sec z from astropysics Site.apparentCoordinates, as the per-plate loops computed it.'''
+    horz = site.apparentCoordinates(coo.ICRSCoordinates(ra, dec), datetime=[jd], refraction=refraction)
+    return 1 / np.cos((90.0 - horz[0].alt.d) * np.pi / 180)
+
+
+def secz_pairs(south, refraction):
+    '''secz_at and the apparentCoordinates path for random plates and times of a night.'''
+    lat, lon = sites['LCO' if south else 'APO']
+    site = obs.Site(lat, lon)
+    rng = np.random.RandomState(13)
+    n = 400
+    ra = rng.uniform(0, 360, n)
+    dec = rng.uniform(-60, 20, n) if south else rng.uniform(-20, 80, n)
+    jd = 2457813.5 + rng.uniform(0, 0.5, n)
+    lst = np.array([site.localSiderialTime(j) for j in jd])
+    # plates near the zenith, where the 1.003 cut applies
+    dec[:40] = lat + rng.uniform(-6, 6, 40)
+    ra[:40] = (lst[:40] * 15 + rng.uniform(-6, 6, 40)) % 360
+    z = secz_at(ra, dec, lst, lat, refraction=refraction, equinox=julian_epoch(jd[0]))
+    expected = np.array([apparent_secz(site, r, d, j, refraction) for r, d, j in zip(ra, dec, jd)])
+    return z, expected
+
+
+def check_cuts(z, expected, tolerance, zenith_tolerance):
+    # airmasses the cuts care about: from the zenith out to beyond the largest maxz
+    used = (expected > 0) & (expected < 3.5)
+    assert np.sum(used) > 100
+    assert np.sum(expected[used] < 1.01) > 10
+    diff = np.abs(z[used] - expected[used])
+    assert np.all(diff <= tolerance * expected[used])
+    # both sides of every cut agree, except within the tolerance of the cut
+    for cut in [1.003, 1.5, 2., 3.]:
+        clear = np.abs(expected[used] - cut) > tolerance * cut
+        assert np.array_equal((z[used] < cut)[clear], (expected[used] < cut)[clear])
+    # the zenith cut needs much less than its 0.003 margin
+    zenith = expected[used] < 1.01
+    assert np.all(diff[zenith] < zenith_tolerance)
+
+
+def test_secz_at_matches_apparent_coordinates():
+    for south in [False, True]:
+        z, expected = secz_pairs(south, False)
+        check_cuts(z, expected, 5e-4, 5e-5)
+
+
+def test_secz_at_refraction():
+    for south in [False, True]:
+        z, expected = secz_pairs(south, True)
+        # astropysics evaluates its Meeus formula in radians, which lowers plates near the
+        # zenith by about 12 arcmin; co_refract_forward gives the usual correction
+        check_cuts(z, expected, 5e-3, 5e-4)
+        # refraction raises the plates, lowering their airmass
+        unrefracted, _ = secz_pairs(south, False)
+        above = unrefracted > 0
+        assert np.all(z[above] <= unrefracted[above])
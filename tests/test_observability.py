@@ -0,0 +1,317 @@
+from __future__ import division
+import imp
+import os
+
+import astropysics.coords as coo
+import numpy as np
+
+from autoscheduler.apogee.observability import obs_matrix
+from autoscheduler.ephemeris import sites
+from autoscheduler.obs_matrix import secz_at
+
+# the autoscheduler.eboss package imports its scheduler, which connects to platedb
+eboss_observability = imp.load_source('eboss_observability', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python', 'autoscheduler', 'eboss', 'observability.py'))
+
+par = {'moon_threshold': 15., 'maxz': 2.}
+equinox = 2017.2
+
+
+class Plate(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def loop_observability(apg, par, beglst, endlst, samplst, lengths, moonra, moondec, lat, south=False):
+    '''The per-plate, per-slot loop of apogee.observability before it became a matrix
+    computation, fed the same LSTs, moon positions and airmass kernel. The loop raised a
+    TypeError on plates without HA limits; here they are outside the HA range (-1), as in
+    the eBOSS engine.'''
+    obsarr = np.zeros([len(apg), len(lengths)])
+    mpos = [coo.ICRSCoordinates(moonra[t], moondec[t]) for t in range(len(lengths))]
+
+    for p in range(len(apg)):
+        if apg[p].priority <= 0:
+            continue
+        for t in range(len(lengths)):
+            obsarr[p, t] = apg[p].priority
+
+        if apg[p].manual_priority == 10:
+            extra_time = 0.25
+        else:
+            extra_time = 0
+        platecoo = coo.ICRSCoordinates(apg[p].ra, apg[p].dec)
+        platelst = float(apg[p].ra + apg[p].ha) / 15
+        minlst = float(apg[p].ra + apg[p].minha) / 15 - extra_time
+        maxlst = float(apg[p].ra + apg[p].maxha) / 15 + extra_time
+
+        for t in range(len(lengths)):
+            usedminlst, usedmaxlst = minlst, maxlst
+            if minlst < 0 and beglst[t] > 12 and endlst[t] > 12:
+                usedminlst += 24
+                usedmaxlst += 24
+            if maxlst > 24 and beglst[t] < 12 and endlst[t] < 12:
+                usedminlst -= 24
+                usedmaxlst -= 24
+            if beglst[t] > endlst[t]:
+                if minlst < 12:
+                    usedminlst += 24
+                if maxlst > 12:
+                    usedmaxlst -= 24
+
+            if beglst[t] > endlst[t]:
+                lstsum = beglst[t]+endlst[t]-24
+                if platelst > 12:
+                    usedplatelst = platelst - 24
+                else:
+                    usedplatelst = platelst
+            else:
+                lstsum = beglst[t]+endlst[t]
+                if beglst[t] > 18 and platelst < 4:
+                    usedplatelst = platelst + 24
+                elif beglst[t] < 4 and platelst > 18:
+                    usedplatelst = platelst - 24
+                else:
+                    usedplatelst = platelst
+
+            obsarr[p, t] += 50.0 * float(np.exp(-(usedplatelst - lstsum/2 + lengths[t]/2)**2 / 2))
+
+            moondist = mpos[t] - platecoo
+            if moondist.d < par['moon_threshold']:
+                obsarr[p, t] = -3
+                continue
+
+            if np.isnan(minlst) or np.isnan(maxlst):
+                obsarr[p, t] = -1
+                continue
+
+            if beglst[t] < usedminlst or endlst[t] > usedmaxlst:
+                obsarr[p, t] = -1
+                continue
+
+            secz = [float(secz_at(apg[p].ra, apg[p].dec, x, lat, equinox=equinox)) for x in samplst[t]]
+            if south:
+                badsecz = [x for x in secz if x > par['maxz']]
+            elif apg[p].manual_priority == 10:
+                badsecz = [x for x in secz if x > par['maxz']]
+            else:
+                badsecz = [x for x in secz if x < 1.003 or x > par['maxz']]
+            if len(badsecz) > 0:
+                obsarr[p, t] = -2
+
+            if t == len(lengths) - 1:
+                if apg[p].exp_time == 1000.0:
+                    obsarr[p, t] = obsarr[p, t] / 3.0
+
+            if lengths[t] < 1.0:
+                if apg[p].exp_time == 1000.0:
+                    obsarr[p, t] = obsarr[p, t] / 3.0
+                elif apg[p].cadence == 'kep_koi' or apg[p].cadence == 'substellar':
+                    obsarr[p, t] = obsarr[p, t] / 2.5
+                elif apg[p].vplan == 3:
+                    obsarr[p, t] = obsarr[p, t] / 2.0
+                elif apg[p].vplan > 3:
+                    obsarr[p, t] = obsarr[p, t] / 1.5
+    return obsarr
+
+
+def plates(rng, n, lat):
+    '''Plates around the sky and near the zenith, with a mix of priorities, HA windows
+    (including windows past 0h and 24h), exposure times and cadences.'''
+    apg = []
+    for i in range(n):
+        ra = rng.uniform(0, 360)
+        dec = rng.uniform(lat - 5, lat + 5) if i % 7 == 0 else rng.uniform(lat - 60, min(lat + 50, 89))
+        ha = rng.uniform(-30, 30)
+        apg.append(Plate(ra=ra, dec=dec, ha=ha,
+                         minha=ha - rng.uniform(5, 60) - 7.5, maxha=ha + rng.uniform(5, 60) + 7.5,
+                         priority=[0., 100., 200., 500.][rng.randint(4)],
+                         manual_priority=[0, 5, 10][rng.randint(3)],
+                         exp_time=[500., 1000.][rng.randint(2)],
+                         cadence=['default', 'kep_koi', 'substellar'][rng.randint(3)],
+                         vplan=[1, 3, 6][rng.randint(3)]))
+    # plates missing one or both HA limits
+    apg[1].minha = np.nan
+    apg[2].maxha = np.nan
+    apg[3].minha = apg[3].maxha = np.nan
+    for p in apg[1:4]:
+        p.priority = 100.
+    return apg
+
+
+def slots(rng, n):
+    '''Slots through a night that crosses 0h LST, so some slots wrap past 24h.'''
+    lengths = rng.choice([0.5, 1.0, 1.5], n)
+    beglst = (20. + np.cumsum(np.append(0, lengths[:-1]))) % 24
+    beglst[n // 2] = 23.7
+    endlst = (beglst + lengths) % 24
+    samplst = (beglst[:, np.newaxis] + lengths[:, np.newaxis] / 2 * np.arange(3)) % 24
+    return beglst, endlst, samplst, lengths
+
+
+def columns(apg):
+    return dict((f, np.array([getattr(p, f) for p in apg])) for f in
+                ['priority', 'manual_priority', 'ra', 'dec', 'ha', 'minha', 'maxha', 'exp_time', 'cadence', 'vplan'])
+
+
+def check_against_loop(south, seed):
+    lat = sites['LCO' if south else 'APO'][0]
+    rng = np.random.RandomState(seed)
+    apg = plates(rng, 150, lat)
+    beglst, endlst, samplst, lengths = slots(rng, 10)
+    beglst[0], endlst[0] = 23.5, 0.5
+    moonra = rng.uniform(0, 360, len(lengths))
+    moondec = rng.uniform(-25, 25, len(lengths))
+
+    expected = loop_observability(apg, par, beglst, endlst, samplst, lengths, moonra, moondec, lat, south=south)
+    obsarr = obs_matrix(columns(apg), par, beglst, endlst, samplst, lengths, moonra, moondec, lat, south=south,
+                        equinox=equinox)
+    assert obsarr.shape == expected.shape
+    assert np.array_equal(obsarr < 0, expected < 0)
+    assert np.array_equal(obsarr[obsarr < 0], expected[expected < 0])
+    assert np.allclose(obsarr, expected, rtol=1e-12, atol=0)
+    # every code comes up, so the comparison covers each branch
+    for code in [0, -1, -2, -3]:
+        assert np.any(expected == code)
+    assert np.any(expected > 0)
+    return obsarr, expected
+
+
+def test_apogee_matrix_matches_loop_north():
+    for seed in range(3):
+        check_against_loop(False, seed)
+
+
+def test_apogee_matrix_matches_loop_south():
+    for seed in range(3):
+        check_against_loop(True, seed)
+
+
+def test_apogee_missing_ha_limits():
+    obsarr, expected = check_against_loop(False, 7)
+    # plates without HA limits are outside the HA range in every slot, unless the moon
+    # rules them out first
+    assert np.array_equal(obsarr[1:4], expected[1:4])
+    assert np.all((obsarr[1:4] == -1) | (obsarr[1:4] == -3))
+    assert np.any(obsarr[1:4] == -1)
+
+
+eboss_par = {'exposure': 16.5, 'maxz': 2.0, 'moon_threshold': 30, 'refraction': False}
+
+
+def eboss_loop_observability(ebo, par, beglst, endlst, midlst, moonra, moondec, lat):
+    '''The per-plate, per-block loop of eboss.observability before it became a matrix
+    computation, fed the same LSTs, moon positions and airmass kernel. The loop left plates
+    without a minimum HA at their base priority and raised a TypeError on plates without a
+    maximum HA; here both are outside the HA range (-1) after the moon check.'''
+    obsarr = np.zeros([len(ebo), len(beglst)])
+    mpos = [coo.ICRSCoordinates(moonra[t], moondec[t]) for t in range(len(beglst))]
+
+    for p in range(len(ebo)):
+        for t in range(len(beglst)):
+            obsarr[p, t] = ebo[p].manual_priority * 100
+
+        platecoo = coo.ICRSCoordinates(ebo[p].ra, ebo[p].dec)
+        platelst = float(ebo[p].ra + ebo[p].ha) / 15
+        nolimit = ebo[p].minha is None or ebo[p].maxha is None
+        if not nolimit:
+            minlst = float(ebo[p].ra + ebo[p].minha) / 15
+            maxlst = float(ebo[p].ra + ebo[p].maxha) / 15
+
+        for t in range(len(beglst)):
+            if not nolimit:
+                usedminlst, usedmaxlst = minlst, maxlst
+                if minlst < 0 and beglst[t] > 12 and endlst[t] > 12:
+                    usedminlst += 24
+                    usedmaxlst += 24
+                if maxlst > 24 and beglst[t] < 12 and endlst[t] < 12:
+                    usedminlst -= 24
+                    usedmaxlst -= 24
+                if beglst[t] > endlst[t]:
+                    if minlst < 12:
+                        usedminlst += 24
+                    if maxlst > 12:
+                        usedmaxlst -= 24
+
+            if beglst[t] > endlst[t]:
+                lstsum = beglst[t]+endlst[t]-24
+                if platelst > 12:
+                    usedplatelst = platelst - 24
+                else:
+                    usedplatelst = platelst
+            else:
+                lstsum = beglst[t]+endlst[t]
+                if beglst[t] > 18 and platelst < 4:
+                    usedplatelst = platelst + 24
+                elif beglst[t] < 4 and platelst > 18:
+                    usedplatelst = platelst - 24
+                else:
+                    usedplatelst = platelst
+
+            obsarr[p, t] += 50.0 * float(np.exp(-(usedplatelst - lstsum/2 + par['exposure']/60/2)**2 / 2))
+
+            moondist = mpos[t] - platecoo
+            if moondist.d < par['moon_threshold']:
+                obsarr[p, t] = -3
+                continue
+
+            if nolimit:
+                obsarr[p, t] = -1
+                continue
+
+            if beglst[t] < usedminlst or endlst[t] > usedmaxlst:
+                obsarr[p, t] = -1
+                continue
+
+            secz = float(secz_at(ebo[p].ra, ebo[p].dec, midlst[t], lat, equinox=equinox))
+            if secz < 1.003 or secz > par['maxz']:
+                obsarr[p, t] = -2
+    return obsarr
+
+
+def check_eboss_against_loop(seed):
+    lat = sites['APO'][0]
+    rng = np.random.RandomState(seed)
+    ebo = []
+    for i in range(150):
+        dec = rng.uniform(lat - 5, lat + 5) if i % 7 == 0 else rng.uniform(-10, 80)
+        ha = rng.uniform(-30, 30)
+        ebo.append(Plate(plateid=i, ra=rng.uniform(0, 360), dec=dec, ha=ha,
+                         minha=ha - rng.uniform(5, 60) - 7.5, maxha=ha + rng.uniform(5, 60) + 7.5,
+                         manual_priority=[0, 2, 5][rng.randint(3)]))
+    # plates missing one or both HA limits, as None from platedb
+    ebo[1].minha = None
+    ebo[2].maxha = None
+    ebo[3].minha = ebo[3].maxha = None
+
+    # consecutive blocks through a night that crosses 0h LST
+    length = eboss_par['exposure'] / 60
+    beglst = (19. + length * np.arange(40)) % 24
+    endlst = (beglst + length) % 24
+    midlst = (beglst + length / 2) % 24
+    moonra = rng.uniform(0, 360, len(beglst))
+    moondec = rng.uniform(-25, 25, len(beglst))
+
+    expected = eboss_loop_observability(ebo, eboss_par, beglst, endlst, midlst, moonra, moondec, lat)
+    obsarr = eboss_observability.obs_matrix(eboss_observability.plate_columns(ebo), eboss_par, beglst, endlst,
+                                            midlst, moonra, moondec, lat, equinox=equinox)
+    assert obsarr.shape == expected.shape
+    assert np.array_equal(obsarr[obsarr < 0], expected[expected < 0])
+    assert np.allclose(obsarr, expected, rtol=1e-12, atol=0)
+    for code in [-1, -2, -3]:
+        assert np.any(expected == code)
+    assert np.any(expected > 0)
+    return ebo, obsarr
+
+
+def test_eboss_matrix_matches_loop():
+    for seed in range(3):
+        check_eboss_against_loop(seed)
+
+
+def test_eboss_missing_ha_limits():
+    ebo, obsarr = check_eboss_against_loop(7)
+    # the loop used to leave these plates at their base priority of manual_priority * 100;
+    # they are now outside the HA range in every block, unless the moon rules them out first
+    assert np.all((obsarr[1:4] == -1) | (obsarr[1:4] == -3))
+    assert np.all(np.any(obsarr[1:4] == -1, axis=1))
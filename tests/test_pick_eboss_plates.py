@@ -0,0 +1,102 @@
+from __future__ import division
+import imp
+import os
+
+import numpy as np
+
+# the autoscheduler.eboss package imports its scheduler, which connects to platedb
+pick_eboss_plates = imp.load_source('pick_eboss_plates', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python', 'autoscheduler', 'eboss',
+    'pick_eboss_plates.py'))
+
+
+class Plate(object):
+    def __init__(self, plateid, plugged, nleft):
+        self.plateid = plateid
+        self.plugged = plugged
+        self.nleft = nleft
+
+    def visleft(self, par):
+        return self.nleft
+
+
+def baseline_place_plates(ebo, par, times, obs):
+    '''pick_plates before the cart budget and slot candidates were tracked incrementally,
+    returning chosen.'''
+    chosen = [-1 for x in times]
+
+    for p in range(len(ebo)):
+        if ebo[p].plugged == 0: continue
+        nleft = ebo[p].visleft(par)
+        if nleft == 0 or max(obs[p,:]) < 0:
+            for t in range(len(times)): obs[p,t] = -10
+            continue
+        optslot = [x for x in range(len(times)) if obs[p,x] == max(obs[p,:])][0]
+        centerslot = int(round(nleft / 2)-1)
+        if optslot < centerslot: startslot = 0
+        elif optslot > len(times)-nleft+centerslot: startslot = len(times) - nleft - 1
+        else: startslot = optslot-centerslot
+
+        if chosen[startslot] >= 0: startslot += 1
+        if startslot+nleft < len(chosen):
+            if chosen[startslot+nleft] >= 0: startslot += -1
+
+        for i in range(nleft):
+            if startslot+i >= len(chosen): continue
+            chosen[startslot+i] = ebo[p].plateid
+        for t in range(len(times)): obs[p,t] = -10
+
+    t = 0
+    while t < len(chosen):
+        if chosen[t] >= 0 or len(np.unique(chosen)) > par['ncarts']:
+            t += 1
+            continue
+        priorder = np.argsort(obs[:,t])
+        p = priorder[-1]
+        if obs[p,t] < 0:
+            t += 1
+            continue
+        nleft = ebo[p].visleft(par)
+        endblock = min([t+nleft, len(chosen)-1])
+        if obs[p,endblock] < 0:
+            obs[p,t] = -10
+            continue
+        for i in range(nleft):
+            if t+i >= len(chosen): continue
+            chosen[t+i] = ebo[p].plateid
+        for i in range(len(times)): obs[p,i] = -10
+    return chosen
+
+
+def test_place_plates_matches_baseline():
+    budget_used = plugged_placed = 0
+    for seed in range(200):
+        rng = np.random.RandomState(seed)
+        nplates, nslots = rng.randint(1, 40), rng.randint(5, 40)
+        ebo = [Plate(5000 + i, rng.randint(1, 10) if rng.rand() < 0.15 else 0, rng.randint(0, 6))
+               for i in range(nplates)]
+        # priorities, with unobservable stretches (-1, -2, -3) and some fully unobservable plates
+        obs = rng.uniform(0, 600, (nplates, nslots))
+        obs[rng.rand(nplates, nslots) < 0.3] = rng.choice([-1, -2, -3])
+        obs[rng.rand(nplates) < 0.1, :] = -1
+        par = {'ncarts': rng.randint(1, 9)}
+        times = np.arange(nslots)
+
+        expected_obs = obs.copy()
+        expected = baseline_place_plates(ebo, par, times, expected_obs)
+        chosen = pick_eboss_plates.place_plates(ebo, par, times, obs, loud=False)
+        assert chosen == expected
+        assert np.array_equal(obs, expected_obs)
+
+        budget_used += len(set(chosen)) > par['ncarts'] and -1 in chosen
+        plugged_placed += any(p.plugged and p.plateid in chosen for p in ebo)
+    # the cases include nights that run out of carts with slots left, and plugged plates
+    assert budget_used > 0
+    assert plugged_placed > 0
+
+
+def test_pick_plates_returns_chosen_plates():
+    ebo = [Plate(5001, 0, 2), Plate(5002, 3, 1), Plate(5003, 0, 2)]
+    obs = np.array([[100., 100., 100., 100.], [0., 0., 0., 50.], [-1., -1., -1., -1.]])
+    assert pick_eboss_plates.pick_plates(ebo, {'ncarts': 8}, np.arange(4), obs, loud=False) == \
+        [{'plate': 5001}, {'plate': 5002}]
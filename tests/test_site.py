@@ -0,0 +1,31 @@
+from __future__ import division
+import datetime
+
+import numpy as np
+from astropy import time
+
+from autoscheduler.sdssUtilities.Site import Site
+
+
+def test_lst_to_date_default_returns_time():
+    assert isinstance(Site().localSiderealTimeToDate(5.), time.Time)
+
+
+def test_lst_to_date_autodetects_format():
+    site = Site()
+    jd = time.Time('2017-03-01T00:00:00', scale='tai').jd
+    expected = site.localSiderealTimeToDate(5., date=jd)
+    for date in ['2017-03-01T00:00:00', datetime.datetime(2017, 3, 1)]:
+        result = site.localSiderealTimeToDate(5., date=date)
+        assert isinstance(result, time.Time)
+        assert np.isclose(result.jd, expected, rtol=0, atol=1e-8)
+
+
+def test_lst_to_date_jd_fast_path():
+    site = Site()
+    jd = 2457813.5
+    expected = site.localSiderealTimeToDate([5., 6.], date=time.Time(jd, format='jd', scale='tai')).jd
+    for date, format in [(jd, None), (jd, 'jd'), (np.array(jd), None), (str(jd), 'jd')]:
+        result = site.localSiderealTimeToDate([5., 6.], date=date, format=format)
+        assert isinstance(result, np.ndarray)
+        assert np.allclose(result, expected, rtol=0, atol=1e-8)